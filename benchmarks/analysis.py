@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures the time taken to analyze a synthetic table for shadowed,
+duplicate and mergeable rules.
+
+    python -m benchmarks.analysis [count]
+"""
+
+import sys
+import time
+
+import netfilter.analysis
+import netfilter.parser
+from benchmarks.data import generate_dump
+from netfilter.snapshot import TableSnapshot
+
+def main(argv):
+    count = 50000
+    if len(argv) > 1:
+        count = int(argv[1])
+    snapshot = TableSnapshot('filter',
+        *netfilter.parser.parse_table(generate_dump(count)))
+    rules = {}
+    for chain in snapshot.list_chains():
+        rules[chain] = snapshot.list_rules(chain)
+
+    start = time.time()
+    findings = netfilter.analysis.analyze(rules)
+    elapsed = time.time() - start
+
+    kinds = {}
+    for finding in findings:
+        kinds[finding['kind']] = kinds.get(finding['kind'], 0) + 1
+    sys.stdout.write("%d rules analyzed in %.3fs\n" % (count, elapsed))
+    for kind in sorted(kinds):
+        sys.stdout.write("%s: %d\n" % (kind, kinds[kind]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
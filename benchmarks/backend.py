@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures how many rules per second the library layer appends through
+each execution mode of Table, against the in-memory FakeBackend.
+
+    python -m benchmarks.backend [count]
+"""
+
+import random
+import sys
+import time
+
+import netfilter.parser
+from benchmarks.data import chains, generate_rule
+from netfilter.backend import FakeBackend
+from netfilter.table import Table
+
+def generate_rules(count, seed=0):
+    rand = random.Random(seed)
+    return [ netfilter.parser.parse_rule(generate_rule(rand))
+        for i in range(count) ]
+
+def run(rules, **kwargs):
+    backend = FakeBackend()
+    table = Table('filter', backend=backend, **kwargs)
+    start = time.time()
+    for chain in chains:
+        table.create_chain(chain)
+    for rule in rules:
+        table.append_rule('INPUT', rule)
+    if table.auto_commit:
+        table.close()
+    else:
+        table.commit(restore=True)
+    elapsed = time.time() - start
+    if len(table.list_rules('INPUT')) != len(rules):
+        raise Exception('rules were lost')
+    return elapsed, len(backend.commands)
+
+def main(argv):
+    count = 5000
+    if len(argv) > 1:
+        count = int(argv[1])
+    rules = generate_rules(count)
+    for label, kwargs in [
+            ('per-command', {}),
+            ('restore', {'auto_commit': False}),
+            ('persistent', {'persistent': True})]:
+        elapsed, commands = run(rules, **kwargs)
+        sys.stdout.write("%-12s %.0f rules/s, %d commands\n" % (label,
+            count / elapsed, commands))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures the cost of a CounterMonitor poll on a large table, when every
+rule has to be parsed and when the ruleset did not change since the
+previous poll.
+
+    python -m benchmarks.counters [count]
+"""
+
+import sys
+import time
+
+import netfilter.parser
+from benchmarks.data import generate_dump
+from netfilter.counters import CounterMonitor
+from netfilter.snapshot import TableSnapshot
+
+def snapshot(data):
+    return TableSnapshot('filter', *netfilter.parser.parse_table(data))
+
+def main(argv):
+    count = 50000
+    if len(argv) > 1:
+        count = int(argv[1])
+    data = generate_dump(count)
+
+    start = time.time()
+    snapshot(data)
+    dump_time = time.time() - start
+
+    monitor = CounterMonitor(None)
+    start = time.time()
+    monitor.update(snapshot(data))
+    first_time = time.time() - start
+
+    start = time.time()
+    monitor.update(snapshot(data))
+    steady_time = time.time() - start
+
+    sys.stdout.write("%d rules\n" % count)
+    sys.stdout.write("split dump:       %.3fs\n" % dump_time)
+    sys.stdout.write("first poll:       %.3fs\n" % first_time)
+    sys.stdout.write("unchanged table:  %.3fs\n" % steady_time)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
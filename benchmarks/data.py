@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import random
+
+chains = ['firewall_input', 'firewall_forward', 'firewall_output']
+
+def generate_rule(rand):
+    """Returns a random rule spec, mixing the matches and targets which
+    are commonly found in real rulesets.
+    """
+    bits = []
+    kind = rand.randint(0, 9)
+    if rand.random() < 0.3:
+        bits.append('-i eth%d' % rand.randint(0, 3))
+    if rand.random() < 0.5:
+        bits.append('-s 10.%d.%d.%d/32' % (rand.randint(0, 255),
+            rand.randint(0, 255), rand.randint(0, 255)))
+    elif rand.random() < 0.2:
+        bits.append('! -s 192.168.%d.0/24' % rand.randint(0, 255))
+    if kind < 4:
+        bits.append('-p tcp -m tcp --dport %d' % rand.randint(1, 65535))
+    elif kind < 6:
+        ports = [ str(rand.randint(1, 65535)) for i in range(rand.randint(2, 6)) ]
+        bits.append('-p udp -m multiport --dports %s' % ','.join(ports))
+    elif kind < 7:
+        bits.append('-p tcp -m tcp --tcp-flags FIN,SYN,RST,ACK SYN')
+    elif kind < 8:
+        bits.append('-m state --state RELATED,ESTABLISHED')
+    elif kind < 9:
+        bits.append('-m conntrack ! --ctstate NEW')
+    else:
+        bits.append('-p icmp -m icmp --icmp-type 8')
+    if rand.random() < 0.1:
+        bits.append('-m comment --comment "rule %d"' % rand.randint(0, 1000))
+
+    target = rand.randint(0, 9)
+    if target < 5:
+        bits.append('-j ACCEPT')
+    elif target < 7:
+        bits.append('-j DROP')
+    elif target < 8:
+        bits.append('-j REJECT --reject-with icmp-port-unreachable')
+    elif target < 9:
+        bits.append('-j LOG --log-prefix "dropped: " --log-level 4')
+    else:
+        bits.append('-j %s' % rand.choice(chains))
+    return ' '.join(bits)
+
+def generate_dump(count, seed=0):
+    """Returns a synthetic iptables-save dump of the filter table
+    holding the given number of rules.
+    """
+    rand = random.Random(seed)
+    lines = [
+        '# Generated by iptables-save v1.6.0',
+        '*filter',
+        ':INPUT DROP [556:75796]',
+        ':FORWARD DROP [204:11510]',
+        ':OUTPUT ACCEPT [1884:214582]',
+    ]
+    for chain in chains:
+        lines.append(':%s - [0:0]' % chain)
+    all_chains = ['INPUT', 'FORWARD', 'OUTPUT'] + chains
+    for i in range(count):
+        lines.append('[%d:%d] -A %s %s' % (rand.randint(0, 10**6),
+            rand.randint(0, 10**9), rand.choice(all_chains),
+            generate_rule(rand)))
+    lines.append('COMMIT')
+    lines.append('# Completed')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures the expected number of rules evaluated per packet by a flat
+INPUT chain keyed on interface, protocol and port, and by the dispatch
+tree built from it.
+
+    python -m benchmarks.dispatch [count] [packets]
+"""
+
+import random
+import sys
+import time
+
+import netfilter.dispatch
+from netfilter.rule import Match, Rule
+from netfilter.simulator import Packet
+
+def generate_rules(count, seed=1):
+    rand = random.Random(seed)
+    rules = [
+        Rule(in_interface='lo', jump='ACCEPT'),
+        Rule(matches=[Match('state', '--state ESTABLISHED,RELATED')],
+            jump='ACCEPT'),
+    ]
+    for i in range(count):
+        protocol = rand.choice(['tcp', 'udp'])
+        rules.append(Rule(
+            in_interface='eth%d' % rand.randint(0, 3),
+            protocol=protocol,
+            source='10.%d.0.0/16' % rand.randint(0, 255),
+            matches=[Match(protocol, '--dport %d' % rand.randint(1, 65535))],
+            jump='ACCEPT'))
+    rules.append(Rule(protocol='icmp', jump='ACCEPT'))
+    rules.append(Rule(jump='LOG'))
+    return rules
+
+def generate_packets(count, seed=1):
+    rand = random.Random(seed)
+    return [ Packet(
+        in_interface='eth%d' % rand.randint(0, 4),
+        source='10.%d.1.1' % rand.randint(0, 255),
+        protocol=rand.choice(['tcp', 'udp', 'icmp']),
+        dport=rand.randint(1, 65535),
+        state='NEW') for i in range(count) ]
+
+def main(argv):
+    count = 10000
+    packet_count = 2000
+    if len(argv) > 1:
+        count = int(argv[1])
+    if len(argv) > 2:
+        packet_count = int(argv[2])
+    rules = generate_rules(count)
+    packets = generate_packets(packet_count)
+    policies = {'INPUT': 'DROP'}
+
+    start = time.time()
+    tree = netfilter.dispatch.build_tree('INPUT', rules)
+    elapsed = time.time() - start
+
+    before = netfilter.dispatch.expected_cost({'INPUT': rules}, 'INPUT',
+        packets, policies)
+    after = netfilter.dispatch.expected_cost(tree, 'INPUT', packets,
+        policies)
+    sys.stdout.write("%d rules split into %d chains in %.3fs\n" % (
+        count, len(tree), elapsed))
+    sys.stdout.write("flat: %.1f rules/packet\n" % before)
+    sys.stdout.write("tree: %.1f rules/packet\n" % after)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
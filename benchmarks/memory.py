@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures the memory held by parsed rules, with and without the parse
+cache (cached rules share their frozen options). As a baseline, the rules
+are also copied to plain objects laid out like Rule and Extension were
+before they gained __slots__, frozen options and interned names: one
+__dict__ each, options as a dictionary of lists and fresh strings.
+
+    python -m benchmarks.memory [count]
+"""
+
+import gc
+import sys
+import tracemalloc
+
+import netfilter.parser
+from benchmarks.data import generate_dump
+
+# the rewrite table each Extension used to refer to
+LEGACY_REWRITE = {}
+
+class LegacyObject(object):
+    pass
+
+def fresh(value):
+    # a copy of a string which is not shared with the other rules
+    if len(value) < 2:
+        return value
+    return value[:1] + value[1:]
+
+def legacy_extension(extension):
+    if extension is None:
+        return None
+    name, items = extension.key()
+    copy = LegacyObject()
+    copy.name = fresh(name)
+    copy.options = dict([ (fresh(opt), [ fresh(value) for value in values ])
+        for opt, values in items ])
+    copy.rewrite_options = LEGACY_REWRITE
+    return copy
+
+def legacy_rule(rule):
+    copy = LegacyObject()
+    for attr in ('protocol', 'destination', 'source', 'in_interface',
+                 'out_interface'):
+        value = getattr(rule, attr)
+        setattr(copy, attr, value and fresh(value))
+    copy.goto = legacy_extension(rule.goto)
+    copy.jump = legacy_extension(rule.jump)
+    copy.matches = [ legacy_extension(match) for match in rule.matches ]
+    copy.packets = rule.packets
+    copy.bytes = rule.bytes
+    return copy
+
+def measure(data, legacy=False):
+    """Returns the number of rules parsed from data and the number of
+    bytes they hold, or the number of bytes their legacy copies hold if
+    legacy is true.
+    """
+    chains, entries = netfilter.parser.parse_table(data)
+    specs = [ entry[2] for chain in entries for entry in entries[chain] ]
+    if legacy:
+        parsed = [ netfilter.parser.parse_rule(spec) for spec in specs ]
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        if legacy:
+            rules = [ legacy_rule(rule) for rule in parsed ]
+        else:
+            rules = [ netfilter.parser.parse_rule(spec) for spec in specs ]
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return len(rules), after - before
+
+def main(argv):
+    count = 100000
+    if len(argv) > 1:
+        count = int(argv[1])
+    data = generate_dump(count)
+    rules, size = measure(data, legacy=True)
+    sys.stdout.write("%d rules, legacy layout: %.1f MB, %d bytes per "
+        "rule\n" % (rules, size / 1048576.0, size // rules))
+    rules, size = measure(data)
+    sys.stdout.write("%d rules: %.1f MB, %d bytes per rule\n" % (
+        rules, size / 1048576.0, size // rules))
+
+    netfilter.parser.enable_cache(count)
+    try:
+        measure(data)
+        rules, size = measure(data)
+    finally:
+        netfilter.parser.disable_cache()
+    sys.stdout.write("with parse cache: %.1f MB, %d bytes per rule\n" % (
+        size / 1048576.0, size // rules))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
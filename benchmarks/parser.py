@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmark of netfilter.parser.parse_rule against the regex-based parser
+it replaced, which is kept here as a reference. Every rule of the
+synthetic dump must parse to the same result with both parsers.
+
+The parser is also timed with a warm parse cache, as for repeated polls
+of an unchanged table.
+
+    python -m benchmarks.parser [count]
+"""
+
+import gc
+import re
+import sys
+import time
+
+import netfilter.parser
+import netfilter.rule
+from benchmarks.data import generate_dump
+
+re_main_opt = re.compile(r'^-([^-])$')
+re_extension_opt = re.compile(r'^--(.*)$')
+
+def reference_extension(name, bits, rewrite_options):
+    options = {}
+    pos = 0
+    cur_opt = []
+    while pos < len(bits):
+        if bits[pos] == '!':
+            cur_opt.append(bits[pos])
+            pos += 1
+            continue
+        m = re_extension_opt.match(bits[pos])
+        if not m:
+            raise Exception("expected option, got: %s" % bits[pos])
+        pos += 1
+        tmp_opt = m.group(1)
+        if tmp_opt in rewrite_options:
+            tmp_opt = rewrite_options[tmp_opt]
+        cur_opt.append(tmp_opt)
+        vals = []
+        while pos < len(bits) and not re_extension_opt.match(bits[pos]):
+            vals.append(bits[pos])
+            pos += 1
+        options[' '.join(cur_opt)] = vals
+        cur_opt = []
+    return options
+
+def reference_parse_rule(spec):
+    """Parses a rule the way the former parser did."""
+    def pull_extension_opts(bits, pos):
+        opt_bits = []
+        while pos < len(bits) and not re_main_opt.match(bits[pos]):
+            opt_bits.append(bits[pos])
+            pos += 1
+        return opt_bits, pos
+
+    def pull_main_opt(bits, pos):
+        val = bits[pos]
+        pos += 1
+        if val == '!':
+            val += ' ' + bits[pos]
+            pos += 1
+        return val, pos
+
+    rule = netfilter.rule.Rule()
+    bits = netfilter.parser.split_words(spec)
+    pos = 0
+    while pos < len(bits):
+        if bits[pos] == '!' and pos < len(bits) - 1:
+            bits[pos] = bits[pos+1]
+            bits[pos+1] = '!'
+        bit = bits[pos]
+        pos += 1
+        if bit == '-d':
+            rule.destination, pos = pull_main_opt(bits, pos)
+        elif bit == '-i':
+            rule.in_interface, pos = pull_main_opt(bits, pos)
+        elif bit == '-g' or bit == '-j':
+            name = bits[pos]
+            opts, pos = pull_extension_opts(bits, pos + 1)
+            target = netfilter.rule.Target(name,
+                reference_extension(name, opts, {}))
+            if bit == '-g':
+                rule.goto = target
+            else:
+                rule.jump = target
+        elif bit == '-m':
+            name = bits[pos]
+            opts, pos = pull_extension_opts(bits, pos + 1)
+            rule.matches.append(netfilter.rule.Match(name,
+                reference_extension(name, opts,
+                    netfilter.rule.match_rewrite_options)))
+        elif bit == '-o':
+            rule.out_interface, pos = pull_main_opt(bits, pos)
+        elif bit == '-p':
+            rule.protocol, pos = pull_main_opt(bits, pos)
+        elif bit == '-s':
+            rule.source, pos = pull_main_opt(bits, pos)
+        else:
+            raise Exception("unhandled option '%s'" % bit)
+    return rule
+
+def specs(data):
+    chains, entries = netfilter.parser.parse_table(data)
+    for chain in entries:
+        for packets, bytes, spec in entries[chain]:
+            yield spec
+
+def timed(func, items, repeat=3):
+    """Returns the best time of several runs, and the results."""
+    best = None
+    for i in range(repeat):
+        results = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            results = [ func(item) for item in items ]
+            elapsed = time.time() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, results
+
+def main(argv):
+    count = 10000
+    if len(argv) > 1:
+        count = int(argv[1])
+    items = list(specs(generate_dump(count)))
+
+    ref_time, ref_rules = timed(reference_parse_rule, items)
+    new_time, rules = timed(netfilter.parser.parse_rule, items)
+    for spec, ref_rule, rule in zip(items, ref_rules, rules):
+        if rule != ref_rule or rule.specbits() != ref_rule.specbits():
+            sys.stderr.write("mismatch for rule: %s\n" % spec)
+            return 1
+
+    sys.stdout.write("%d rules, identical results\n" % len(items))
+    sys.stdout.write("reference parser: %.3fs (%.0f rules/s)\n" % (
+        ref_time, len(items) / ref_time))
+    sys.stdout.write("parse_rule:       %.3fs (%.0f rules/s)\n" % (
+        new_time, len(items) / new_time))
+
+    netfilter.parser.enable_cache(len(items))
+    try:
+        [ netfilter.parser.parse_rule(item) for item in items ]
+        cached_time, rules = timed(netfilter.parser.parse_rule, items)
+    finally:
+        netfilter.parser.disable_cache()
+    sys.stdout.write("cached (warm):    %.3fs (%.0f rules/s)\n" % (
+        cached_time, len(items) / cached_time))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures how many packets per second the Simulator evaluates against a
+synthetic table, with and without its indexes.
+
+    python -m benchmarks.simulator [count] [packets]
+"""
+
+import random
+import sys
+import time
+
+import netfilter.parser
+import netfilter.simulator
+from benchmarks.data import chains, generate_dump
+from netfilter.simulator import Packet, Simulator
+from netfilter.snapshot import TableSnapshot
+
+def load_rules(count):
+    snapshot = TableSnapshot('filter',
+        *netfilter.parser.parse_table(generate_dump(count)))
+    rules = {}
+    for chain in snapshot.list_chains():
+        # only let the built-in chains jump, to avoid loops
+        rules[chain] = [ rule for rule in snapshot.list_rules(chain)
+            if chain not in chains or rule.jump.name() not in chains ]
+    policies = {'INPUT': 'DROP', 'FORWARD': 'DROP', 'OUTPUT': 'ACCEPT'}
+    return rules, policies
+
+def generate_packets(count, seed=1):
+    rand = random.Random(seed)
+    packets = []
+    for i in range(count):
+        packets.append(Packet(
+            in_interface='eth%d' % rand.randint(0, 3),
+            source='10.%d.%d.%d' % (rand.randint(0, 255),
+                rand.randint(0, 255), rand.randint(0, 255)),
+            destination='192.168.0.1',
+            protocol=rand.choice(['tcp', 'udp', 'icmp']),
+            sport=rand.randint(1024, 65535),
+            dport=rand.randint(1, 65535),
+            state=rand.choice(['NEW', 'ESTABLISHED']),
+            tcp_flags=['SYN']))
+    return packets
+
+def run(simulator, packets):
+    start = time.time()
+    verdicts = [ simulator.evaluate('INPUT', packet)[0]
+        for packet in packets ]
+    return time.time() - start, verdicts
+
+def main(argv):
+    count = 30000
+    packet_count = 20000
+    if len(argv) > 1:
+        count = int(argv[1])
+    if len(argv) > 2:
+        packet_count = int(argv[2])
+    rules, policies = load_rules(count)
+    packets = generate_packets(packet_count)
+
+    start = time.time()
+    simulator = Simulator(rules, policies)
+    compile_time = time.time() - start
+    indexed_time, verdicts = run(simulator, packets)
+
+    # evaluate every rule in turn, as the kernel does
+    compiled = netfilter.simulator.CompiledChain
+    candidates = compiled.candidates
+    compiled.candidates = lambda self, packet: (1 << len(self.rules)) - 1
+    try:
+        linear_time, linear_verdicts = run(simulator,
+            packets[:max(1, packet_count // 20)])
+    finally:
+        compiled.candidates = candidates
+    if linear_verdicts != verdicts[:len(linear_verdicts)]:
+        sys.stderr.write("indexed and linear verdicts differ\n")
+        return 1
+
+    sys.stdout.write("%d rules compiled in %.3fs\n" % (count, compile_time))
+    sys.stdout.write("indexed: %.0f packets/s\n" % (
+        len(packets) / indexed_time))
+    sys.stdout.write("linear:  %.0f packets/s\n" % (
+        len(linear_verdicts) / linear_time))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
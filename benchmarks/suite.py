@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Runs the parse, render, diff and commit benchmarks against synthetic
+tables of several sizes, recording the best time and the peak memory of
+each case. Results can be saved as a baseline and later runs compared
+against it, failing if a case got slower or bigger than the tolerance.
+
+    python -m benchmarks.suite [--sizes 1000,10000,100000]
+        [--save baseline.json] [--compare baseline.json] [--tolerance 0.25]
+
+Commits go through a FakeBackend, so no root access is needed. Times
+depend on the machine, so baselines should be recorded on the machine
+which compares against them; benchmarks/baseline.json is a reference run
+of the default sizes.
+"""
+
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import netfilter.parser
+import netfilter.table
+from benchmarks.data import generate_dump
+from netfilter.backend import FakeBackend
+from netfilter.rule import Match
+from netfilter.snapshot import TableSnapshot
+from netfilter.table import Table
+
+SIZES = [1000, 10000, 100000]
+
+# differences below these are noise rather than regressions
+MIN_SECONDS = 0.005
+MIN_PEAK = 65536
+
+def load(data):
+    return TableSnapshot('filter', *netfilter.parser.parse_table(data))
+
+def desired_rules(snapshot, seed=0):
+    # change about 1% of the rules of each chain
+    rand = random.Random(seed)
+    desired = {}
+    for chain in snapshot.list_chains():
+        rules = snapshot.list_rules(chain)
+        for i in range(len(rules) // 100):
+            position = rand.randrange(len(rules))
+            if rand.random() < 0.5:
+                del rules[position]
+            else:
+                rules.insert(position, rules[rand.randrange(len(rules))])
+        desired[chain] = rules
+    return desired
+
+def prepare(count):
+    """Returns the cases for a table of the given size, as a list of
+    (name, setup, function) tuples. setup is called before each run and
+    its result is passed to function, which is the part measured.
+    """
+    data = generate_dump(count)
+    snapshot = load(data)
+    chains = list(snapshot.list_chains())
+    specs = [ spec for chain in chains
+        for packets, bytes, spec in snapshot.list_entries(chain) ]
+    options = []
+    for spec in specs:
+        bits = netfilter.parser.split_words(spec)
+        if '-m' in bits:
+            pos = bits.index('-m')
+            opts, end = netfilter.parser.pull_extension_opts(bits, pos + 2)
+            options.append((bits[pos + 1],
+                netfilter.parser.join_words(opts)))
+
+    # Rules cache their rendering, so each run is given fresh ones
+    def parse_rules():
+        return [ netfilter.parser.parse_rule(spec) for spec in specs ]
+
+    def chain_rules():
+        rules = {}
+        for chain in chains:
+            rules[chain] = [ netfilter.parser.parse_rule(spec)
+                for packets, bytes, spec in snapshot.list_entries(chain) ]
+        return rules
+
+    def commit(rules):
+        table = Table('filter', auto_commit=False, backend=FakeBackend())
+        for chain in chains:
+            if snapshot.get_policy(chain) is None:
+                table.create_chain(chain)
+        for chain in chains:
+            for rule in rules[chain]:
+                table.append_rule(chain, rule)
+        table.commit(restore=True)
+
+    return [
+        ('parse_table', lambda: data, netfilter.parser.parse_table),
+        ('parse_rule', lambda: None, lambda arg: parse_rules()),
+        ('extension_options', lambda: options, lambda options: [
+            Match(name, opts) for name, opts in options ]),
+        ('specbits', parse_rules, lambda rules: [ rule.specbits()
+            for rule in rules ]),
+        ('format_rules', chain_rules, lambda rules: [
+            netfilter.parser.format_rules(chain, rules[chain], True)
+            for chain in chains ]),
+        ('diff', lambda: (load(data), desired_rules(load(data))),
+            lambda args: netfilter.table.diff_table(*args)),
+        ('commit', chain_rules, commit),
+    ]
+
+def measure(setup, func, repeat):
+    """Returns the best time of several runs of func, and its peak memory
+    allocation in bytes.
+    """
+    best = None
+    for i in range(repeat):
+        arg = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func(arg)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+
+    arg = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def run(sizes, repeat, out=sys.stdout):
+    """Runs every case for each table size, returning a dictionary
+    mapping 'case/size' to dictionaries with 'seconds' and 'peak' keys.
+    """
+    results = {}
+    for count in sizes:
+        for name, setup, func in prepare(count):
+            seconds, peak = measure(setup, func, repeat)
+            key = '%s/%d' % (name, count)
+            results[key] = {'seconds': seconds, 'peak': peak}
+            out.write("%-26s %9.4fs %9.1f MB\n" % (key, seconds,
+                peak / 1048576.0))
+            out.flush()
+    return results
+
+def compare(results, baseline, tolerance):
+    """Returns a list of messages describing the cases which are slower
+    or use more memory than in the baseline, beyond the tolerance and
+    beyond noise.
+    """
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        for metric, minimum in (('seconds', MIN_SECONDS),
+                                ('peak', MIN_PEAK)):
+            old = baseline[key][metric]
+            new = results[key][metric]
+            if old and new > old * (1 + tolerance) and \
+               new - old > minimum:
+                regressions.append("%s %s: %s -> %s (+%.0f%%)" % (key,
+                    metric, old, new, (new - old) * 100.0 / old))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+        help='comma-separated table sizes')
+    parser.add_argument('--repeat', type=int, default=5,
+        help='runs of each case, the best time is kept')
+    parser.add_argument('--save', help='write the results to a JSON file')
+    parser.add_argument('--compare',
+        help='compare the results with a JSON file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='relative increase reported as a regression')
+    args = parser.parse_args(argv[1:])
+
+    results = run([ int(size) for size in args.sizes.split(',') ],
+        args.repeat)
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            sys.stderr.write("regression: %s\n" % message)
+        if regressions:
+            return 1
+        sys.stdout.write("no regressions against %s\n" % args.compare)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
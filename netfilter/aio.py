@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# asyncio counterpart of netfilter.table, requires Python 3.5 or later
+
+import asyncio
+
+import netfilter.capabilities
+import netfilter.instrument
+import netfilter.parser
+import netfilter.table
+from netfilter.snapshot import TableSnapshot
+
+
+class BufferBackend:
+    """The BufferBackend class is the backend of the Table which builds
+    the commands of an AsyncTable. It never runs anything, the
+    capabilities are probed beforehand by AsyncTable.capabilities().
+    """
+    def __init__(self):
+        self.caps = None
+
+    def capabilities(self, binary, run):
+        return self.caps
+
+class AsyncTable:
+    """The AsyncTable class mirrors Table for use with asyncio: iptables,
+    iptables-save and iptables-restore are run as asyncio subprocesses,
+    so many tables can be queried and updated concurrently from a
+    single event loop.
+
+    Commands are always run as subprocesses, there is no pluggable
+    backend, but they are reported to netfilter.instrument like the
+    commands run by Table.
+    """
+
+    def __init__(self, name, auto_commit = True, ipv6 = False, netns = None):
+        """Constructs a new AsyncTable, see Table.__init__().
+        """
+        self.auto_commit = auto_commit
+        self.netns = netns
+        self.__name = name
+        # commands are built by a buffered Table
+        self.__backend = BufferBackend()
+        self.__table = netfilter.table.Table(name, auto_commit=False,
+            ipv6=ipv6, netns=netns, backend=self.__backend)
+        if ipv6:
+            self.__iptables = 'ip6tables'
+            self.__iptables_restore = 'ip6tables-restore'
+            self.__iptables_save = 'ip6tables-save'
+        else:
+            self.__iptables = 'iptables'
+            self.__iptables_restore = 'iptables-restore'
+            self.__iptables_save = 'iptables-save'
+
+    async def capabilities(self):
+        """Returns the Capabilities of the iptables binary used by the
+        table, probing it with an asyncio subprocess unless they are
+        already known, see netfilter.capabilities.detect().
+        """
+        caps = self.__backend.caps
+        if caps is None:
+            caps = netfilter.capabilities.lookup(self.__iptables)
+            if caps is None:
+                try:
+                    output = await self.__run([self.__iptables, '--version'])
+                except Exception:
+                    output = ''
+                caps = netfilter.capabilities.detect(self.__iptables,
+                    lambda cmd: output)
+            self.__backend.caps = caps
+        return caps
+
+    async def create_chain(self, chainname):
+        """Creates the specified user-defined chain.
+        """
+        await self.capabilities()
+        self.__table.create_chain(chainname)
+        await self.__run_last()
+
+    async def delete_chain(self, chainname=None):
+        """Attempts to delete the specified user-defined chain (all the
+        chains in the table if none is given).
+        """
+        await self.capabilities()
+        self.__table.delete_chain(chainname)
+        await self.__run_last()
+
+    async def execute(self, args):
+        """Runs iptables against the table with the given list of
+        arguments, or buffers the command if auto_commit is false.
+        """
+        await self.capabilities()
+        self.__table.execute(args)
+        await self.__run_last()
+
+    async def flush_chain(self, chainname=None):
+        """Flushes the specified chain (all the chains in the table if
+        none is given).
+        """
+        await self.capabilities()
+        self.__table.flush_chain(chainname)
+        await self.__run_last()
+
+    async def list_chains(self):
+        """Returns a list of strings representing the chains in the
+        Table.
+        """
+        return (await self.snapshot()).list_chains()
+
+    async def rename_chain(self, old_chain_name, new_chain_name):
+        """Renames the specified user-defined chain.
+        """
+        await self.capabilities()
+        self.__table.rename_chain(old_chain_name, new_chain_name)
+        await self.__run_last()
+
+    async def get_policy(self, chainname):
+        """Gets the policy for the specified built-in chain.
+        """
+        return (await self.snapshot()).get_policy(chainname)
+
+    async def set_policy(self, chainname, policy):
+        """Sets the policy for the specified built-in chain.
+        """
+        await self.capabilities()
+        self.__table.set_policy(chainname, policy)
+        await self.__run_last()
+
+    async def append_rule(self, chainname, rule):
+        """Appends a Rule to the specified chain.
+        """
+        await self.capabilities()
+        self.__table.append_rule(chainname, rule)
+        await self.__run_last()
+
+    async def delete_rule(self, chainname, rule):
+        """Deletes a Rule from the specified chain.
+        """
+        await self.capabilities()
+        self.__table.delete_rule(chainname, rule)
+        await self.__run_last()
+
+    async def prepend_rule(self, chainname, rule):
+        """Prepends a Rule to the specified chain.
+        """
+        await self.capabilities()
+        self.__table.prepend_rule(chainname, rule)
+        await self.__run_last()
+
+    async def list_rules(self, chainname):
+        """Returns a list of Rules in the specified chain.
+        """
+        return (await self.snapshot()).list_rules(chainname)
+
+    async def dump(self, all_tables=False):
+        """Returns the output of iptables-save, including counters, for
+        the current table or for all the tables if all_tables is true.
+        """
+        cmd = netfilter.table.netns_prefix(self.netns) + \
+            [self.__iptables_save, '-c']
+        if not all_tables:
+            cmd[-1:-1] = ['-t', self.__name]
+        return await self.__run(cmd)
+
+    async def snapshot(self):
+        """Returns a TableSnapshot of the table's contents.
+        """
+        data = await self.dump()
+        return TableSnapshot(self.__name,
+            *netfilter.parser.parse_table(data))
+
+    async def diff(self, desired, policies=None):
+        """Returns the list of iptables arguments which bring the table
+        from its current state to the desired one, see Table.diff().
+        """
+        return netfilter.table.diff_table(await self.snapshot(), desired,
+            policies)
+
+    async def sync(self, desired, policies=None):
+        """Brings the table to the desired state, see Table.sync().
+        """
+        commands = await self.diff(desired, policies)
+        if self.auto_commit:
+            await self.restore(netfilter.table.restore_payload(
+                self.__name, commands))
+        else:
+            await self.capabilities()
+            for args in commands:
+                self.__table.execute(args)
+        return commands
+
+    async def commit(self, restore=False):
+        """Commits any buffered commands, see Table.commit().
+        """
+        if restore:
+            await self.restore(self.__table.get_restore_payload())
+            self.__table.clear_buffer()
+        else:
+            buffer = self.__table.get_buffer()
+            while len(buffer) > 0:
+                await self.__run(buffer.pop(0))
+
+    async def restore(self, payload, flush=False, counters=False):
+        """Feeds an iptables-restore document to iptables-restore, see
+        Table.restore().
+        """
+        if payload:
+            caps = await self.capabilities()
+            await self.__run(netfilter.table.netns_prefix(self.netns) +
+                [self.__iptables_restore] + caps.restore_wait_option() +
+                netfilter.table.restore_options(flush, counters), payload)
+
+    def clear_buffer(self):
+        """Discards any buffered commands.
+        """
+        self.__table.clear_buffer()
+
+    def get_buffer(self):
+        """Returns the command buffer. This is only useful if
+        auto_commit is False.
+        """
+        return self.__table.get_buffer()
+
+    def get_restore_payload(self):
+        """Returns the command buffer as an iptables-restore document.
+        """
+        return self.__table.get_restore_payload()
+
+    async def __run_last(self):
+        # take the command out of the buffer before yielding to the loop
+        if self.auto_commit:
+            await self.__run(self.__table.get_buffer().pop())
+
+    async def __run(self, cmd, input=None):
+        if not netfilter.instrument.sinks:
+            return await self.__exec(cmd, input)
+        event = netfilter.instrument.command_event(cmd, self.__name,
+            self.netns)
+        start = netfilter.instrument.clock()
+        try:
+            output = await self.__exec(cmd, input)
+        except Exception as e:
+            event['status'] = getattr(e, 'status', None)
+            raise
+        else:
+            event['bytes'] = len(output)
+        finally:
+            event['seconds'] = netfilter.instrument.clock() - start
+            netfilter.instrument.emit(event)
+        return output
+
+    async def __exec(self, cmd, input=None):
+        if input is not None:
+            stdin = asyncio.subprocess.PIPE
+            input = input.encode('utf8')
+        else:
+            stdin = None
+        p = await asyncio.create_subprocess_exec(*cmd,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        out, err = await p.communicate(input)
+        netfilter.table.check_status(cmd, p.returncode, err.decode('utf8'))
+        return out.decode('utf8')
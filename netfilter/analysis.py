@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import itertools
+import socket
+import struct
+
+from netfilter.simulator import Index, PrefixIndex, normalize_protocol, \
+    parse_network, parse_ports, terminating_targets
+
+# multiport accepts at most 15 ports
+MAX_MULTIPORT = 15
+
+# number of leaves of the segment tree used to index port ranges
+PORT_COUNT = 65536
+
+# rules with more unrecognised match options than this are compared with
+# every set of options instead of looking up each subset
+MAX_SUBSET_ITEMS = 8
+
+class Criteria:
+    """The Criteria class is the normalised form of what a Rule matches,
+    as used by the analysis. Ports and connection states are pulled out
+    of the matches which carry them, comments are ignored and any other
+    match option is kept as an opaque (match, option, values) item.
+    """
+    def __init__(self, rule):
+        self.protocol = None
+        self.in_interface = rule.in_interface
+        self.out_interface = rule.out_interface
+        self.source = rule.source
+        self.destination = rule.destination
+        self.sport = None
+        self.dport = None
+        self.state = None
+        others = []
+
+        if rule.protocol and rule.protocol.lower() != 'all':
+            self.protocol = normalize_protocol(rule.protocol)
+        for match in rule.matches:
+            name, items = match.key()
+            if name == 'comment':
+                continue
+            for opt, vals in items:
+                if name in ('tcp', 'udp', 'multiport') and \
+                   opt in ('sport', 'sports', 'dport', 'dports'):
+                    attr = opt[0] == 's' and 'sport' or 'dport'
+                    if getattr(self, attr) is None:
+                        ranges = []
+                        for val in vals:
+                            ranges.extend(parse_ports(val))
+                        setattr(self, attr, tuple(sorted(set(ranges))))
+                        continue
+                elif (name, opt) in (('state', 'state'),
+                                     ('conntrack', 'ctstate')):
+                    if self.state is None:
+                        states = set()
+                        for val in vals:
+                            states.update(val.split(','))
+                        self.state = frozenset(states)
+                        continue
+                others.append((name, opt, vals))
+        self.others = frozenset(others)
+
+        target = rule.goto or rule.jump
+        self.target = target and target.key()
+        if rule.goto is not None:
+            self.terminating = True
+        elif rule.jump is not None:
+            name = rule.jump.name()
+            self.terminating = name == 'RETURN' or \
+                name in terminating_targets
+        else:
+            self.terminating = False
+
+    def key(self, skip=None):
+        """Returns a hashable representation of the criteria and target,
+        leaving out the skip attribute if it is given.
+        """
+        values = []
+        for attr in ('protocol', 'in_interface', 'out_interface', 'source',
+                     'destination', 'sport', 'dport', 'state', 'others',
+                     'target'):
+            if attr != skip:
+                values.append(getattr(self, attr))
+        return tuple(values)
+
+class InterfaceIndex:
+    # interface names, where 'eth+' contains every name starting with 'eth'
+    def __init__(self):
+        self.exact = Index()
+        self.patterns = {}
+
+    def add(self, position, value):
+        if value is not None and value.endswith('+'):
+            bit = 1 << position
+            prefix = value[:-1]
+            self.patterns[prefix] = self.patterns.get(prefix, 0) | bit
+        else:
+            self.exact.add(position, value is not None and [value] or None)
+
+    def containing(self, value):
+        mask = self.exact.lookup(value)
+        if value is not None and value[:1] != '!':
+            for prefix in self.patterns:
+                if value.startswith(prefix):
+                    mask |= self.patterns[prefix]
+        return mask
+
+class NetworkIndex:
+    # networks, where a network contains all of its subnets
+    def __init__(self):
+        self.prefixes = PrefixIndex()
+        self.negated = Index()
+
+    def add(self, position, value):
+        if value is None:
+            self.prefixes.add(position, None)
+        elif value[:1] == '!':
+            self.negated.add(position, [value])
+        else:
+            self.prefixes.add(position, parse_network(value))
+
+    def containing(self, value):
+        if value is None:
+            return self.prefixes.any
+        if value[:1] == '!':
+            return self.prefixes.any | self.negated.values.get(value, 0)
+        bits, network, length = parse_network(value)
+        return self.prefixes.lookup((bits, network), length)
+
+class PortIndex:
+    # port ranges, where a range contains all of its subranges. Each range
+    # is stored in the nodes of a segment tree over the port numbers which
+    # cover it, so the ranges containing a port lie on the path from its
+    # leaf to the root.
+    def __init__(self):
+        self.any = 0
+        self.nodes = {}
+
+    def add(self, position, ranges):
+        bit = 1 << position
+        if ranges is None:
+            self.any |= bit
+            return
+        for first, last in ranges:
+            low = first + PORT_COUNT
+            high = last + PORT_COUNT + 1
+            while low < high:
+                if low & 1:
+                    self.__add(low, last, bit)
+                    low += 1
+                if high & 1:
+                    high -= 1
+                    self.__add(high, last, bit)
+                low >>= 1
+                high >>= 1
+
+    def __add(self, node, last, bit):
+        ends = self.nodes.setdefault(node, {})
+        ends[last] = ends.get(last, 0) | bit
+
+    def containing(self, ranges):
+        if ranges is None:
+            return self.any
+        # every range must be contained in one of the rule's ranges
+        mask = -1
+        for first, last in ranges:
+            covered = self.any
+            node = first + PORT_COUNT
+            while node:
+                ends = self.nodes.get(node)
+                if ends:
+                    for other_last in ends:
+                        if last <= other_last:
+                            covered |= ends[other_last]
+                node >>= 1
+            mask &= covered
+        return mask
+
+class SetIndex:
+    # sets of values, where a set contains all of its subsets
+    def __init__(self):
+        self.sets = {}
+        self.items = {}
+
+    def add(self, position, values):
+        bit = 1 << position
+        key = values or frozenset()
+        self.sets[key] = self.sets.get(key, 0) | bit
+        for item in key:
+            self.items[item] = self.items.get(item, 0) | bit
+
+    def containing(self, values, superset=False):
+        # when superset is true, the rules must match all of the values,
+        # otherwise the rules' values must be a subset of the given ones
+        empty = self.sets.get(frozenset(), 0)
+        if superset:
+            if values is None:
+                return empty
+            mask = -1
+            for item in values:
+                mask &= self.items.get(item, 0)
+            return empty | mask
+        values = values or frozenset()
+        mask = empty
+        if len(values) > MAX_SUBSET_ITEMS:
+            for key in self.sets:
+                if key <= values:
+                    mask |= self.sets[key]
+            return mask
+        # look up each subset of the values
+        values = list(values)
+        for count in range(1, len(values) + 1):
+            for items in itertools.combinations(values, count):
+                mask |= self.sets.get(frozenset(items), 0)
+        return mask
+
+class ChainAnalyzer:
+    """The ChainAnalyzer class indexes the rules of a chain by what they
+    match, so that the earlier rules which contain a given rule can be
+    found with a few lookups instead of comparing every pair of rules.
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        self.criteria = [ Criteria(rule) for rule in rules ]
+        self.terminating = 0
+        self.protocols = Index()
+        self.in_interfaces = InterfaceIndex()
+        self.out_interfaces = InterfaceIndex()
+        self.sources = NetworkIndex()
+        self.destinations = NetworkIndex()
+        self.sports = PortIndex()
+        self.dports = PortIndex()
+        self.states = SetIndex()
+        self.others = SetIndex()
+        for position, criteria in enumerate(self.criteria):
+            if criteria.terminating:
+                self.terminating |= 1 << position
+            self.protocols.add(position,
+                criteria.protocol and [criteria.protocol])
+            self.in_interfaces.add(position, criteria.in_interface)
+            self.out_interfaces.add(position, criteria.out_interface)
+            self.sources.add(position, criteria.source)
+            self.destinations.add(position, criteria.destination)
+            self.sports.add(position, criteria.sport)
+            self.dports.add(position, criteria.dport)
+            self.states.add(position, criteria.state)
+            self.others.add(position, criteria.others)
+
+    def containing(self, position):
+        """Returns the bitmask of the rules which match every packet the
+        rule at the given position matches.
+        """
+        criteria = self.criteria[position]
+        return self.protocols.lookup(criteria.protocol) & \
+            self.in_interfaces.containing(criteria.in_interface) & \
+            self.out_interfaces.containing(criteria.out_interface) & \
+            self.sources.containing(criteria.source) & \
+            self.destinations.containing(criteria.destination) & \
+            self.sports.containing(criteria.sport) & \
+            self.dports.containing(criteria.dport) & \
+            self.states.containing(criteria.state, True) & \
+            self.others.containing(criteria.others)
+
+    def shadowing(self, position):
+        """Returns the position of the first earlier rule which stops
+        every packet the rule at the given position matches, or None.
+        """
+        mask = self.containing(position) & self.terminating & \
+            ((1 << position) - 1)
+        if not mask:
+            return None
+        return (mask & -mask).bit_length() - 1
+
+def merge_ports(first, second, overlap=True):
+    # coalesce overlapping and contiguous ranges, refusing to merge
+    # overlapping ones unless overlap is true
+    ports = []
+    for port_first, port_last in sorted(set(first) | set(second)):
+        if ports and port_first <= ports[-1][1] + 1:
+            if port_first <= ports[-1][1] and not overlap:
+                return None
+            ports[-1] = (ports[-1][0], max(ports[-1][1], port_last))
+        else:
+            ports.append((port_first, port_last))
+    count = 0
+    for port_first, port_last in ports:
+        count += port_first == port_last and 1 or 2
+    if count > MAX_MULTIPORT:
+        return None
+    return ','.join([ first == last and str(first) or '%d:%d' % (first, last)
+        for first, last in ports ])
+
+def merge_networks(first, second):
+    if first is None or second is None or first[:1] == '!' or \
+       second[:1] == '!':
+        return None
+    bits, network1, length1 = parse_network(first)
+    bits2, network2, length2 = parse_network(second)
+    if bits != bits2 or length1 != length2 or length1 == 0:
+        return None
+    parent = length1 - 1
+    shift = bits - parent
+    if network1 >> shift != network2 >> shift or network1 == network2:
+        return None
+    network = (network1 >> shift) << shift
+    if bits == 32:
+        address = socket.inet_ntoa(struct.pack('!I', network))
+    else:
+        address = socket.inet_ntop(socket.AF_INET6, struct.pack('!QQ',
+            network >> 64, network & ((1 << 64) - 1)))
+    return '%s/%d' % (address, parent)
+
+def analyze_chain(chainname, rules):
+    """Analyzes the list of Rules of a chain and returns a list of
+    findings, as dictionaries with the following keys:
+
+      'kind': 'duplicate' if the rule is identical to an earlier one,
+        'shadowed' if an earlier rule stops every packet it matches,
+        'mergeable' if it could be merged with the previous rule
+      'chain': the name of the chain
+      'rule': the rule number, starting at 1
+      'by': the number of the earlier rule
+      'field': for mergeable rules, the field which differs ('dport',
+        'source' or 'destination')
+      'value': for mergeable rules, the merged value of the field
+
+    Rules using match options which are not understood are only
+    compared by equality of those options, so the analysis may miss
+    some findings but does not report false ones.
+    """
+    analyzer = ChainAnalyzer(list(rules))
+    criteria = analyzer.criteria
+    findings = []
+    seen = {}
+    for position in range(len(criteria)):
+        key = criteria[position].key()
+        if key in seen:
+            findings.append({'kind': 'duplicate', 'chain': chainname,
+                'rule': position + 1, 'by': seen[key] + 1})
+            continue
+        seen[key] = position
+        shadowing = analyzer.shadowing(position)
+        if shadowing is not None:
+            findings.append({'kind': 'shadowed', 'chain': chainname,
+                'rule': position + 1, 'by': shadowing + 1})
+            continue
+
+        if position == 0:
+            continue
+        previous, current = criteria[position - 1], criteria[position]
+        for field in ('dport', 'source', 'destination'):
+            if previous.key(field) != current.key(field):
+                continue
+            if field == 'dport':
+                if previous.dport is None or current.dport is None:
+                    continue
+                # a packet must not hit a non-terminating target twice
+                value = merge_ports(previous.dport, current.dport,
+                    current.terminating)
+            else:
+                value = merge_networks(getattr(previous, field),
+                    getattr(current, field))
+            if value is not None:
+                findings.append({'kind': 'mergeable', 'chain': chainname,
+                    'rule': position + 1, 'by': position, 'field': field,
+                    'value': value})
+            break
+    return findings
+
+def analyze(rules):
+    """Analyzes a dictionary mapping chain names to lists of Rules, see
+    analyze_chain().
+    """
+    findings = []
+    for chainname in rules:
+        findings.extend(analyze_chain(chainname, rules[chainname]))
+    return findings
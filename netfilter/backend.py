@@ -0,0 +1,555 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Backends run the commands built by Table. ProcessBackend runs them as
+subprocesses, FakeBackend applies them to tables held in memory, which
+makes it possible to test and benchmark code using Table without root.
+"""
+
+import fcntl
+import os
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+
+import netfilter.capabilities
+import netfilter.instrument
+import netfilter.parser
+import netfilter.table
+import netfilter.worker
+from netfilter.rule import Target
+from netfilter.snapshot import TableSnapshot
+
+# the lock taken by iptables, iptables-restore and iptables-save
+XTABLES_LOCK = '/run/xtables.lock'
+
+# interval at which wait_lock() checks the xtables lock, in seconds
+LOCK_POLL = 0.01
+
+class ProcessBackend:
+    """The ProcessBackend class runs iptables, iptables-save and
+    iptables-restore as subprocesses.
+
+    If lock_probe is set, commands using --wait which are reported to
+    netfilter.instrument first poll the xtables lock for up to lock_probe
+    seconds to measure how long they would wait for it, see wait_lock().
+    """
+    def __init__(self, lock_probe=None):
+        self.lock_probe = lock_probe
+
+    def capabilities(self, binary, run):
+        """Returns the Capabilities of an iptables binary, probing it with
+        the run function once per process, see netfilter.capabilities.
+        """
+        return netfilter.capabilities.detect(binary, run)
+
+    def run(self, cmd, input=None):
+        """Runs a command, feeding it the given input if any, and returns
+        its output. Raises an IptablesError if the command fails.
+        """
+        if input is not None:
+            stdin = subprocess.PIPE
+            input = input.encode('utf8')
+        else:
+            stdin = None
+        p = subprocess.Popen(cmd,
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            close_fds=True)
+        out, err = p.communicate(input)
+        out = out.decode('utf8')
+        err = err.decode('utf8')
+        status = p.wait()
+        netfilter.table.check_status(cmd, status, err)
+        return out
+
+    def stream(self, cmd):
+        """Runs a command and yields the lines of its output as they are
+        read. Raises an IptablesError if the command fails.
+        """
+        # stderr goes to a file so that it cannot fill up and block
+        # the process while we are reading its output
+        errfile = tempfile.TemporaryFile()
+        p = subprocess.Popen(cmd,
+            stdout=subprocess.PIPE,
+            stderr=errfile,
+            close_fds=True)
+        try:
+            for line in p.stdout:
+                yield line
+        finally:
+            p.stdout.close()
+            status = p.wait()
+            errfile.seek(0)
+            err = errfile.read().decode('utf8')
+            errfile.close()
+        # check exit status
+        if status:
+            raise netfilter.table.IptablesError(cmd, err, status)
+
+    def wait_lock(self):
+        """Polls the xtables lock until no process holds it and returns the
+        time spent waiting in seconds. Returns None if lock_probe is not
+        set, if the lock file cannot be opened or if the lock is still
+        held after lock_probe seconds. The lock is never waited for, it
+        is up to the command to take it for real.
+        """
+        if self.lock_probe is None:
+            return None
+        path = os.environ.get('XTABLES_LOCKFILE', XTABLES_LOCK)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            start = netfilter.instrument.clock()
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    elapsed = netfilter.instrument.clock() - start
+                    if elapsed >= self.lock_probe:
+                        return None
+                    time.sleep(LOCK_POLL)
+                else:
+                    return netfilter.instrument.clock() - start
+        finally:
+            os.close(fd)
+
+    def worker(self, command):
+        """Returns a worker which streams transactions to a persistent
+        iptables-restore process, see netfilter.worker.RestoreWorker.
+        """
+        return netfilter.worker.RestoreWorker(command)
+
+# built-in chains of each table
+builtin_chains = {
+    'filter': ['INPUT', 'FORWARD', 'OUTPUT'],
+    'nat': ['PREROUTING', 'INPUT', 'OUTPUT', 'POSTROUTING'],
+    'mangle': ['PREROUTING', 'INPUT', 'FORWARD', 'OUTPUT', 'POSTROUTING'],
+    'raw': ['PREROUTING', 'OUTPUT'],
+    'security': ['INPUT', 'FORWARD', 'OUTPUT'],
+}
+
+class FakeError(Exception):
+    pass
+
+class FakeTable:
+    """The FakeTable class holds the chains and rules of a table for a
+    FakeBackend, and applies iptables commands to them.
+    """
+    def __init__(self, name):
+        if name not in builtin_chains:
+            raise FakeError("can't initialize %s table: Table does not "
+                "exist" % name)
+        self.name = name
+        self.chains = OrderedDict()
+        self.rules = {}
+        for chainname in builtin_chains[name]:
+            self.chains[chainname] = 'ACCEPT'
+            self.rules[chainname] = []
+
+    def copy(self):
+        table = FakeTable(self.name)
+        table.chains = OrderedDict()
+        for chainname in self.chains.keys():
+            table.chains[chainname] = self.chains[chainname]
+            table.rules[chainname] = list(self.rules[chainname])
+        return table
+
+    def snapshot(self):
+        """Returns the contents of the table as a TableSnapshot.
+        """
+        chains = netfilter.parser.odict()
+        entries = {}
+        for chainname in self.chains.keys():
+            chains[chainname] = {
+                'policy': self.chains[chainname],
+                'packets': 0,
+                'bytes': 0,
+            }
+            entries[chainname] = [ (rule.packets, rule.bytes, rule.spec())
+                for rule in self.rules[chainname] ]
+        return TableSnapshot(self.name, chains, entries)
+
+    def execute(self, args, packets=0, bytes=0):
+        """Applies the iptables arguments to the table. Raises a FakeError
+        with the message iptables would print if they are invalid.
+        """
+        if not args:
+            raise FakeError("no command specified")
+        command = args[0]
+        if command in ('-A', '-I', '-R', '-D'):
+            chainname = self.__chain(args, user=False)
+            rules = self.rules[chainname]
+            spec = args[2:]
+            number = None
+            if spec and spec[0].isdigit():
+                number = int(spec[0])
+                spec = spec[1:]
+            if command == '-D':
+                self.__delete(rules, number, spec)
+                return
+            rule = netfilter.parser.parse_rule(
+                netfilter.parser.join_words(spec))
+            rule.packets = packets
+            rule.bytes = bytes
+            self.__check_target(rule)
+            if command == '-A':
+                rules.append(rule)
+            elif command == '-I':
+                number = number or 1
+                if number > len(rules) + 1:
+                    raise FakeError("Index of insertion too big.")
+                rules.insert(number - 1, rule)
+            else:
+                if number is None or not 0 < number <= len(rules):
+                    raise FakeError("Index of replacement too big.")
+                rules[number - 1] = rule
+        elif command == '-N':
+            if len(args) != 2:
+                raise FakeError("-N requires a chain name")
+            if args[1] in self.chains:
+                raise FakeError("Chain already exists.")
+            self.chains[args[1]] = None
+            self.rules[args[1]] = []
+        elif command == '-X':
+            if len(args) > 1:
+                chainnames = [self.__chain(args, user=True)]
+            else:
+                chainnames = [ chainname for chainname in self.chains.keys()
+                    if self.chains[chainname] is None ]
+            for chainname in chainnames:
+                if self.rules[chainname]:
+                    raise FakeError("Directory not empty.")
+                if self.__referenced(chainname, chainnames):
+                    raise FakeError("Too many links.")
+            for chainname in chainnames:
+                del self.chains[chainname]
+                del self.rules[chainname]
+        elif command in ('-F', '-Z'):
+            if len(args) > 1:
+                chainnames = [self.__chain(args, user=False)]
+            else:
+                chainnames = list(self.chains.keys())
+            for chainname in chainnames:
+                if command == '-F':
+                    self.rules[chainname] = []
+                else:
+                    for rule in self.rules[chainname]:
+                        rule.packets = rule.bytes = 0
+        elif command == '-P':
+            chainname = self.__chain(args, user=False)
+            if self.chains[chainname] is None:
+                raise FakeError("Bad built-in chain name.")
+            if len(args) != 3 or args[2] not in ('ACCEPT', 'DROP'):
+                raise FakeError("Bad policy name.")
+            self.chains[chainname] = args[2]
+        elif command == '-E':
+            chainname = self.__chain(args, user=True)
+            if len(args) != 3:
+                raise FakeError("-E requires old-chain-name and "
+                    "new-chain-name")
+            newname = args[2]
+            if newname in self.chains:
+                raise FakeError("File exists.")
+            chains = OrderedDict()
+            for name in self.chains.keys():
+                chains[name == chainname and newname or name] = \
+                    self.chains[name]
+            self.chains = chains
+            self.rules[newname] = self.rules.pop(chainname)
+            # the kernel refers to chains by reference
+            for rules in self.rules.values():
+                for rule in rules:
+                    for attr in ('goto', 'jump'):
+                        target = getattr(rule, attr)
+                        if target is not None and target.name() == chainname:
+                            setattr(rule, attr, Target(newname,
+                                target.options()))
+        else:
+            raise FakeError("unknown option \"%s\"" % command)
+
+    def __chain(self, args, user):
+        if len(args) < 2:
+            raise FakeError("option \"%s\" requires an argument" % args[0])
+        chainname = args[1]
+        if chainname not in self.chains:
+            raise FakeError("No chain/target/match by that name.")
+        if user and self.chains[chainname] is not None:
+            raise FakeError("Invalid argument.")
+        return chainname
+
+    def __check_target(self, rule):
+        if rule.goto is not None:
+            if self.chains.get(rule.goto.name(), 'missing') is not None:
+                raise FakeError("goto '%s' is not a chain" % rule.goto.name())
+        elif rule.jump is not None:
+            name = rule.jump.name()
+            # extension targets are written in capitals
+            if name not in self.chains and not name.isupper():
+                raise FakeError("Couldn't load target `%s'" % name)
+
+    def __delete(self, rules, number, spec):
+        if number is not None:
+            if spec or not 0 < number <= len(rules):
+                raise FakeError("Index of deletion too big.")
+            del rules[number - 1]
+            return
+        rule = netfilter.parser.parse_rule(netfilter.parser.join_words(spec))
+        for position, other in enumerate(rules):
+            if other == rule:
+                del rules[position]
+                return
+        raise FakeError("Bad rule (does a matching rule exist in that "
+            "chain?).")
+
+    def __referenced(self, chainname, deleted):
+        for other in self.chains.keys():
+            if other in deleted:
+                continue
+            for rule in self.rules[other]:
+                target = rule.goto or rule.jump
+                if target is not None and target.name() == chainname:
+                    return True
+        return False
+
+class FakeWorker:
+    """The FakeWorker class stands for a RestoreWorker in a FakeBackend,
+    applying each transaction as soon as it is sent.
+    """
+    def __init__(self, backend, command):
+        self.__backend = backend
+        self.__command = command
+
+    def close(self):
+        self.wait()
+
+    def execute(self, table, commands):
+        try:
+            self.__backend.run(self.__command,
+                netfilter.table.restore_payload(table, commands))
+        except netfilter.table.IptablesError as e:
+            # tolerate existing chains like RestoreWorker does
+            if len(commands) != 1 or commands[0][0] != '-N' or \
+               'Chain already exists' not in e.message:
+                raise
+
+    def wait(self):
+        pass
+
+class FakeBackend:
+    """The FakeBackend class emulates iptables, iptables-save and
+    iptables-restore (and their IPv6 counterparts) against tables held
+    in memory, one set per network namespace and address family. It
+    understands the -A, -D, -I, -R, -N, -X, -F, -Z, -P and -E commands.
+    'ipset restore' is emulated too, see get_ipset().
+
+    Rules are kept as they were written, unlike the kernel which
+    normalises them (for instance adding '-m tcp' for '--dport').
+    """
+    def __init__(self, version='1.8.7'):
+        self.version = version
+        # the commands run so far
+        self.commands = []
+        self.__tables = {}
+        self.__ipsets = {}
+
+    def get_table(self, name, ipv6=False, netns=None):
+        """Returns the FakeTable with the given name, creating it with
+        empty built-in chains if needed.
+        """
+        key = (netns, ipv6, name)
+        table = self.__tables.get(key)
+        if table is None:
+            table = self.__tables[key] = FakeTable(name)
+        return table
+
+    def get_ipset(self, name, netns=None):
+        """Returns the list of members of an ipset, or None if there is no
+        set with that name.
+        """
+        members = self.__ipsets.get(netns, {}).get(name)
+        return members is not None and list(members) or members
+
+    def capabilities(self, binary, run):
+        """Returns the Capabilities of the emulated binary, without
+        sharing them with the other backends.
+        """
+        return netfilter.capabilities.Capabilities(binary,
+            tuple([ int(x) for x in self.version.split('.') ]), 'legacy')
+
+    def run(self, cmd, input=None):
+        """Runs a command against the tables, see ProcessBackend.run().
+        """
+        self.commands.append(cmd)
+        args = list(cmd)
+        netns = None
+        if args[:3] == ['ip', 'netns', 'exec']:
+            netns = args[3]
+            args = args[4:]
+        binary = os.path.basename(args[0])
+        ipv6 = binary.startswith('ip6')
+        args = args[1:]
+        if '--version' in args:
+            return '%s v%s (legacy)\n' % (binary, self.version)
+
+        try:
+            if binary.endswith('-save'):
+                return self.__save(args, ipv6, netns)
+            elif binary.endswith('-restore'):
+                self.__restore(binary, args, input or '', ipv6, netns)
+                return ''
+            elif binary == 'ipset' and args == ['restore']:
+                self.__ipset_restore(input or '', netns)
+                return ''
+            elif binary in ('iptables', 'ip6tables'):
+                name = 'filter'
+                while args and args[0] in ('-t', '-w', '--wait'):
+                    if args[0] == '-t':
+                        name = args[1]
+                        args = args[1:]
+                    args = args[1:]
+                try:
+                    self.get_table(name, ipv6, netns).execute(args)
+                except FakeError as e:
+                    raise FakeError('%s: %s\n' % (binary, e))
+                return ''
+            raise FakeError('%s: command not found\n' % binary)
+        except FakeError as e:
+            netfilter.table.check_status(cmd, 1, str(e))
+            return ''
+
+    def stream(self, cmd):
+        """Runs a command and yields the lines of its output, see
+        ProcessBackend.stream().
+        """
+        for line in self.run(cmd).splitlines(True):
+            yield line
+
+    def wait_lock(self):
+        """Returns 0, the tables are never locked.
+        """
+        return 0.0
+
+    def worker(self, command):
+        """Returns a FakeWorker, see ProcessBackend.worker().
+        """
+        return FakeWorker(self, command)
+
+    def __save(self, args, ipv6, netns):
+        counters = '-c' in args or '--counters' in args
+        if '-t' in args:
+            name = args[args.index('-t') + 1]
+            return self.get_table(name, ipv6, netns).snapshot().format(
+                counters)
+        lines = []
+        for key in sorted(self.__tables):
+            if key[:2] == (netns, ipv6):
+                lines.append(self.__tables[key].snapshot().format(counters))
+        return ''.join(lines)
+
+    def __restore(self, binary, args, data, ipv6, netns):
+        counters = '-c' in args or '--counters' in args
+        noflush = '-n' in args or '--noflush' in args
+        table = None
+        lineno = 0
+        for line in data.splitlines():
+            lineno += 1
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                if line.startswith('*'):
+                    name = line[1:]
+                    if noflush:
+                        table = self.get_table(name, ipv6, netns).copy()
+                    else:
+                        table = FakeTable(name)
+                elif table is None:
+                    raise FakeError("no table specified")
+                elif line == 'COMMIT':
+                    self.__tables[(netns, ipv6, table.name)] = table
+                    table = None
+                elif line.startswith(':'):
+                    chainname, policy = line[1:].split()[:2]
+                    if chainname not in table.chains:
+                        table.execute(['-N', chainname])
+                    elif table.chains[chainname] is None:
+                        table.execute(['-F', chainname])
+                    if policy != '-':
+                        table.execute(['-P', chainname, policy])
+                else:
+                    packets = bytes = 0
+                    if line.startswith('['):
+                        end = line.index(']')
+                        if counters:
+                            packets, bytes = [ int(x)
+                                for x in line[1:end].split(':') ]
+                        line = line[end + 1:]
+                    table.execute(netfilter.parser.split_words(line),
+                        packets, bytes)
+            except FakeError as e:
+                raise FakeError('%s: %s\nError occurred at line: %d\n' % (
+                    binary, e, lineno))
+        if table is not None:
+            raise FakeError('%s: COMMIT expected at line: %d\n' % (binary,
+                lineno + 1))
+
+    def __ipset_restore(self, data, netns):
+        sets = self.__ipsets.setdefault(netns, {})
+        lineno = 0
+        for line in data.splitlines():
+            lineno += 1
+            words = line.split()
+            if not words:
+                continue
+            try:
+                command, names = words[0], words[1:2]
+                if command == 'swap':
+                    names = words[1:3]
+                if command != 'create':
+                    for name in names:
+                        if name not in sets:
+                            raise FakeError("The set with the given name "
+                                "does not exist")
+                if command == 'create':
+                    if names[0] in sets and '-exist' not in words:
+                        raise FakeError("Set cannot be created: set with "
+                            "the same name already exists")
+                    sets.setdefault(names[0], [])
+                elif command == 'flush':
+                    sets[names[0]] = []
+                elif command == 'add':
+                    if words[2] not in sets[names[0]]:
+                        sets[names[0]].append(words[2])
+                elif command == 'swap':
+                    sets[names[0]], sets[names[1]] = \
+                        sets[names[1]], sets[names[0]]
+                elif command == 'destroy':
+                    del sets[names[0]]
+                else:
+                    raise FakeError("Unknown command %s" % command)
+            except FakeError as e:
+                raise FakeError('ipset v7.15: Error in line %d: %s\n' % (
+                    lineno, e))
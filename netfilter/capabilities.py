@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+
+re_version = re.compile(r'v([0-9]+(?:\.[0-9]+)*)(?:\s+\(([^)]+)\))?')
+
+# iptables gained the --wait option in version 1.4.20
+WAIT_VERSION = (1, 4, 20)
+
+# iptables-restore gained the --wait option in version 1.6.2
+RESTORE_WAIT_VERSION = (1, 6, 2)
+
+class Capabilities:
+    """The Capabilities class describes what an iptables binary supports,
+    as detected by detect().
+    """
+    def __init__(self, path, version=None, backend=None):
+        # full path of the binary, or its name if it was not found
+        self.path = path
+        # version as a tuple of integers, or None if unknown
+        self.version = version
+        # 'nf_tables' or 'legacy', or None if unknown
+        self.backend = backend
+
+    def __repr__(self):
+        return '<Capabilities %s version=%s backend=%s>' % (self.path,
+            self.version and '.'.join(map(str, self.version)),
+            self.backend)
+
+    def supports_wait(self):
+        """Returns whether the binary accepts the --wait option.
+        """
+        return self.version is not None and self.version >= WAIT_VERSION
+
+    def wait_option(self):
+        """Returns the arguments which make the binary wait for the
+        xtables lock, if it supports them.
+        """
+        if self.supports_wait():
+            return ['--wait']
+        return []
+
+    def supports_restore_wait(self):
+        """Returns whether the matching iptables-restore binary accepts
+        the --wait option.
+        """
+        return self.version is not None and \
+            self.version >= RESTORE_WAIT_VERSION
+
+    def restore_wait_option(self):
+        """Returns the arguments which make the matching iptables-restore
+        binary wait for the xtables lock, if it supports them.
+        """
+        if self.supports_restore_wait():
+            return ['--wait']
+        return []
+
+# detected capabilities, keyed by binary name, see detect()
+_cache = {}
+_cache_file = None
+_lock = threading.Lock()
+
+def set_cache_file(path):
+    """Persists the detected capabilities to a JSON file, so that later
+    processes do not need to probe the binaries again. An entry is only
+    reused while the modification time of its binary is unchanged.
+    """
+    global _cache_file
+    with _lock:
+        _cache_file = path
+        _cache.clear()
+
+def clear_cache():
+    """Forgets the capabilities detected by this process.
+    """
+    with _lock:
+        _cache.clear()
+
+def parse_version(output):
+    """Parses the output of 'iptables --version', for instance
+    'iptables v1.8.7 (nf_tables)', into a (version, backend) tuple.
+    """
+    m = re_version.search(output)
+    if not m:
+        return None, None
+    version = tuple([ int(x) for x in m.group(1).split('.') ])
+    backend = m.group(2)
+    if backend is None:
+        # versions before 1.8 only had the legacy backend
+        backend = 'legacy'
+    return version, backend
+
+def which(binary):
+    """Returns the full path of a binary found in the PATH, or None.
+    """
+    if os.path.dirname(binary):
+        return binary
+    for directory in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        path = os.path.join(directory, binary)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+def run_version(cmd):
+    p = subprocess.Popen(cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        close_fds=True)
+    out = p.communicate()[0]
+    return out.decode('utf8')
+
+def detect(binary, run=None):
+    """Returns the Capabilities of an iptables binary, for instance
+    'ip6tables'. The binary is probed by running it with --version once
+    per process, or once per binary upgrade if set_cache_file() was
+    called. run is the function used to run the probe, it is given the
+    command as a list and returns its output.
+    """
+    with _lock:
+        caps, path, mtime = _lookup(binary)
+        if caps is None:
+            if run is None:
+                run = run_version
+            try:
+                output = run([path or binary, '--version'])
+            except Exception:
+                output = ''
+            version, backend = parse_version(output)
+            caps = Capabilities(path or binary, version, backend)
+            if version is not None and mtime is not None:
+                _store(caps, mtime)
+        _cache[binary] = caps
+        return caps
+
+def lookup(binary):
+    """Returns the Capabilities of an iptables binary if they are already
+    known to this process or stored in the cache file, or None if the
+    binary needs to be probed, see detect().
+    """
+    with _lock:
+        caps, path, mtime = _lookup(binary)
+        if caps is not None:
+            _cache[binary] = caps
+        return caps
+
+def _lookup(binary):
+    caps = _cache.get(binary)
+    if caps is not None:
+        return caps, None, None
+
+    path = which(binary)
+    mtime = None
+    if path is not None:
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            pass
+    return _load(path, mtime), path, mtime
+
+def _read():
+    try:
+        with open(_cache_file) as fp:
+            data = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return data
+
+def _load(path, mtime):
+    if _cache_file is None or mtime is None:
+        return None
+    entry = _read().get(path)
+    if not entry or entry.get('mtime') != mtime:
+        return None
+    return Capabilities(path, tuple(entry['version']), entry['backend'])
+
+def _store(caps, mtime):
+    if _cache_file is None:
+        return
+    data = _read()
+    data[caps.path] = {
+        'mtime': mtime,
+        'version': list(caps.version),
+        'backend': caps.backend,
+    }
+    # write to a temporary file first, so readers never see a partial file
+    directory = os.path.dirname(os.path.abspath(_cache_file))
+    try:
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(data, fp)
+        os.rename(tmp, _cache_file)
+    except (IOError, OSError):
+        # the cache is only an optimisation
+        pass
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+
+import netfilter.parser
+
+class CounterMonitor:
+    """The CounterMonitor class tracks the packet and byte counters of
+    the rules of a table over time.
+
+    Rules are matched across polls by identity rather than by position,
+    so inserting, deleting or reordering rules does not mix up their
+    counters. Identical rules within a chain are told apart by their
+    order of appearance.
+
+    A rule is identified by its specification as printed by
+    iptables-save, so only the rules which appeared since the previous
+    poll need to be parsed.
+    """
+    def __init__(self, table):
+        """Constructs a new CounterMonitor for the given Table.
+        """
+        self.__table = table
+        self.__counters = None
+        self.__timestamp = None
+
+    def poll(self):
+        """Takes a snapshot of the table and returns the counter deltas
+        since the previous poll, see update().
+        """
+        self.__table.invalidate_snapshot()
+        return self.update(self.__table.snapshot())
+
+    def run(self, callback, interval=5, count=None):
+        """Polls the table every interval seconds and calls callback with
+        the result of each poll, count times or forever if count is None.
+        """
+        deadline = time.time()
+        while count is None or count > 0:
+            sample = self.poll()
+            if sample is not None:
+                callback(sample)
+                if count is not None:
+                    count -= 1
+            deadline += interval
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def update(self, snapshot):
+        """Records the counters of a TableSnapshot.
+
+        Returns None on the first call, as there is nothing to compare
+        with yet. Otherwise returns a dictionary with the following keys:
+
+          'timestamp': the time at which the snapshot was taken
+          'interval': the number of seconds since the previous snapshot
+          'rules': a list of dictionaries, one per rule, with 'chain',
+            'rule', 'packets', 'bytes', 'packets_rate' and 'bytes_rate'
+            keys, in the order of the snapshot. The Rule holds the
+            absolute counters and is reused by later polls.
+          'chains': a dictionary mapping chain names to dictionaries with
+            'packets', 'bytes', 'packets_rate' and 'bytes_rate' keys,
+            summing up the rules of the chain
+
+        Rules which were not present in the previous snapshot, or whose
+        counters went down (e.g. after 'iptables -Z'), are considered to
+        have been counting from zero.
+        """
+        previous = self.__counters
+        interval = None
+        if self.__timestamp is not None:
+            interval = snapshot.timestamp - self.__timestamp
+        counters = {}
+        rules = []
+        chains = {}
+        for chain in snapshot.list_chains():
+            packets_total = 0
+            bytes_total = 0
+            occurrences = {}
+            for packets, bytes, spec in snapshot.list_entries(chain):
+                occurrence = occurrences.get(spec, 0)
+                occurrences[spec] = occurrence + 1
+                key = (chain, spec, occurrence)
+
+                # only parse the rules we have not seen before
+                old = previous and previous.get(key)
+                if old:
+                    rule = old[2]
+                else:
+                    rule = netfilter.parser.parse_rule(spec)
+                rule.packets = packets
+                rule.bytes = bytes
+                counters[key] = (packets, bytes, rule)
+                if previous is None:
+                    continue
+
+                if old and old[0] <= packets and \
+                   old[1] <= bytes:
+                    packets -= old[0]
+                    bytes -= old[1]
+                packets_total += packets
+                bytes_total += bytes
+                rules.append(self.__entry({'chain': chain, 'rule': rule},
+                    packets, bytes, interval))
+            if previous is not None:
+                chains[chain] = self.__entry({}, packets_total, bytes_total,
+                    interval)
+
+        self.__counters = counters
+        self.__timestamp = snapshot.timestamp
+        if previous is None:
+            return None
+        return {
+            'timestamp': snapshot.timestamp,
+            'interval': interval,
+            'rules': rules,
+            'chains': chains,
+        }
+
+    def __entry(self, entry, packets, bytes, interval):
+        entry['packets'] = packets
+        entry['bytes'] = bytes
+        if interval:
+            entry['packets_rate'] = packets / float(interval)
+            entry['bytes_rate'] = bytes / float(interval)
+        else:
+            entry['packets_rate'] = None
+            entry['bytes_rate'] = None
+        return entry
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Splits large flat chains into a tree of user-defined chains, dispatching
+packets by input interface, then protocol, then destination port range,
+for instance:
+
+    tree = netfilter.dispatch.build_tree('INPUT', rules['INPUT'])
+    optimized = dict(rules)
+    optimized.update(tree)
+    before = netfilter.dispatch.expected_cost(rules, 'INPUT', packets)
+    after = netfilter.dispatch.expected_cost(optimized, 'INPUT', packets)
+    netfilter.dispatch.apply_tree(table, tree)
+"""
+
+import bisect
+from collections import OrderedDict
+
+from netfilter.rule import Match, Rule
+from netfilter.simulator import Simulator, normalize_protocol, \
+    parse_ports, split_negation
+
+# groups with fewer rules are left in their chain
+MIN_SIZE = 8
+
+# maximum number of port ranges a chain dispatches to
+FANOUT = 8
+
+# iptables chain names are limited to 28 characters
+MAX_CHAIN_LENGTH = 28
+
+# protocols whose match accepts --dport
+port_protocols = ('tcp', 'udp', 'sctp')
+
+def classify_interface(rule):
+    # returns None if the rule matches any value, a list of the values
+    # it matches, or a function telling whether it may match a value
+    if rule.in_interface is None:
+        return None
+    negated, value = split_negation(rule.in_interface)
+    if value.endswith('+'):
+        prefix = value[:-1]
+        test = lambda key: key.startswith(prefix)
+    elif negated:
+        test = lambda key: key == value
+    else:
+        return [value]
+    if negated:
+        return lambda key: not test(key)
+    return test
+
+def classify_protocol(rule):
+    if not rule.protocol:
+        return None
+    negated, value = split_negation(rule.protocol)
+    value = normalize_protocol(value)
+    if value == 'all':
+        if negated:
+            return lambda key: False
+        return None
+    if negated:
+        return lambda key: key != value
+    return [value]
+
+def classify_dport(rule):
+    # rules with negated or other port options may match any range
+    for match in rule.matches:
+        name, items = match.key()
+        if name in port_protocols or name == 'multiport':
+            for opt, vals in items:
+                if opt in ('dport', 'dports'):
+                    ranges = []
+                    for val in vals:
+                        ranges.extend(parse_ports(val))
+                    return ranges
+    return None
+
+def port_buckets(ranges, fanout):
+    """Returns up to fanout disjoint (first, last) ranges covering the
+    given list of lists of port ranges, balancing the number of lists
+    in each of them.
+    """
+    # merge overlapping ranges into components
+    components = []
+    for first, last in sorted(set([ port_range
+                                    for port_ranges in ranges
+                                    for port_range in port_ranges ])):
+        if components and first <= components[-1][1]:
+            components[-1][1] = max(components[-1][1], last)
+        else:
+            components.append([first, last])
+
+    # count the lists touching each component
+    starts = [ first for first, last in components ]
+    counts = [0] * len(components)
+    for port_ranges in ranges:
+        for position in set([ bisect.bisect(starts, first) - 1
+                              for first, last in port_ranges ]):
+            counts[position] += 1
+
+    size = float(sum(counts)) / fanout
+    buckets = []
+    count = 0
+    for position, (first, last) in enumerate(components):
+        if buckets and count < size:
+            buckets[-1] = (buckets[-1][0], last)
+        else:
+            buckets.append((first, last))
+            count = 0
+        count += counts[position]
+    return buckets
+
+class TreeBuilder:
+    """The TreeBuilder class splits a chain into a tree of chains, see
+    build_tree().
+    """
+    def __init__(self, chainname, min_size, fanout):
+        self.chainname = chainname
+        self.min_size = min_size
+        self.fanout = fanout
+        self.chains = OrderedDict()
+
+    def chain_name(self, parent, label):
+        name = '%s_%s' % (parent, label)
+        if len(name) > MAX_CHAIN_LENGTH or name in self.chains:
+            suffix = '_%d' % len(self.chains)
+            name = self.chainname[:MAX_CHAIN_LENGTH - len(suffix)] + suffix
+        return name
+
+    def build(self, name, rules, levels, protocol=None):
+        self.chains[name] = rules
+        for position, level in enumerate(levels):
+            if level == 'dport':
+                if protocol not in port_protocols:
+                    continue
+                # ranges can be split again
+                next_levels = levels[position:]
+            else:
+                next_levels = levels[position + 1:]
+            if self.split(name, rules, level, next_levels, protocol):
+                return
+
+    def split(self, name, rules, level, next_levels, protocol):
+        if len(rules) < self.min_size:
+            return False
+
+        classify = {
+            'in_interface': classify_interface,
+            'protocol': classify_protocol,
+            'dport': classify_dport,
+        }[level]
+        kinds = [ classify(rule) for rule in rules ]
+        if level == 'dport':
+            keys = port_buckets([ kind for kind in kinds
+                if isinstance(kind, list) ], self.fanout)
+        else:
+            keys = []
+            for kind in kinds:
+                if isinstance(kind, list) and kind[0] not in keys:
+                    keys.append(kind[0])
+
+        def may_match(kind, key):
+            if kind is None:
+                return True
+            elif isinstance(kind, list):
+                if level == 'dport':
+                    for first, last in kind:
+                        if first <= key[1] and key[0] <= last:
+                            return True
+                    return False
+                return key in kind
+            return kind(key)
+
+        # a group gets its own chain if enough rules only match its key
+        groups = []
+        dispatched = set()
+        for key in keys:
+            members = []
+            exact = 0
+            for position, kind in enumerate(kinds):
+                if may_match(kind, key):
+                    members.append(position)
+                    if isinstance(kind, list):
+                        exact += 1
+            # port ranges are split again, so they must shrink the chain
+            if exact >= self.min_size and (level != 'dport' or
+                                           len(members) < len(rules)):
+                groups.append((key, members))
+                dispatched.add(key)
+        if not groups:
+            return False
+
+        dispatch = []
+        for key, members in groups:
+            if level == 'in_interface':
+                label = key
+                rule = Rule(in_interface=key)
+            elif level == 'protocol':
+                label = key
+                rule = Rule(protocol=key)
+            else:
+                if key[0] == key[1]:
+                    label = ports = str(key[0])
+                else:
+                    label = '%d-%d' % key
+                    ports = '%d:%d' % key
+                rule = Rule(protocol=protocol,
+                    matches=[Match(protocol, '--dport %s' % ports)])
+            subchain = self.chain_name(name, label)
+            # a goto lets the subchain fall off its end as we would
+            rule.goto = subchain
+            dispatch.append(rule)
+            self.build(subchain, [ rules[position] for position in members ],
+                next_levels, level == 'protocol' and key or protocol)
+
+        # keep the rules which can still match packets not dispatched
+        remaining = []
+        for position, kind in enumerate(kinds):
+            if not isinstance(kind, list):
+                remaining.append(rules[position])
+                continue
+            for key in keys:
+                if key not in dispatched and may_match(kind, key):
+                    remaining.append(rules[position])
+                    break
+        self.chains[name] = dispatch + remaining
+        return True
+
+def build_tree(chainname, rules, min_size=MIN_SIZE, fanout=FANOUT):
+    """Splits a chain into a tree of user-defined chains, so that packets
+    only walk through the rules which may match them.
+
+    At each level, the chain starts with one goto rule per input
+    interface, protocol or destination port range which at least
+    min_size rules match exclusively, leading to a chain holding the
+    rules which may match such packets in their original order. The
+    remaining rules follow the goto rules. Port ranges are only split
+    within chains dedicated to a protocol, into at most fanout ranges.
+
+    Returns an ordered dictionary mapping the chain names to their
+    Rules, starting with the given chain.
+    """
+    builder = TreeBuilder(chainname, min_size, fanout)
+    builder.build(chainname, list(rules),
+        ['in_interface', 'protocol', 'dport'])
+    return builder.chains
+
+def is_subchain(chainname, name):
+    # whether a chain may have been created by build_tree() for the given
+    # chain, see TreeBuilder.chain_name()
+    if name.startswith(chainname + '_'):
+        return True
+    prefix, sep, number = name.rpartition('_')
+    return len(name) == MAX_CHAIN_LENGTH and number.isdigit() and \
+        chainname.startswith(prefix)
+
+def tree_chains(table, chainname):
+    # the subchains which the rules of a chain dispatch to, recursively
+    chains = []
+    pending = [chainname]
+    while pending:
+        for rule in table.list_rules(pending.pop()):
+            if rule.goto is None:
+                continue
+            name = rule.goto.name()
+            if name not in chains and is_subchain(chainname, name):
+                chains.append(name)
+                pending.append(name)
+    return chains
+
+def apply_tree(table, chains):
+    """Writes the chains returned by build_tree() to a Table, creating
+    the user-defined chains which do not exist yet before the first
+    chain is replaced. The subchains of a tree applied earlier which are
+    no longer used are then deleted, so chain names starting with the
+    name of the first chain and an underscore are reserved for the tree.
+    Use a Table without auto_commit and commit(restore=True) to apply the
+    changes in a single transaction.
+    """
+    names = list(chains)
+    existing = set(table.list_chains())
+    stale = [ name for name in tree_chains(table, names[0])
+        if name not in chains ]
+    for name in names[1:]:
+        if name not in existing:
+            table.create_chain(name)
+        table.flush_chain(name)
+    for name in names[1:]:
+        for rule in chains[name]:
+            table.append_rule(name, rule)
+    table.flush_chain(names[0])
+    for rule in chains[names[0]]:
+        table.append_rule(names[0], rule)
+
+    # chains the rules still refer to are kept
+    for name in names:
+        for rule in chains[name]:
+            target = rule.goto or rule.jump
+            if target is not None and target.name() in stale:
+                stale.remove(target.name())
+    for name in stale:
+        table.flush_chain(name)
+    for name in stale:
+        table.delete_chain(name)
+
+def expected_cost(rules, chainname, packets, policies=None):
+    """Returns the average number of rules the kernel evaluates for each
+    of the given Packets, starting from the specified chain of a
+    dictionary mapping chain names to lists of Rules, see
+    netfilter.simulator.Simulator.cost().
+    """
+    return Simulator(rules, policies).cost(chainname, packets)
@@ -23,6 +23,7 @@ import subprocess
 import sys
 
 from netfilter.rule import Rule,Match,Target
+import netfilter.snapshot
 import netfilter.table
 
 class Firewall:
@@ -31,18 +32,23 @@ class Firewall:
 
     WARNING: THIS API IS NOT FROZEN!
     """
-    def __init__(self, auto_commit = True, ipv6 = False):
+    def __init__(self, auto_commit = True, ipv6 = False, netns = None,
+                 backend = None):
         self.filter = netfilter.table.Table(
             name='filter',
             auto_commit=auto_commit,
-            ipv6=ipv6)
+            ipv6=ipv6,
+            netns=netns,
+            backend=backend)
         self.__ipv6 = ipv6
         self.__tables = [ self.filter ]
         if not ipv6:
             self.nat = netfilter.table.Table(
                 name='nat',
                 auto_commit=auto_commit,
-                ipv6=ipv6)
+                ipv6=ipv6,
+                netns=netns,
+                backend=backend)
             self.__tables.append(self.nat)
      
     def clear(self):
@@ -51,11 +57,29 @@ class Firewall:
             table.flush_chain()
             table.delete_chain()
        
-    def commit(self):
-        """Commit changes to the tables."""
-        for table in self.__tables: 
-            table.commit()
+    def commit(self, restore=False):
+        """Commit changes to the tables.
+
+        If restore is true, the changes to all the tables are applied
+        in a single iptables-restore transaction.
+        """
+        if restore:
+            payload = ''.join([table.get_restore_payload()
+                for table in self.__tables])
+            self.filter.restore(payload)
+            for table in self.__tables:
+                # the payload changed every table, not just filter
+                table.invalidate_snapshot()
+                table.clear_buffer()
+        else:
+            for table in self.__tables: 
+                table.commit()
     
+    def get_tables(self):
+        """Get the tables managed by the firewall, for instance to
+        commit several firewalls with netfilter.parallel.commit()."""
+        return self.__tables
+
     def get_buffer(self):
         """Get the change buffers."""
         buffer = []
@@ -63,6 +87,12 @@ class Firewall:
             buffer.extend(table.get_buffer())
         return buffer
     
+    def snapshot(self):
+        """Get the contents of all the tables (not just those managed
+        by the firewall) from a single iptables-save call, as an ordered
+        dictionary mapping table names to TableSnapshots."""
+        return netfilter.snapshot.load(self.filter.dump(all_tables=True))
+
     def run(self, args):
         """
         Process command line arguments and run the given command command
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Keeps track of the position of each rule of a table, so that rules can be
+deleted or replaced by number instead of having the kernel look for them,
+see the indexed argument of netfilter.table.Table.
+"""
+
+import bisect
+from collections import OrderedDict
+
+import netfilter.parser
+
+# spacing of the sort keys, leaving room for insertions
+GAP = 1 << 16
+
+class ChainIndex:
+    """The ChainIndex class holds the rules of a chain in order. Each rule
+    has a sort key, so that finding the position of a rule takes a
+    dictionary lookup and a binary search.
+    """
+    def __init__(self, rules=()):
+        self.__keys = []
+        self.__rules = {}
+        self.__positions = {}
+        for rule in rules:
+            self.append(rule)
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def list_rules(self):
+        """Returns the list of Rules in the chain.
+        """
+        return [ self.__rules[key] for key in self.__keys ]
+
+    def find(self, rule):
+        """Returns the position of the first occurrence of a Rule,
+        counting from 1, or None if it is not in the chain.
+        """
+        keys = self.__positions.get(rule)
+        if not keys:
+            return None
+        return bisect.bisect_left(self.__keys, min(keys)) + 1
+
+    def append(self, rule):
+        """Adds a Rule at the end of the chain.
+        """
+        key = self.__keys and self.__keys[-1] + GAP or GAP
+        self.__keys.append(key)
+        self.__add(key, rule)
+
+    def insert(self, position, rule):
+        """Inserts a Rule at the given position, counting from 1.
+        """
+        count = len(self.__keys)
+        if not 0 < position <= count + 1:
+            raise IndexError("Index of insertion too big.")
+        if position == count + 1:
+            self.append(rule)
+            return
+        low = position > 1 and self.__keys[position - 2] or 0
+        high = self.__keys[position - 1]
+        if high - low < 2:
+            self.__renumber()
+            low = position > 1 and self.__keys[position - 2] or 0
+            high = self.__keys[position - 1]
+        key = (low + high) // 2
+        self.__keys.insert(position - 1, key)
+        self.__add(key, rule)
+
+    def replace(self, position, rule):
+        """Replaces the Rule at the given position, counting from 1.
+        """
+        if not 0 < position <= len(self.__keys):
+            raise IndexError("Index of replacement too big.")
+        key = self.__keys[position - 1]
+        self.__remove(key)
+        self.__add(key, rule)
+
+    def delete(self, position):
+        """Deletes the Rule at the given position, counting from 1.
+        """
+        if not 0 < position <= len(self.__keys):
+            raise IndexError("Index of deletion too big.")
+        self.__remove(self.__keys.pop(position - 1))
+
+    def __add(self, key, rule):
+        self.__rules[key] = rule
+        self.__positions.setdefault(rule, []).append(key)
+
+    def __remove(self, key):
+        rule = self.__rules.pop(key)
+        keys = self.__positions[rule]
+        keys.remove(key)
+        if not keys:
+            del self.__positions[rule]
+
+    def __renumber(self):
+        rules = self.list_rules()
+        self.__keys = []
+        self.__rules = {}
+        self.__positions = {}
+        for rule in rules:
+            self.append(rule)
+
+class TableIndex:
+    """The TableIndex class holds a ChainIndex for each chain of a table,
+    and follows the iptables commands applied to the table.
+    """
+    def __init__(self, snapshot):
+        self.chains = OrderedDict()
+        self.builtin = set()
+        for chainname in snapshot.list_chains():
+            self.chains[chainname] = ChainIndex(
+                snapshot.list_rules(chainname))
+            if snapshot.get_policy(chainname) is not None:
+                self.builtin.add(chainname)
+
+    def find(self, chainname, rule):
+        """Returns the position of a Rule in a chain, counting from 1, or
+        None if it is not in the chain.
+        """
+        chain = self.chains.get(chainname)
+        if chain is None:
+            return None
+        return chain.find(rule)
+
+    def list_rules(self, chainname):
+        """Returns the list of Rules in the specified chain.
+        """
+        return self.chains[chainname].list_rules()
+
+    def apply(self, args, rule=None):
+        """Applies a list of iptables arguments to the index. rule is the
+        Rule the arguments describe, if it is known. Returns False if the
+        effect of the command cannot be determined, in which case the
+        index should be discarded.
+        """
+        try:
+            return self.__apply(args, rule)
+        except (IndexError, KeyError, TypeError,
+                netfilter.parser.ParseError):
+            return False
+
+    def __apply(self, args, rule):
+        command = args[0]
+        if command in ('-A', '-I', '-R', '-D'):
+            chain = self.chains.get(args[1])
+            if chain is None:
+                return False
+            spec = args[2:]
+            position = None
+            if spec and spec[0].isdigit():
+                position = int(spec[0])
+                spec = spec[1:]
+            if spec and rule is None:
+                rule = netfilter.parser.parse_rule(
+                    netfilter.parser.join_words(spec))
+            if command == '-D':
+                if position is None:
+                    position = chain.find(rule)
+                    if position is None:
+                        return False
+                chain.delete(position)
+            elif command == '-A':
+                chain.append(rule)
+            elif command == '-I':
+                chain.insert(position or 1, rule)
+            else:
+                chain.replace(position, rule)
+        elif command == '-N':
+            if args[1] not in self.chains:
+                self.chains[args[1]] = ChainIndex()
+        elif command == '-X':
+            if len(args) > 1:
+                self.chains.pop(args[1], None)
+            else:
+                for chainname in list(self.chains.keys()):
+                    if chainname not in self.builtin:
+                        del self.chains[chainname]
+        elif command == '-F':
+            chainnames = args[1:] or list(self.chains.keys())
+            for chainname in chainnames:
+                if chainname not in self.chains:
+                    return False
+                self.chains[chainname] = ChainIndex()
+        elif command not in ('-P', '-Z'):
+            # renaming a chain changes the rules which refer to it
+            return False
+        return True
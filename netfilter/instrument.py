@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Reports the commands run by Table and the rules parsed from their output
+as events passed to sinks, for instance:
+
+    counters = netfilter.instrument.Counters()
+    netfilter.instrument.add_sink(counters)
+    netfilter.instrument.add_sink(netfilter.instrument.LoggingSink())
+    firewall.start()
+    print(counters.render())
+
+A sink is any callable taking an event, which is a dictionary. Command
+events look like:
+
+    {'event': 'command', 'command': [...], 'binary': 'iptables',
+     'table': 'filter', 'netns': None, 'seconds': 0.004,
+     'lock_wait': 0.0, 'status': 0, 'bytes': 0}
+
+lock_wait is the time spent waiting for the xtables lock before running a
+command using --wait, or None if it was not measured, which is the case
+unless the backend is a ProcessBackend with lock_probe set. status is None
+if a command failed without an exit status. Parse events look like:
+
+    {'event': 'parse', 'function': 'list_rules', 'rules': 10000,
+     'seconds': 0.03, 'rate': 333333.3}
+
+Parse events are emitted where Rules are built: by parse_rules() and
+iterparse(), and by TableSnapshot.list_rules() the first time it parses
+the rules of a chain. Splitting a dump into chains with parse_tables() is
+not reported, as it does not parse the rules.
+
+When no sink is registered, the only cost is a check of the sinks list.
+"""
+
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+
+# the registered sinks, see add_sink()
+sinks = []
+
+clock = getattr(time, 'perf_counter', time.time)
+
+def add_sink(sink):
+    """Registers a callable which receives every event.
+    """
+    sinks.append(sink)
+
+def remove_sink(sink):
+    """Unregisters a sink added with add_sink().
+    """
+    sinks.remove(sink)
+
+def emit(event):
+    """Passes an event to each registered sink.
+    """
+    for sink in list(sinks):
+        sink(event)
+
+def binary_name(cmd):
+    # skip the 'ip netns exec <name>' prefix
+    if cmd[:3] == ['ip', 'netns', 'exec']:
+        cmd = cmd[4:]
+    return os.path.basename(cmd[0])
+
+def uses_wait(cmd):
+    return '--wait' in cmd or '-w' in cmd
+
+def command_event(cmd, table=None, netns=None):
+    """Returns a command event for a command about to be run, which the
+    caller completes and emits once the command has completed or failed.
+    """
+    return {
+        'event': 'command',
+        'command': cmd,
+        'binary': binary_name(cmd),
+        'table': table,
+        'netns': netns,
+        'lock_wait': None,
+        'status': 0,
+        'bytes': 0,
+    }
+
+def run(backend, cmd, input=None, table=None, netns=None):
+    """Runs a command with a backend, emitting a command event once it
+    has completed or failed. Returns the output of the command.
+    """
+    event = command_event(cmd, table, netns)
+    if uses_wait(cmd) and hasattr(backend, 'wait_lock'):
+        event['lock_wait'] = backend.wait_lock()
+    start = clock()
+    try:
+        output = backend.run(cmd, input)
+    except Exception as e:
+        event['status'] = getattr(e, 'status', None)
+        raise
+    else:
+        event['bytes'] = len(output)
+    finally:
+        event['seconds'] = clock() - start
+        emit(event)
+    return output
+
+def stream(backend, cmd, table=None, netns=None):
+    """Runs a command with a backend and yields the lines of its output,
+    emitting a command event once they have all been read.
+    """
+    event = command_event(cmd, table, netns)
+    start = clock()
+    try:
+        for line in backend.stream(cmd):
+            event['bytes'] += len(line)
+            yield line
+    except Exception as e:
+        event['status'] = getattr(e, 'status', None)
+        raise
+    finally:
+        event['seconds'] = clock() - start
+        emit(event)
+
+def parse_event(function, rules, seconds):
+    return {
+        'event': 'parse',
+        'function': function,
+        'rules': rules,
+        'seconds': seconds,
+        'rate': seconds and rules / seconds or None,
+    }
+
+def parsed(count):
+    """Decorates a parser function so that it emits a parse event, where
+    count returns the number of rules in the function's result.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not sinks:
+                return func(*args, **kwargs)
+            start = clock()
+            result = func(*args, **kwargs)
+            emit(parse_event(func.__name__, count(result), clock() - start))
+            return result
+        return wrapper
+    return decorator
+
+def iterparsed(function, events):
+    """Yields the events of netfilter.parser.iterparse(), emitting a parse
+    event once they have all been read. The time includes reading the
+    lines, and whatever the consumer does between events.
+    """
+    rules = 0
+    start = clock()
+    try:
+        for item in events:
+            if item[0] == 'rule':
+                rules += 1
+            yield item
+    finally:
+        emit(parse_event(function, rules, clock() - start))
+
+class LoggingSink:
+    """The LoggingSink class logs each event as a single line. The event
+    is attached to the log record as its netfilter_event attribute.
+    """
+    def __init__(self, logger=None, level=logging.DEBUG):
+        if logger is None:
+            logger = logging.getLogger('netfilter.instrument')
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, event):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        extra = {'netfilter_event': event}
+        if event['event'] == 'command':
+            lock_wait = event['lock_wait']
+            self.logger.log(self.level,
+                "%s: %.6fs, lock wait %s, status %s, %d bytes",
+                ' '.join(event['command']), event['seconds'],
+                lock_wait is None and '-' or '%.6fs' % lock_wait,
+                event['status'], event['bytes'], extra=extra)
+        elif event['event'] == 'parse':
+            self.logger.log(self.level,
+                "%s: %d rules in %.6fs (%.0f rules/s)", event['function'],
+                event['rules'], event['seconds'], event['rate'] or 0,
+                extra=extra)
+
+class Counters:
+    """The Counters class aggregates events into Prometheus-style
+    counters, which render() formats in the text exposition format:
+
+      netfilter_commands_total{binary,status}
+      netfilter_command_seconds_total{binary}
+      netfilter_lock_wait_seconds_total{binary}
+      netfilter_output_bytes_total{binary}
+      netfilter_parsed_rules_total{function}
+      netfilter_parse_seconds_total{function}
+
+    For a ProcessBackend, netfilter_commands_total counts the processes
+    forked by the tables.
+    """
+    def __init__(self, prefix='netfilter'):
+        self.prefix = prefix
+        self.__values = OrderedDict()
+
+    def __call__(self, event):
+        if event['event'] == 'command':
+            binary = event['binary']
+            status = event['status']
+            self.inc('commands_total', binary=binary,
+                status=status is None and 'unknown' or str(status))
+            self.inc('command_seconds_total', event['seconds'],
+                binary=binary)
+            if event['lock_wait'] is not None:
+                self.inc('lock_wait_seconds_total', event['lock_wait'],
+                    binary=binary)
+            self.inc('output_bytes_total', event['bytes'], binary=binary)
+        elif event['event'] == 'parse':
+            function = event['function']
+            self.inc('parsed_rules_total', event['rules'],
+                function=function)
+            self.inc('parse_seconds_total', event['seconds'],
+                function=function)
+
+    def clear(self):
+        """Resets all the counters.
+        """
+        self.__values.clear()
+
+    def get(self, name, **labels):
+        """Returns the value of a counter, or 0 if it was never increased.
+        """
+        return self.__values.get((name, tuple(sorted(labels.items()))), 0)
+
+    def inc(self, name, value=1, **labels):
+        """Increases a counter by the given value.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        self.__values[key] = self.__values.get(key, 0) + value
+
+    def render(self):
+        """Returns the counters in the Prometheus text exposition format.
+        """
+        names = []
+        samples = {}
+        for name, labels in self.__values.keys():
+            if name not in samples:
+                names.append(name)
+                samples[name] = []
+            samples[name].append(labels)
+        lines = []
+        for name in names:
+            metric = '%s_%s' % (self.prefix, name)
+            lines.append('# TYPE %s counter\n' % metric)
+            for labels in samples[name]:
+                value = self.__values[(name, labels)]
+                if labels:
+                    metric_labels = '{%s}' % ','.join([ '%s="%s"' % (
+                        key, str(val).replace('\\', '\\\\').replace('"',
+                        '\\"')) for key, val in labels ])
+                else:
+                    metric_labels = ''
+                lines.append('%s%s %s\n' % (metric, metric_labels,
+                    repr(value)))
+        return ''.join(lines)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Compiles runs of rules which only differ by their source, destination
+or destination ports into a single rule matching an ipset, for instance:
+
+    rules, sets = netfilter.ipset.compile_rules(desired, 'allow')
+    netfilter.ipset.restore(sets)
+    table.sync(rules)
+
+The sets must be restored before the rules which use them are applied.
+"""
+
+from collections import OrderedDict
+
+import netfilter.backend
+import netfilter.instrument
+from netfilter.rule import Match, Rule
+from netfilter.simulator import parse_ports, terminating_targets
+
+# runs shorter than this are left alone
+MIN_SIZE = 4
+
+# ipset names are limited to 31 characters, including the suffix of the
+# temporary set used to swap the contents
+MAX_NAME_LENGTH = 27
+TEMPORARY_SUFFIX = '-tmp'
+
+class IpSet:
+    """The IpSet class describes an ipset and its members, which can be
+    loaded atomically with restore().
+    """
+    def __init__(self, name, type, members=None, family='inet',
+                 options=None):
+        if len(name) > MAX_NAME_LENGTH:
+            raise ValueError("ipset name is too long: %s" % name)
+        self.name = name
+        self.type = type
+        self.members = members or []
+        self.family = family
+        self.options = options or []
+
+    def __repr__(self):
+        return '<IpSet %s %s (%d members)>' % (self.name, self.type,
+            len(self.members))
+
+    def restore_lines(self):
+        """Returns the 'ipset restore' commands which create the set if
+        needed and replace its members in a single swap.
+        """
+        create = [self.type]
+        if not self.type.startswith('bitmap:'):
+            create.extend(['family', self.family])
+        create.extend(self.options)
+        create = ' '.join(create)
+        temporary = self.name + TEMPORARY_SUFFIX
+        lines = [
+            'create %s %s -exist\n' % (self.name, create),
+            'create %s %s -exist\n' % (temporary, create),
+            'flush %s\n' % temporary,
+        ]
+        for member in self.members:
+            lines.append('add %s %s\n' % (temporary, member))
+        lines.append('swap %s %s\n' % (temporary, self.name))
+        lines.append('destroy %s\n' % temporary)
+        return lines
+
+def restore_payload(sets):
+    """Returns the input of 'ipset restore' which loads the given IpSets.
+    """
+    lines = []
+    for ipset in sets:
+        lines.extend(ipset.restore_lines())
+    return ''.join(lines)
+
+def restore(sets, ipset='ipset', netns=None, backend=None):
+    """Loads the given IpSets with a single 'ipset restore' call. Each set
+    is filled under a temporary name and swapped in, so rules using it
+    never see it partially loaded. Raises an IptablesError on failure.
+
+    backend runs the command, it defaults to a ProcessBackend, see
+    netfilter.table.Table.
+    """
+    payload = restore_payload(sets)
+    if not payload:
+        return
+    if backend is None:
+        backend = netfilter.backend.ProcessBackend()
+    cmd = [ipset, 'restore']
+    if netns:
+        cmd = ['ip', 'netns', 'exec', netns] + cmd
+    if netfilter.instrument.sinks:
+        netfilter.instrument.run(backend, cmd, payload, netns=netns)
+    else:
+        backend.run(cmd, payload)
+
+def is_terminating(rule):
+    if rule.goto is not None:
+        return True
+    return rule.jump is not None and rule.jump.name() in terminating_targets
+
+def copy_rule(rule, **kwargs):
+    attrs = {
+        'protocol': rule.protocol,
+        'in_interface': rule.in_interface,
+        'out_interface': rule.out_interface,
+        'source': rule.source,
+        'destination': rule.destination,
+        'goto': rule.goto,
+        'jump': rule.jump,
+        'matches': list(rule.matches),
+    }
+    attrs.update(kwargs)
+    return Rule(**attrs)
+
+def split_address(rule, field):
+    value = getattr(rule, field)
+    if value is None or value[:1] == '!':
+        return None
+    family = ':' in value and 'inet6' or 'inet'
+    return (family, copy_rule(rule, **{field: None})), [value]
+
+def split_dport(rule):
+    matches = []
+    ports = None
+    for match in rule.matches:
+        if match.name() in ('tcp', 'udp', 'multiport'):
+            # leave the caller's match untouched, options() would thaw it
+            options = dict(match.key()[1])
+            found = [ opt for opt in ('dport', 'dports') if opt in options ]
+            if found:
+                if ports is not None or len(found) > 1:
+                    return None
+                ports = options.pop(found[0])
+                if not options:
+                    continue
+                match = Match(match.name(), options)
+        matches.append(match)
+    if ports is None:
+        return None
+    members = []
+    for value in ports:
+        for first, last in parse_ports(value):
+            if first == last:
+                members.append(str(first))
+            else:
+                members.append('%d-%d' % (first, last))
+    return (None, copy_rule(rule, matches=matches)), members
+
+def split_rule(rule, field):
+    # returns ((family, rule without the field), members) or None
+    if field == 'dport':
+        return split_dport(rule)
+    return split_address(rule, field)
+
+def compile_chain(rules, prefix, min_size=MIN_SIZE, start=1):
+    """Replaces the runs of at least min_size consecutive Rules of a chain
+    which only differ by their source, destination or destination ports
+    by a single rule matching an ipset.
+
+    Only rules with a terminating target are considered, so the result
+    handles packets exactly as the original rules did. Sets are named
+    after the prefix followed by a number, counting from start.
+
+    Returns the list of Rules and the list of IpSets they use.
+    """
+    rules = list(rules)
+    result = []
+    sets = []
+    position = 0
+    while position < len(rules):
+        best = None
+        if is_terminating(rules[position]):
+            for field in ('source', 'destination', 'dport'):
+                split = split_rule(rules[position], field)
+                if split is None:
+                    continue
+                key, members = split
+                end = position + 1
+                while end < len(rules):
+                    other = split_rule(rules[end], field)
+                    if other is None or other[0][0] != key[0] or \
+                       other[0][1] != key[1]:
+                        break
+                    members.extend(other[1])
+                    end += 1
+                if end - position >= min_size:
+                    best = (field, end, key, members)
+                    break
+        if best is None:
+            result.append(rules[position])
+            position += 1
+            continue
+
+        field, end, (family, rule), members = best
+        name = '%s%d' % (prefix, start + len(sets))
+        if field == 'dport':
+            ipset = IpSet(name, 'bitmap:port',
+                options=['range', '0-65535'])
+            direction = 'dst'
+        else:
+            ipset = IpSet(name, 'hash:net', family=family)
+            direction = field == 'source' and 'src' or 'dst'
+        seen = set()
+        for member in members:
+            if member not in seen:
+                seen.add(member)
+                ipset.members.append(member)
+        sets.append(ipset)
+        rule.matches.append(Match('set', '--match-set %s %s' % (name,
+            direction)))
+        result.append(rule)
+        position = end
+    return result, sets
+
+def compile_rules(rules, prefix, min_size=MIN_SIZE):
+    """Runs compile_chain() on a dictionary mapping chain names to lists
+    of Rules, and returns the resulting dictionary along with the list
+    of IpSets the rules use. The sets are numbered following the order
+    of the chains if rules is an OrderedDict, or their names otherwise.
+    """
+    result = {}
+    sets = []
+    chainnames = list(rules.keys())
+    if not isinstance(rules, OrderedDict):
+        chainnames.sort()
+    for chainname in chainnames:
+        result[chainname], chain_sets = compile_chain(rules[chainname],
+            prefix, min_size, len(sets) + 1)
+        sets.extend(chain_sets)
+    return result, sets
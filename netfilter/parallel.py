@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import threading
+import time
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+class CommitError(Exception):
+    """The CommitError class is raised by commit() once every table has
+    been attempted, if any of them failed.
+    """
+    def __init__(self, errors, timings):
+        # list of (table, exception) tuples
+        self.errors = errors
+        # list of (table, seconds) tuples, see commit()
+        self.timings = timings
+
+    def __str__(self):
+        return '\n'.join([ "%r: %s" % (table, error)
+            for table, error in self.errors ])
+
+def commit(tables, restore=False, max_workers=8):
+    """Commits the buffered commands of several Tables in parallel, using
+    at most max_workers threads, so that the total time is set by the
+    slowest table rather than by the sum of all the tables.
+
+    Each table, whatever its namespace (see the netns argument of Table),
+    family or name, is committed on its own. Changes which would conflict
+    are serialized by iptables itself, through the host-wide xtables
+    lock which it waits for when it supports --wait. The restore
+    argument is passed on to Table.commit().
+
+    Returns a list of (table, seconds) tuples, in the order the tables
+    were given. If any table fails, the remaining ones are still
+    committed and a CommitError is raised at the end.
+    """
+    tables = list(tables)
+    timings = [None] * len(tables)
+    errors = [None] * len(tables)
+
+    queue = Queue()
+    for i in range(len(tables)):
+        queue.put(i)
+
+    def work():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except Empty:
+                return
+            start = time.time()
+            try:
+                tables[i].commit(restore=restore)
+            except Exception as e:
+                errors[i] = e
+            timings[i] = time.time() - start
+
+    threads = []
+    for i in range(min(max_workers, len(tables))):
+        thread = threading.Thread(target=work)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    result = list(zip(tables, timings))
+    failed = [ (tables[i], errors[i]) for i in range(len(tables))
+        if errors[i] is not None ]
+    if failed:
+        raise CommitError(failed, result)
+    return result
@@ -19,18 +19,22 @@
 #
 
 import re
+from collections import OrderedDict
 try:
     from UserDict import UserDict
 except ImportError:
     from collections import UserDict
 
+import netfilter.instrument
 import netfilter.rule
 
 # define useful regexps
 re_chain = re.compile(r'^:*([^\s]+) ([^\s]+) \[([0-9]+):([0-9]+)\]$')
-re_rule = re.compile(r'^\[([0-9]+):([0-9]+)\] -A ([^\s]+) (.*)$')
-re_word = re.compile(r'("[^"]*"|[^\s]+)')
+re_rule = re.compile(r'^(?:\[([0-9]+):([0-9]+)\] )?-A ([^\s]+)(?: (.*))?$')
+re_word = re.compile(r'("(?:[^"\\]|\\.)*"|[^\s]+)')
+re_escape = re.compile(r'\\(.)')
 re_main_opt = re.compile(r'^-([^-])$')
+re_unsafe = re.compile(r'[\s"\'\\]')
 
 class odict(UserDict):
     def __init__(self, dict = None):
@@ -47,9 +51,86 @@ class odict(UserDict):
 class ParseError(Exception):
     pass
 
+class ParseCache:
+    """The ParseCache class is a bounded LRU cache of parse results,
+    which keeps track of its hits and misses.
+    """
+    def __init__(self, maxsize = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data = OrderedDict()
+
+    def __len__(self):
+        return len(self.__data)
+
+    def clear(self):
+        """Removes all the entries and resets the statistics.
+        """
+        self.__data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the value stored for key, or None.
+        """
+        try:
+            value = self.__data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.__data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores a value, evicting the least recently used entry if
+        the cache is full.
+        """
+        self.__data[key] = value
+        if len(self.__data) > self.maxsize:
+            self.__data.popitem(last=False)
+
+    def stats(self):
+        """Returns a dictionary with the hits, misses, size and maxsize
+        of the cache.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.__data),
+            'maxsize': self.maxsize,
+        }
+
+# parse result caches, see enable_cache()
+rule_cache = None
+extension_cache = None
+
+def enable_cache(maxsize = 4096):
+    """
+    Enables the memoization of parse_rule() and of the parsing of
+    extension options given as strings. Each cache holds at most
+    maxsize entries. The cached results are immutable, callers always
+    get fresh Rule, Match and Target objects.
+    """
+    global rule_cache, extension_cache
+    rule_cache = ParseCache(maxsize)
+    extension_cache = ParseCache(maxsize)
+
+def disable_cache():
+    """
+    Disables the memoization of parse results.
+    """
+    global rule_cache, extension_cache
+    rule_cache = None
+    extension_cache = None
+
 def split_words(line):
     def unquote(x):
         if x and x[0] == '"':
+            # undo the escaping done by join_words()
+            if '\\' in x:
+                return re_escape.sub(r'\1', x[1:-1])
             return x[1:-1]
         else:
             return x
@@ -61,6 +142,37 @@ def split_words(line):
         # shortcut for the bulk of cases
         return line.split()
 
+def join_words(bits):
+    def quote(x):
+        if x and not re_unsafe.search(x):
+            return x
+        return '"%s"' % x.replace('\\', '\\\\').replace('"', '\\"')
+
+    return ' '.join([ quote(x) for x in bits ])
+
+def format_rule(chainname, rule, counters = False):
+    """
+    Formats a Rule as a line of iptables-save output, without the
+    trailing newline. If counters is true, the line is prefixed with the
+    packet and byte counters of the rule.
+    """
+    spec = rule.spec()
+    if spec:
+        line = '-A %s %s' % (chainname, spec)
+    else:
+        line = '-A %s' % chainname
+    if counters:
+        return '[%d:%d] %s' % (rule.packets, rule.bytes, line)
+    return line
+
+def format_rules(chainname, rules, counters = False):
+    """
+    Formats a list of Rules as iptables-save output, one line per rule,
+    see format_rule().
+    """
+    return ''.join([ format_rule(chainname, rule, counters) + '\n'
+        for rule in rules ])
+
 def pull_extension_opts(bits, pos):
     opt_bits = []
     while pos < len(bits) and not re_main_opt.match(bits[pos]):
@@ -68,6 +180,84 @@ def pull_extension_opts(bits, pos):
         pos += 1
     return opt_bits, pos
 
+def pull_extension(bits, pos, rewrite_options = {}, stop_at_main_opt = True):
+    """
+    Collects the options of a match or target extension in a single
+    pass, classifying bits with plain string checks. Option names are
+    rewritten to their canonical form using rewrite_options.
+
+    Returns the options dictionary and the position of the first bit
+    which was not consumed.
+    """
+    def is_main_opt(pos):
+        bit = bits[pos]
+        if bit == '!' and pos + 1 < count:
+            # negation of a main option, e.g. "! -s 1.2.3.4"
+            bit = bits[pos + 1]
+        return len(bit) == 2 and bit[0] == '-' and bit[1] != '-'
+
+    options = {}
+    prefix = ''
+    count = len(bits)
+    while pos < count:
+        if stop_at_main_opt and is_main_opt(pos):
+            break
+        bit = bits[pos]
+        if bit == '!':
+            prefix += '! '
+            pos += 1
+            continue
+
+        # get option name
+        if bit[:2] != '--':
+            raise ParseError("expected option, got: %s" % bit)
+        pos += 1
+        opt = bit[2:]
+        opt = netfilter.rule.intern(rewrite_options.get(opt, opt))
+
+        # collect value(s)
+        vals = []
+        while pos < count:
+            bit = bits[pos]
+            if bit[:2] == '--' or (stop_at_main_opt and
+                    (bit[:1] == '-' or bit == '!') and is_main_opt(pos)):
+                break
+            vals.append(bit)
+            pos += 1
+
+        if prefix:
+            opt = netfilter.rule.intern(prefix + opt)
+        options[opt] = vals
+        prefix = ''
+    return options, pos
+
+def thaw_options(items):
+    return dict([ (opt, list(vals)) for opt, vals in items ])
+
+def parse_extension_options(options, rewrite_options = {}):
+    """
+    Parses the options of a match or target extension given as a string
+    or as a list of bits, using the cache if it is enabled.
+    """
+    if isinstance(options, list):
+        return pull_extension(options, 0, rewrite_options, False)[0]
+
+    cache = extension_cache
+    if cache is None:
+        return pull_extension(split_words(options), 0, rewrite_options,
+            False)[0]
+
+    key = (options, id(rewrite_options))
+    cached = cache.get(key)
+    if cached is not None and cached[0] is rewrite_options:
+        return thaw_options(cached[1])
+
+    result = pull_extension(split_words(options), 0, rewrite_options,
+        False)[0]
+    items = [ (opt, tuple(vals)) for opt, vals in result.items() ]
+    cache.put(key, (rewrite_options, tuple(items)))
+    return result
+
 def pull_main_opt(bits, pos):
     val = bits[pos]
     pos += 1
@@ -77,12 +267,52 @@ def pull_main_opt(bits, pos):
     return val, pos
 
 def parse_rule(spec):
+    """
+    Parses a rule specification, as output by iptables-save, into a Rule.
+    """
+    cache = rule_cache
+    if cache is None:
+        return parse_rule_uncached(spec)
+
+    key = cache.get(spec)
+    if key is not None:
+        return thaw_rule(key)
+    rule = parse_rule_uncached(spec)
+    cache.put(spec, rule.key())
+    return rule
+
+def thaw_rule(key):
+    protocol, in_interface, out_interface, source, destination, \
+        goto, jump, matches = key
+    rule = netfilter.rule.Rule()
+    # the key is already canonical, only assign what is set
+    if protocol is not None:
+        rule.protocol = protocol
+    if in_interface is not None:
+        rule.in_interface = in_interface
+    if out_interface is not None:
+        rule.out_interface = out_interface
+    if source is not None:
+        rule.source = source
+    if destination is not None:
+        rule.destination = destination
+    # extensions accept their frozen options as is
+    if goto is not None:
+        rule.goto = netfilter.rule.Target(goto[0], goto[1])
+    if jump is not None:
+        rule.jump = netfilter.rule.Target(jump[0], jump[1])
+    for name, items in matches:
+        rule.matches.append(netfilter.rule.Match(name, items))
+    return rule
+
+def parse_rule_uncached(spec):
     rule = netfilter.rule.Rule()
     bits = split_words(spec)
+    count = len(bits)
     pos = 0
-    while pos < len(bits):
+    while pos < count:
         # in iptables 1.4.3, negation moved before the match option
-        if bits[pos] == '!' and pos < len(bits) - 1:
+        if bits[pos] == '!' and pos < count - 1:
             bits[pos] = bits[pos+1]
             bits[pos+1] = '!'
         bit = bits[pos]
@@ -93,15 +323,16 @@ def parse_rule(spec):
             rule.in_interface, pos = pull_main_opt(bits, pos)
         elif bit == '-g':
             target_name = bits[pos]
-            opts, pos = pull_extension_opts(bits, pos + 1)
+            opts, pos = pull_extension(bits, pos + 1)
             rule.goto = netfilter.rule.Target(target_name, opts)
         elif bit == '-j':
             target_name = bits[pos]
-            opts, pos = pull_extension_opts(bits, pos + 1)
+            opts, pos = pull_extension(bits, pos + 1)
             rule.jump = netfilter.rule.Target(target_name, opts)
         elif bit == '-m':
             match_name = bits[pos]
-            opts, pos = pull_extension_opts(bits, pos + 1) 
+            opts, pos = pull_extension(bits, pos + 1,
+                netfilter.rule.match_rewrite_options)
             rule.matches.append(
                 netfilter.rule.Match(match_name, opts))
         elif bit == '-o':
@@ -132,6 +363,96 @@ def parse_chains(data):
             }
     return chains
 
+def iterparse(lines):
+    """
+    Parse an iptables-save dump incrementally, from any iterable of lines
+    such as a file object or a subprocess pipe. Yields tuples of the form:
+
+      ('chain', table, chain, {'policy': ..., 'packets': ..., 'bytes': ...})
+      ('rule', table, chain, rule)
+    """
+    events = iterparse_events(lines)
+    if netfilter.instrument.sinks:
+        return netfilter.instrument.iterparsed('iterparse', events)
+    return events
+
+def iterparse_events(lines):
+    table = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf8')
+        if line.startswith('*'):
+            table = line[1:].strip()
+            continue
+        m = re_rule.match(line)
+        if m:
+            rule = parse_rule(m.group(4) or '')
+            rule.packets = int(m.group(1) or 0)
+            rule.bytes = int(m.group(2) or 0)
+            yield 'rule', table, m.group(3), rule
+            continue
+        m = re_chain.match(line)
+        if m:
+            policy = None
+            if m.group(2) != '-':
+                policy = m.group(2)
+            yield 'chain', table, m.group(1), {
+                'policy': policy,
+                'packets': int(m.group(3)),
+                'bytes': int(m.group(4)),
+            }
+
+def parse_table(data):
+    """
+    Parse the chain definitions and split the rules by chain in a
+    single pass. The rules are returned as (packets, bytes, spec)
+    tuples and are left for parse_rule() to process.
+    """
+    tables = parse_tables(data)
+    for name in tables.keys():
+        return tables[name]
+    return odict(), {}
+
+def parse_tables(data):
+    """
+    Parse a complete iptables-save dump, covering any number of tables,
+    in a single pass. data is either a string or an iterable of lines.
+    Returns an ordered dictionary mapping table names to (chains, entries)
+    tuples, in the format returned by parse_table().
+    """
+    if hasattr(data, 'splitlines'):
+        data = data.splitlines(True)
+
+    tables = odict()
+    chains = entries = None
+    for line in data:
+        if isinstance(line, bytes):
+            line = line.decode('utf8')
+        m = re_rule.match(line)
+        if m:
+            if entries is None:
+                chains, entries = tables[None] = (odict(), {})
+            entries.setdefault(m.group(3), []).append(
+                (int(m.group(1) or 0), int(m.group(2) or 0),
+                 m.group(4) or ''))
+            continue
+        m = re_chain.match(line)
+        if m:
+            if chains is None:
+                chains, entries = tables[None] = (odict(), {})
+            policy = None
+            if m.group(2) != '-':
+                policy = m.group(2)
+            chains[m.group(1)] = {
+                'policy': policy,
+                'packets': int(m.group(3)),
+                'bytes': int(m.group(4)),
+            }
+        elif line.startswith('*'):
+            chains, entries = tables[line[1:].strip()] = (odict(), {})
+    return tables
+
+@netfilter.instrument.parsed(len)
 def parse_rules(data, chain):
     """
     Parse the rules for the specified chain.
@@ -140,8 +461,8 @@ def parse_rules(data, chain):
     for line in data.splitlines(True):
         m = re_rule.match(line)
         if m and m.group(3) == chain:
-            rule = parse_rule(m.group(4))
-            rule.packets = int(m.group(1))
-            rule.bytes = int(m.group(2))
+            rule = parse_rule(m.group(4) or '')
+            rule.packets = int(m.group(1) or 0)
+            rule.bytes = int(m.group(2) or 0)
             rules.append(rule)
     return rules
@@ -19,30 +19,69 @@
 #
 
 import logging
-import re
+try:
+    from sys import intern
+except ImportError:
+    # Python 2 can only intern byte strings
+    import __builtin__
+    def intern(value):
+        if isinstance(value, str):
+            return __builtin__.intern(value)
+        return value
 
 import netfilter.parser
 
-# define useful regexps
-re_extension_opt = re.compile(r'^--(.*)$')
+# canonical names of match options
+match_rewrite_options = {
+    'destination-port': 'dport',
+    'destination-ports': 'dports',
+    'source-port': 'sport',
+    'source-ports': 'sports',
+}
 
-class Extension:
+class Extension(object):
     """The Extension class is the base class for iptables match and target
     extensions.
     """
+    # options are stored as a sorted tuple of (name, values) items, which
+    # is turned into a dictionary the first time options() is called.
+    # While options are still a tuple, they cannot change and the
+    # rendered arguments are kept.
+    __slots__ = ('__name', '__options', '__specbits', '__spec')
+
     def __init__(self, name, options, rewrite_options = {}):
-        self.__name = name
-        self.__options = {}
-        self.__rewrite_options = rewrite_options
-        if options:
-            self.__parse_options(options)
+        self.__name = intern(name)
+        self.__specbits = None
+        self.__spec = None
+        if isinstance(options, tuple):
+            # already in canonical form, see key()
+            self.__options = options
+            return
+
+        if isinstance(options, dict):
+            # already parsed, see netfilter.parser.pull_extension()
+            pass
+        elif options:
+            options = netfilter.parser.parse_extension_options(
+                options, rewrite_options)
+        else:
+            options = {}
+        items = []
+        for opt, optval in options.items():
+            if isinstance(optval, list):
+                optval = tuple(optval)
+            items.append((opt, optval))
+        items.sort()
+        self.__options = tuple(items)
 
     def __eq__(self, other):
         if isinstance(other, Extension):
-            return self.__name == other.__name and \
-                self.__options == other.__options
+            return self.key() == other.key()
         else:
             return NotImplemented
+
+    def __hash__(self):
+        return hash(self.key())
     
     def __ne__(self, other):
         result = self.__eq__(other)
@@ -50,49 +89,27 @@ class Extension:
             return result
         return not result
 
-    def __parse_options(self, options):
-        if isinstance(options, list):
-            bits = options
-        else:
-            bits = netfilter.parser.split_words(options)
-        
-        pos = 0
-        cur_opt = []
-        while pos < len(bits):
-            if bits[pos] == '!':
-                cur_opt.append(bits[pos])
-                pos += 1
-                continue
-            
-            # get option name
-            m = re_extension_opt.match(bits[pos])
-            if not m:
-                raise Exception("expected option, got: %s" % bits[pos])
-            pos += 1
-            # rewrite option to its canonical name
-            tmp_opt = m.group(1)
-            if tmp_opt in self.__rewrite_options:
-                tmp_opt = self.__rewrite_options[tmp_opt]
-            cur_opt.append(tmp_opt)
-            
-            # collect value(s)
-            vals = []
-            while pos < len(bits) and not re_extension_opt.match(bits[pos]):
-                vals.append(bits[pos])
-                pos += 1
-            
-            # store option
-            opt = ' '.join(cur_opt)
-            self.__options[opt] = vals
-            
-            # reset current option name
-            cur_opt = []
+    def key(self):
+        """Returns a hashable representation of the Extension, which
+        does not depend on the order of its options.
+        """
+        options = self.__options
+        if isinstance(options, tuple):
+            return (self.__name, options)
+
+        items = []
+        for opt, optval in options.items():
+            if isinstance(optval, list):
+                optval = tuple(optval)
+            items.append((opt, optval))
+        items.sort()
+        return (self.__name, tuple(items))
 
     def log(self, level, prefix = ''):
         """Writes the contents of the Extension to the logging system.
         """
         logging.log(level, "%sname: %s", prefix, self.__name)
-        logging.log(level, "%soptions: %s", prefix, self.__options)
+        logging.log(level, "%soptions: %s", prefix, self.options())
     
     def name(self):
         """Accessor for the Extension's name.
@@ -102,62 +119,106 @@ class Extension:
     def options(self):
         """Accessor for the Extension's options.
         """
-        return self.__options
+        options = self.__options
+        if isinstance(options, tuple):
+            options = {}
+            for opt, optval in self.__options:
+                if isinstance(optval, tuple):
+                    optval = list(optval)
+                options[opt] = optval
+            # the options may now be modified by the caller
+            self.__options = options
+            self.__specbits = None
+            self.__spec = None
+        return options
     
+    def spec(self):
+        """Returns the name of the Extension followed by its arguments
+        as a single string, quoted as in the output of iptables-save.
+        """
+        spec = self.__spec
+        if spec is None:
+            spec = netfilter.parser.join_words(
+                (self.__name,) + self.__render())
+            if isinstance(self.__options, tuple):
+                self.__spec = spec
+        return spec
+
     def specbits(self):
         """Returns the array of arguments that would be given to
         iptables for the current Extension.
         """
+        return list(self.__render())
+
+    def __render(self):
+        bits = self.__specbits
+        if bits is not None:
+            return bits
+
         bits = []
-        for opt in sorted(self.__options):
+        for opt, optval in self.key()[1]:
             # handle the case where this is a negated option
-            m = re.match(r'^! (.*)', opt)
-            if m:
-                bits.extend(['!', "--%s" % m.group(1)])
+            if opt[:2] == '! ':
+                bits.append('!')
+                bits.append('--' + opt[2:])
             else:
-                bits.append("--%s" % opt)
-                
-            optval = self.__options[opt]
-            if isinstance(optval, list):
+                bits.append('--' + opt)
+
+            if isinstance(optval, tuple):
                 bits.extend(optval)
             else:
                 bits.append(optval)
+        bits = tuple(bits)
+        if isinstance(self.__options, tuple):
+            self.__specbits = bits
         return bits
 
 class Match(Extension):
     """The Match class represents an iptables match extension, for
     instance 'multiport'.
     """
+    __slots__ = ()
+
     def __init__(self, name, options = None):
-        Extension.__init__(self, name, options, {
-            'destination-port': 'dport',
-            'destination-ports': 'dports',
-            'source-port': 'sport',
-            'source-ports': 'sports'})
+        Extension.__init__(self, name, options, match_rewrite_options)
     
 class Target(Extension):
     """The Target class represents an iptables target, which can be
     used in the 'jump' statement of a rule.
     """
+    __slots__ = ()
+
     def __init__(self, name, options = None):
         Extension.__init__(self, name, options)
     
-class Rule:
+class Rule(object):
     """The Rule represents an iptables rule.
+
+    Rules can be used as dictionary keys or set members, provided they
+    are not modified while in use.
     """
+    # the standard attributes live in slots, a dictionary is only
+    # allocated for any other attributes. The rendered protocol,
+    # interfaces and addresses are kept until one of them is modified.
+    __slots__ = ('protocol', 'destination', 'source', 'goto', 'jump',
+        'in_interface', 'out_interface', 'matches', 'packets', 'bytes',
+        '__host', '__dict__')
+
     def __init__(self, **kwargs):
-        # initialise rule definition
-        self.protocol = None
-        self.destination = None
-        self.source = None
-        self.goto = None
-        self.jump = None
-        self.in_interface = None
-        self.out_interface = None
-        self.matches = []
+        # initialise rule definition, the defaults need no checks
+        init = object.__setattr__
+        init(self, 'protocol', None)
+        init(self, 'destination', None)
+        init(self, 'source', None)
+        init(self, 'goto', None)
+        init(self, 'jump', None)
+        init(self, 'in_interface', None)
+        init(self, 'out_interface', None)
+        init(self, 'matches', [])
         # initialise counters
-        self.packets = 0
-        self.bytes = 0
+        init(self, 'packets', 0)
+        init(self, 'bytes', 0)
+        init(self, '_Rule__host', None)
         # assign supplied arguments
         for k, v in kwargs.items():
             self.__setattr__(k, v)
@@ -181,19 +242,34 @@ class Rule:
             return result
         return not result
 
+    def __hash__(self):
+        return hash(self.key())
+
     def __setattr__(self, name, value):
         if name == 'source' or name == 'destination':
             # produce "canonical" form of a source / destination
             # FIXME: we need to handle arbitrary netmasks here
-            if value is not None and value.endswith('/32'):
-                value = value[:-3] 
+            if value is None:
+                pass
+            elif ':' in value:
+                if value.endswith('/128'):
+                    value = value[:-4]
+            elif value.endswith('/32'):
+                value = value[:-3]
+            object.__setattr__(self, '_Rule__host', None)
         elif name == 'goto' or name == 'jump': 
             if value is not None and not isinstance(value, Target):
                 value = Target(value)
         elif name == 'matches':
             if not isinstance(value, list):
                 raise Exception("matches attribute requires a list")
-        self.__dict__[name] = value
+        elif name == 'protocol' or name == 'in_interface' or \
+             name == 'out_interface':
+            # these are shared by many rules
+            if value is not None:
+                value = intern(value)
+            object.__setattr__(self, '_Rule__host', None)
+        object.__setattr__(self, name, value)
 
     def find(self, rules):
         """Convenience method that finds the current Rule in a list.
@@ -203,6 +279,20 @@ class Rule:
                 return rule
         return None
 
+    def key(self):
+        """Returns a hashable representation of the Rule, which only
+        depends on the criteria compared by the equality operator.
+        """
+        def extension_key(ext):
+            if ext is None:
+                return None
+            return ext.key()
+
+        return (self.protocol, self.in_interface, self.out_interface,
+            self.source, self.destination,
+            extension_key(self.goto), extension_key(self.jump),
+            tuple([ match.key() for match in self.matches ]))
+
     def log(self, level, prefix = ''):
         """Writes the contents of the Rule to the logging system.
         """
@@ -217,37 +307,59 @@ class Rule:
             logging.log(level, "%sjump:", prefix)
             self.jump.log(level, prefix + '  ')
 
+    def spec(self):
+        """Returns the arguments that would be given to iptables for
+        the current Rule as a single string, quoted as in the output of
+        iptables-save.
+        """
+        host = self.__render_host()[1]
+        parts = host and [host] or []
+        for mod in self.matches:
+            parts.append('-m ' + mod.spec())
+        if self.goto:
+            parts.append('-g ' + self.goto.spec())
+        elif self.jump:
+            parts.append('-j ' + self.jump.spec())
+        return ' '.join(parts)
+
     def specbits(self):
         """Returns the array of arguments that would be given to
         iptables for the current Rule.
         """
-        def host_bits(opt, optval):
-            # handle the case where this is a negated value
-            m = re.match(r'^!\s*(.*)', optval)
-            if m:
-                return ['!', opt, m.group(1)]
-            else:
-                return [opt, optval]
-
-        bits = []
-        if self.protocol:
-            bits.extend(host_bits('-p', self.protocol))
-        if self.in_interface:
-            bits.extend(host_bits('-i', self.in_interface))
-        if self.out_interface:
-            bits.extend(host_bits('-o', self.out_interface))
-        if self.source:
-            bits.extend(host_bits('-s', self.source))
-        if self.destination:
-            bits.extend(host_bits('-d', self.destination))
+        bits = list(self.__render_host()[0])
         for mod in self.matches:
-            bits.extend(['-m', mod.name()])
+            bits.append('-m')
+            bits.append(mod.name())
             bits.extend(mod.specbits())
         if self.goto:
-            bits.extend(['-g', self.goto.name()])
+            bits.append('-g')
+            bits.append(self.goto.name())
             bits.extend(self.goto.specbits())
         elif self.jump:
-            bits.extend(['-j', self.jump.name()])
+            bits.append('-j')
+            bits.append(self.jump.name())
             bits.extend(self.jump.specbits())
         return bits
 
+    def __render_host(self):
+        host = self.__host
+        if host is not None:
+            return host
+
+        bits = []
+        for opt, optval in (('-p', self.protocol),
+                            ('-i', self.in_interface),
+                            ('-o', self.out_interface),
+                            ('-s', self.source),
+                            ('-d', self.destination)):
+            if not optval:
+                continue
+            # handle the case where this is a negated value
+            if optval[:1] == '!':
+                bits.extend(['!', opt, optval[1:].lstrip()])
+            else:
+                bits.extend([opt, optval])
+        host = (tuple(bits), netfilter.parser.join_words(bits))
+        object.__setattr__(self, '_Rule__host', host)
+        return host
+
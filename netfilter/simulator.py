@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import socket
+import struct
+
+# targets which end the traversal of the table, CT and NOTRACK let the
+# packet carry on like LOG does
+terminating_targets = set([
+    'ACCEPT', 'DROP', 'REJECT', 'QUEUE', 'NFQUEUE', 'DNAT', 'SNAT',
+    'MASQUERADE', 'REDIRECT', 'NETMAP', 'TPROXY',
+])
+
+# protocol numbers as printed by iptables-save when it has no name
+protocol_names = {
+    '1': 'icmp',
+    '6': 'tcp',
+    '17': 'udp',
+    '58': 'ipv6-icmp',
+    '132': 'sctp',
+    'icmpv6': 'ipv6-icmp',
+}
+
+# give up on rulesets which loop through their chains
+MAX_DEPTH = 64
+
+class SimulatorError(Exception):
+    pass
+
+class Packet:
+    """The Packet class describes a packet to be evaluated by a Simulator.
+
+    Its attributes are in_interface, out_interface, source, destination,
+    protocol, sport, dport, state (e.g. 'NEW'), tcp_flags (a list of
+    flags which are set, e.g. ['SYN']), icmp_type and mark. Any of them
+    may be left out.
+    """
+    def __init__(self, **kwargs):
+        self.in_interface = None
+        self.out_interface = None
+        self.source = None
+        self.destination = None
+        self.protocol = None
+        self.sport = None
+        self.dport = None
+        self.state = None
+        self.tcp_flags = None
+        self.icmp_type = None
+        self.mark = 0
+        for k, v in kwargs.items():
+            if not hasattr(self, k):
+                raise TypeError("unknown packet attribute '%s'" % k)
+            setattr(self, k, v)
+
+def parse_address(value):
+    """Parses an IPv4 or IPv6 address into a (bits, integer) tuple.
+    """
+    if ':' in value:
+        high, low = struct.unpack('!QQ',
+            socket.inet_pton(socket.AF_INET6, value))
+        return 128, (high << 64) | low
+    return 32, struct.unpack('!I', socket.inet_aton(value))[0]
+
+def parse_network(value):
+    """Parses a network such as '10.0.0.0/8' or '10.0.0.0/255.0.0.0'
+    into a (bits, network, prefix length) tuple.
+    """
+    if '/' in value:
+        addr, length = value.split('/', 1)
+    else:
+        addr, length = value, None
+    bits, network = parse_address(addr)
+    if length is None:
+        length = bits
+    elif '.' in length or ':' in length:
+        # a netmask, which iptables only prints when it is not a prefix
+        mask = parse_address(length)[1]
+        length = bin(mask).count('1')
+        if mask != ((1 << bits) - 1) ^ ((1 << (bits - length)) - 1):
+            raise SimulatorError("unsupported netmask: %s" % value)
+    else:
+        length = int(length)
+    network &= ((1 << bits) - 1) ^ ((1 << (bits - length)) - 1)
+    return bits, network, length
+
+def split_negation(value):
+    if value[:1] == '!':
+        return True, value[1:].lstrip()
+    return False, value
+
+def normalize_protocol(value):
+    value = value.lower()
+    return protocol_names.get(value, value)
+
+def parse_ports(value):
+    """Parses a port specification such as '22', '1000:2000' or
+    '22,80,1000:2000' into a list of (first, last) ranges.
+    """
+    ranges = []
+    for part in value.split(','):
+        if ':' in part:
+            first, last = part.split(':', 1)
+            ranges.append((int(first or 0), int(last or 65535)))
+        else:
+            ranges.append((int(part), int(part)))
+    return ranges
+
+def exact_ports(ranges):
+    # single ports can be indexed, ranges cannot
+    for first, last in ranges:
+        if first != last:
+            return None
+    return [ first for first, last in ranges ]
+
+def negate(predicate, negated):
+    if negated:
+        return lambda packet: not predicate(packet)
+    return predicate
+
+def match_ports(attr, value):
+    negated, value = split_negation(value)
+    ranges = parse_ports(value)
+
+    def predicate(packet):
+        port = getattr(packet, attr)
+        if port is None:
+            return False
+        for first, last in ranges:
+            if first <= port <= last:
+                return True
+        return False
+
+    # the packet must have the port at all, even for negated matches
+    if negated:
+        return lambda packet: getattr(packet, attr) is not None and \
+            not predicate(packet)
+    return predicate
+
+def match_any_port(value):
+    sport = match_ports('sport', value)
+    dport = match_ports('dport', value)
+    negated, value = split_negation(value)
+    if negated:
+        return lambda packet: sport(packet) and dport(packet)
+    return lambda packet: sport(packet) or dport(packet)
+
+def match_values(attr, value, convert=None):
+    negated, value = split_negation(value)
+    values = set(value.split(','))
+
+    def predicate(packet):
+        current = getattr(packet, attr)
+        if convert is not None:
+            current = convert(current)
+        return current in values
+
+    return negate(predicate, negated)
+
+def match_tcp_flags(mask, comp, negated):
+    mask = set(mask.split(','))
+    comp = set(comp.split(','))
+    if 'ALL' in mask:
+        mask = set(['FIN', 'SYN', 'RST', 'PSH', 'ACK', 'URG'])
+    if 'NONE' in comp:
+        comp = set()
+
+    def predicate(packet):
+        flags = set(packet.tcp_flags or [])
+        return (flags & mask) == comp
+
+    return negate(predicate, negated)
+
+def match_mark(attr, value):
+    negated, value = split_negation(value)
+    if '/' in value:
+        mark, mask = [ int(x, 0) for x in value.split('/', 1) ]
+    else:
+        mark, mask = int(value, 0), 0xffffffff
+    return negate(lambda packet: (getattr(packet, attr) or 0) & mask == mark,
+        negated)
+
+def option_value(opt, vals):
+    # a negated option is stored as '! name', pass its values on as
+    # '! value' so that all the matchers handle negation the same way
+    value = ' '.join(vals)
+    if opt[:2] == '! ':
+        return opt[2:], '! ' + value
+    return opt, value
+
+def compile_ports_match(name, options):
+    predicates = []
+    for opt, value in options:
+        if opt == 'dport':
+            predicates.append(match_ports('dport', value))
+        elif opt == 'sport':
+            predicates.append(match_ports('sport', value))
+        elif opt == 'syn':
+            predicates.append(match_tcp_flags('SYN,RST,ACK,FIN', 'SYN',
+                value[:1] == '!'))
+        elif opt == 'tcp-flags':
+            negated, value = split_negation(value)
+            mask, comp = value.split()
+            predicates.append(match_tcp_flags(mask, comp, negated))
+        else:
+            raise SimulatorError("unsupported %s option: %s" % (name, opt))
+    return predicates
+
+def compile_multiport(name, options):
+    predicates = []
+    for opt, value in options:
+        if opt in ('dports', 'dport'):
+            predicates.append(match_ports('dport', value))
+        elif opt in ('sports', 'sport'):
+            predicates.append(match_ports('sport', value))
+        elif opt in ('ports', 'port'):
+            predicates.append(match_any_port(value))
+        else:
+            raise SimulatorError("unsupported %s option: %s" % (name, opt))
+    return predicates
+
+def compile_state(name, options):
+    predicates = []
+    for opt, value in options:
+        if opt not in ('state', 'ctstate'):
+            raise SimulatorError("unsupported %s option: %s" % (name, opt))
+        predicates.append(match_values('state', value))
+    return predicates
+
+def compile_icmp(name, options):
+    predicates = []
+    for opt, value in options:
+        if opt not in ('icmp-type', 'icmpv6-type'):
+            raise SimulatorError("unsupported %s option: %s" % (name, opt))
+        predicates.append(match_values('icmp_type', value, str))
+    return predicates
+
+def compile_mark(name, options):
+    predicates = []
+    for opt, value in options:
+        if opt != 'mark':
+            raise SimulatorError("unsupported %s option: %s" % (name, opt))
+        predicates.append(match_mark('mark', value))
+    return predicates
+
+def compile_comment(name, options):
+    return []
+
+# functions which turn the options of a match into a list of predicates,
+# they are given the match name and a list of (option, value) tuples
+match_compilers = {
+    'comment': compile_comment,
+    'icmp': compile_icmp,
+    'icmp6': compile_icmp,
+    'mark': compile_mark,
+    'multiport': compile_multiport,
+    'conntrack': compile_state,
+    'sctp': compile_ports_match,
+    'state': compile_state,
+    'tcp': compile_ports_match,
+    'udp': compile_ports_match,
+}
+
+def match_interface(attr, value):
+    negated, value = split_negation(value)
+    if value.endswith('+'):
+        prefix = value[:-1]
+        predicate = lambda packet: (getattr(packet, attr) or '').startswith(
+            prefix)
+    else:
+        predicate = lambda packet: getattr(packet, attr) == value
+    return negate(predicate, negated)
+
+def match_network(attr, value):
+    negated, value = split_negation(value)
+    bits, network, length = parse_network(value)
+    mask = ((1 << bits) - 1) ^ ((1 << (bits - length)) - 1)
+
+    def predicate(packet):
+        address = getattr(packet, attr)
+        if address is None:
+            return False
+        address_bits, address = address
+        return address_bits == bits and address & mask == network
+
+    return negate(predicate, negated)
+
+def match_protocol(value):
+    negated, value = split_negation(value)
+    value = normalize_protocol(value)
+    if value == 'all':
+        predicate = lambda packet: True
+    else:
+        predicate = lambda packet: packet.protocol == value
+    return negate(predicate, negated)
+
+class Index:
+    """The Index class maps the values of a packet field to the set of
+    rules which may match them, as a bitmask of rule numbers. Rules
+    which cannot be indexed on the field match any value.
+    """
+    def __init__(self):
+        self.any = 0
+        self.values = {}
+        self.negated = 0
+        self.negated_values = {}
+
+    def add(self, position, values, negated=False):
+        bit = 1 << position
+        if values is None:
+            self.any |= bit
+        elif negated:
+            # the rule matches any value but these
+            self.negated |= bit
+            for value in values:
+                self.negated_values[value] = \
+                    self.negated_values.get(value, 0) | bit
+        else:
+            for value in values:
+                self.values[value] = self.values.get(value, 0) | bit
+
+    def lookup(self, value):
+        mask = self.any | self.values.get(value, 0)
+        if self.negated:
+            mask |= self.negated & ~self.negated_values.get(value, 0)
+        return mask
+
+class PrefixIndex:
+    """The PrefixIndex class maps addresses to the set of rules whose
+    network may contain them, with one table per prefix length.
+    """
+    def __init__(self):
+        self.any = 0
+        self.tables = {}
+
+    def add(self, position, network):
+        bit = 1 << position
+        if network is None:
+            self.any |= bit
+        else:
+            bits, network, length = network
+            table = self.tables.setdefault((bits, length), {})
+            key = network >> (bits - length)
+            table[key] = table.get(key, 0) | bit
+
+    def lookup(self, address, max_length=None):
+        """Returns the rules whose network contains the address, only
+        considering prefixes up to max_length bits if it is set.
+        """
+        mask = self.any
+        if address is None:
+            return mask
+        bits, address = address
+        for table_bits, length in self.tables:
+            if table_bits == bits and (max_length is None or
+                                       length <= max_length):
+                mask |= self.tables[(bits, length)].get(
+                    address >> (bits - length), 0)
+        return mask
+
+class CompiledChain:
+    """The CompiledChain class holds the rules of a chain along with the
+    indexes used to skip the rules which cannot match a packet.
+    """
+    def __init__(self, name, rules, policy):
+        self.name = name
+        self.policy = policy
+        self.rules = rules
+        self.predicates = []
+        self.protocols = Index()
+        self.dports = Index()
+        self.in_interfaces = Index()
+        self.states = Index()
+        self.sources = PrefixIndex()
+        self.destinations = PrefixIndex()
+        for position, rule in enumerate(rules):
+            self.__add(position, rule)
+
+    def __add(self, position, rule):
+        predicates = []
+        protocol = dport = in_interface = state = None
+        protocol_negated = in_interface_negated = state_negated = False
+        source = destination = None
+
+        if rule.protocol:
+            predicates.append(match_protocol(rule.protocol))
+            protocol_negated, value = split_negation(rule.protocol)
+            value = normalize_protocol(value)
+            if value != 'all':
+                protocol = [value]
+        if rule.in_interface:
+            predicates.append(match_interface('in_interface',
+                rule.in_interface))
+            in_interface_negated, value = split_negation(rule.in_interface)
+            if not value.endswith('+'):
+                in_interface = [value]
+        if rule.out_interface:
+            predicates.append(match_interface('out_interface',
+                rule.out_interface))
+        if rule.source:
+            predicates.append(match_network('source', rule.source))
+            negated, value = split_negation(rule.source)
+            if not negated:
+                source = parse_network(value)
+        if rule.destination:
+            predicates.append(match_network('destination', rule.destination))
+            negated, value = split_negation(rule.destination)
+            if not negated:
+                destination = parse_network(value)
+
+        for match in rule.matches:
+            name, items = match.key()
+            compiler = match_compilers.get(name)
+            if compiler is None:
+                raise SimulatorError("unsupported match: %s" % name)
+            options = [ option_value(opt, vals) for opt, vals in items ]
+            predicates.extend(compiler(name, options))
+            for opt, value in options:
+                if opt in ('state', 'ctstate'):
+                    state_negated, value = split_negation(value)
+                    state = value.split(',')
+                elif opt in ('dport', 'dports') and value[:1] != '!':
+                    dport = exact_ports(parse_ports(value))
+
+        self.predicates.append(predicates)
+        self.protocols.add(position, protocol, protocol_negated)
+        self.dports.add(position, dport)
+        self.in_interfaces.add(position, in_interface, in_interface_negated)
+        self.states.add(position, state, state_negated)
+        self.sources.add(position, source)
+        self.destinations.add(position, destination)
+
+    def candidates(self, packet):
+        """Returns the bitmask of the rules which may match the packet.
+        """
+        return self.protocols.lookup(packet.protocol) & \
+            self.dports.lookup(packet.dport) & \
+            self.in_interfaces.lookup(packet.in_interface) & \
+            self.states.lookup(packet.state) & \
+            self.sources.lookup(packet.source) & \
+            self.destinations.lookup(packet.destination)
+
+class Simulator:
+    """The Simulator class evaluates packets against a table, following
+    jumps and gotos to user-defined chains, RETURN targets and the
+    policies of built-in chains, without touching the kernel.
+    """
+    def __init__(self, rules, policies=None):
+        """Constructs a new Simulator.
+
+        rules is a dictionary mapping chain names to lists of Rules,
+        policies an optional dictionary mapping built-in chain names to
+        their policy. The chains are compiled once, so many packets can
+        be evaluated quickly.
+        """
+        if policies is None:
+            policies = {}
+        self.__chains = {}
+        for chainname in rules:
+            self.__chains[chainname] = CompiledChain(chainname,
+                list(rules[chainname]), policies.get(chainname))
+        for chainname in policies:
+            if chainname not in self.__chains:
+                self.__chains[chainname] = CompiledChain(chainname, [],
+                    policies[chainname])
+
+    def evaluate(self, chainname, packet):
+        """Evaluates a Packet starting from the specified chain.
+
+        Returns a (verdict, path) tuple. The verdict is the name of the
+        terminating target, the policy of the chain if no rule decided,
+        or None if the chain has no policy. The path lists the rules
+        which matched, as (chain name, rule number, Rule) tuples with
+        rule numbers starting at 1.
+        """
+        packet = self.__prepare(packet)
+        path = []
+        verdict = self.__walk(chainname, packet, path, 0)
+        if verdict is None:
+            verdict = self.__chains[chainname].policy
+        return verdict, path
+
+    def cost(self, chainname, packets):
+        """Returns the average number of rules the kernel evaluates for
+        the given Packets starting from the specified chain, counting
+        every rule it walks through in turn up to the verdict.
+        """
+        evaluated = [0]
+        for packet in packets:
+            self.__walk(chainname, self.__prepare(packet), [], 0, evaluated)
+        return float(evaluated[0]) / max(1, len(packets))
+
+    def __prepare(self, packet):
+        # parse the addresses once for all the chains
+        prepared = Packet()
+        prepared.__dict__.update(packet.__dict__)
+        if packet.source is not None:
+            prepared.source = parse_address(packet.source)
+        if packet.destination is not None:
+            prepared.destination = parse_address(packet.destination)
+        if packet.protocol is not None:
+            prepared.protocol = normalize_protocol(packet.protocol)
+        return prepared
+
+    def __walk(self, chainname, packet, path, depth, evaluated=None):
+        # returns a verdict, or None if the chain returned. If evaluated
+        # is given, the number of rules walked through is added to it.
+        if depth > MAX_DEPTH:
+            raise SimulatorError("too many nested chains in %s" % chainname)
+        chain = self.__chains.get(chainname)
+        if chain is None:
+            raise SimulatorError("no such chain: %s" % chainname)
+
+        # walk the bits of the mask from the lowest one
+        bits = bin(chain.candidates(packet))[:1:-1]
+        predicates = chain.predicates
+        position = bits.find('1')
+        while position >= 0:
+            next_position = bits.find('1', position + 1)
+            matched = True
+            for predicate in predicates[position]:
+                if not predicate(packet):
+                    matched = False
+                    break
+            if not matched:
+                position = next_position
+                continue
+
+            rule = chain.rules[position]
+            path.append((chainname, position + 1, rule))
+            count = position + 1
+            position = next_position
+            target = rule.goto or rule.jump
+            if target is None:
+                continue
+            name = target.name()
+            if name == 'RETURN' or name in terminating_targets:
+                if evaluated is not None:
+                    evaluated[0] += count
+                if name == 'RETURN':
+                    return None
+                return name
+            if name in self.__chains:
+                verdict = self.__walk(name, packet, path, depth + 1,
+                    evaluated)
+                if verdict is not None or rule.goto is not None:
+                    # falling off the end of a goto returns to our caller
+                    if evaluated is not None:
+                        evaluated[0] += count
+                    return verdict
+            # other targets, such as LOG, let the packet carry on
+        if evaluated is not None:
+            evaluated[0] += len(chain.rules)
+        return None
+
+def from_snapshot(snapshot):
+    """Returns a Simulator for the contents of a TableSnapshot.
+    """
+    rules = {}
+    policies = {}
+    for chainname in snapshot.list_chains():
+        rules[chainname] = snapshot.list_rules(chainname)
+        policy = snapshot.get_policy(chainname)
+        if policy is not None:
+            policies[chainname] = policy
+    return Simulator(rules, policies)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+
+import netfilter.instrument
+import netfilter.parser
+
+def load(data):
+    """Loads a complete iptables-save dump, either a string or an
+    iterable of lines, in a single pass. Returns an ordered dictionary
+    mapping table names to TableSnapshots.
+    """
+    snapshots = netfilter.parser.odict()
+    tables = netfilter.parser.parse_tables(data)
+    for name in tables.keys():
+        chains, entries = tables[name]
+        snapshots[name] = TableSnapshot(name, chains, entries)
+    return snapshots
+
+def dump(snapshots, counters=False):
+    """Formats TableSnapshots as a complete iptables-save document, which
+    can be read back by load() or fed to iptables-restore. snapshots is
+    either an iterable of TableSnapshots or a dictionary mapping table
+    names to TableSnapshots, as returned by load(). If counters is true,
+    the packet and byte counters are included.
+    """
+    if hasattr(snapshots, 'keys'):
+        snapshots = [ snapshots[name] for name in snapshots.keys() ]
+    return ''.join([ snapshot.format(counters) for snapshot in snapshots ])
+
+def create(name, rules, policies=None):
+    """Builds a TableSnapshot from in-memory state, for instance to
+    write a ruleset with dump() and apply it in a single iptables-restore
+    call. rules is a dictionary mapping chain names to lists of Rules,
+    policies an optional dictionary mapping built-in chain names to
+    their policy. The counters of the Rules are kept.
+    """
+    chains = netfilter.parser.odict()
+    entries = {}
+    if policies:
+        for chainname in policies:
+            chains[chainname] = {
+                'policy': policies[chainname],
+                'packets': 0,
+                'bytes': 0,
+            }
+    for chainname in rules:
+        if chainname not in chains:
+            chains[chainname] = {
+                'policy': None,
+                'packets': 0,
+                'bytes': 0,
+            }
+        entries[chainname] = [ (rule.packets, rule.bytes, rule.spec())
+            for rule in rules[chainname] ]
+    return TableSnapshot(name, chains, entries)
+
+class TableSnapshot:
+    """The TableSnapshot class represents the contents of a netfilter
+    table at a given time, as returned by a single call to iptables-save.
+    """
+    def __init__(self, name, chains, entries):
+        """Constructs a new TableSnapshot.
+
+        chains is an ordered dictionary mapping chain names to their
+        definition (policy and counters), entries is a dictionary mapping
+        chain names to lists of (packets, bytes, spec) tuples, as returned
+        by netfilter.parser.parse_table(). The rules of a chain are only
+        parsed the first time they are requested.
+        """
+        self.name = name
+        self.timestamp = time.time()
+        self.__chains = chains
+        self.__entries = entries
+        self.__rules = {}
+
+    def age(self):
+        """Returns the number of seconds elapsed since the snapshot
+        was taken.
+        """
+        return time.time() - self.timestamp
+
+    def format(self, counters=False):
+        """Formats the table as an iptables-save document, see dump().
+        """
+        lines = ['*%s\n' % self.name]
+        for chainname in self.__chains.keys():
+            chain = self.__chains[chainname]
+            if counters:
+                packets, bytes = chain['packets'], chain['bytes']
+            else:
+                packets, bytes = 0, 0
+            lines.append(':%s %s [%d:%d]\n' % (chainname,
+                chain['policy'] or '-', packets, bytes))
+        for chainname in self.__chains.keys():
+            for packets, bytes, spec in self.__entries.get(chainname, []):
+                spec = spec.rstrip()
+                if spec:
+                    line = '-A %s %s\n' % (chainname, spec)
+                else:
+                    line = '-A %s\n' % chainname
+                if counters:
+                    line = '[%d:%d] %s' % (packets, bytes, line)
+                lines.append(line)
+        lines.append('COMMIT\n')
+        return ''.join(lines)
+
+    def get_chain(self, chainname):
+        """Returns the definition of the specified chain, as a dictionary
+        with 'policy', 'packets' and 'bytes' keys.
+        """
+        return self.__chains[chainname]
+
+    def get_policy(self, chainname):
+        """Gets the policy for the specified built-in chain.
+        """
+        return self.__chains[chainname]['policy']
+
+    def list_chains(self):
+        """Returns a list of strings representing the chains in the
+        table.
+        """
+        return self.__chains.keys()
+
+    def list_entries(self, chainname):
+        """Returns the rules of the specified chain as they appear in the
+        dump, as a list of (packets, bytes, spec) tuples. This is much
+        cheaper than list_rules() as the rules are not parsed.
+        """
+        return list(self.__entries.get(chainname, []))
+
+    def list_rules(self, chainname):
+        """Returns a list of Rules in the specified chain.
+        """
+        rules = self.__rules.get(chainname)
+        if rules is None:
+            timed = bool(netfilter.instrument.sinks)
+            if timed:
+                start = netfilter.instrument.clock()
+            rules = []
+            for packets, bytes, spec in self.__entries.get(chainname, []):
+                rule = netfilter.parser.parse_rule(spec)
+                rule.packets = packets
+                rule.bytes = bytes
+                rules.append(rule)
+            self.__rules[chainname] = rules
+            if timed:
+                netfilter.instrument.emit(netfilter.instrument.parse_event(
+                    'list_rules', len(rules),
+                    netfilter.instrument.clock() - start))
+        return list(rules)
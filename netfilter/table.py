@@ -18,46 +18,216 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import os
+import difflib
 import re
-import subprocess
 
+import netfilter.backend
+import netfilter.index
+import netfilter.instrument
 import netfilter.parser
+from netfilter.snapshot import TableSnapshot
 
 
 class IptablesError(Exception):
-    def __init__(self, command, message):
+    def __init__(self, command, message, status=None):
         self.command = command
         self.message = message
+        self.status = status
     
     def __str__(self):
         return "command: %s\nmessage: %s" % (self.command, self.message) 
 
+def diff_rules(chainname, current, desired):
+    """Returns the list of iptables arguments which turn the current
+    list of Rules of a chain into the desired one.
+
+    Rules which are present in both lists are left alone, so their
+    counters are preserved. The commands address rules by number and
+    must be run in the order they are returned.
+    """
+    matcher = difflib.SequenceMatcher(None, current, desired,
+        autojunk=False)
+
+    # work backwards so that the rule numbers of earlier blocks stay valid
+    commands = []
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == 'equal':
+            continue
+
+        # replace rules pairwise, then delete or insert the remainder
+        replaced = 0
+        if tag == 'replace':
+            replaced = min(i2 - i1, j2 - j1)
+        for k in range(replaced):
+            commands.append(['-R', chainname, str(i1 + k + 1)] +
+                desired[j1 + k].specbits())
+        for pos in range(i2, i1 + replaced, -1):
+            commands.append(['-D', chainname, str(pos)])
+        for k in range(j1 + replaced, j2):
+            commands.append(['-I', chainname, str(i1 + k - j1 + 1)] +
+                desired[k].specbits())
+    return commands
+
+def diff_table(snapshot, desired, policies=None):
+    """Returns the list of iptables arguments which bring the table
+    from the state captured in a TableSnapshot to the desired one,
+    see Table.diff().
+    """
+    chains = snapshot.list_chains()
+    commands = []
+    for chainname in desired:
+        if chainname not in chains:
+            commands.append(['-N', chainname])
+    for chainname in desired:
+        if chainname in chains:
+            current = snapshot.list_rules(chainname)
+        else:
+            current = []
+        commands.extend(diff_rules(chainname, current, desired[chainname]))
+    if policies:
+        for chainname in policies:
+            if snapshot.get_policy(chainname) != policies[chainname]:
+                commands.append(['-P', chainname, policies[chainname]])
+    return commands
+
+def restore_payload(tablename, commands):
+    """Returns an iptables-restore document which runs the given list
+    of iptables arguments against the specified table, or an empty
+    string if there are no commands.
+    """
+    if not commands:
+        return ''
+    lines = ['*%s\n' % tablename]
+    for args in commands:
+        lines.append(netfilter.parser.join_words(args) + '\n')
+    lines.append('COMMIT\n')
+    return ''.join(lines)
+
+def restore_options(flush=False, counters=False):
+    """Returns the iptables-restore options for the given flush and
+    counters settings, see Table.restore().
+    """
+    options = []
+    if counters:
+        options.append('--counters')
+    if not flush:
+        options.append('--noflush')
+    return options
+
+def netns_prefix(netns):
+    """Returns the arguments which run a command in the given network
+    namespace, if any, using 'ip netns exec'.
+    """
+    if netns:
+        return ['ip', 'netns', 'exec', netns]
+    return []
+
+def check_status(cmd, status, err):
+    """Raises an IptablesError if a command exited with a non-zero
+    status, unless it only complained about an existing chain. status is
+    the return code of the process, as given by Popen.wait(), which is
+    the negated number of the signal which killed it if any.
+    """
+    if status:
+        if not re.match(r'(iptables|ip6tables): Chain already exists', err):
+            raise IptablesError(cmd, err, status)
+
 class Table:
     """The Table class represents a netfilter table (IPv4 or IPv6).
     """
 
-    __iptables_wait_option = None
-
-    def __init__(self, name, auto_commit = True, ipv6 = False):
+    def __init__(self, name, auto_commit = True, ipv6 = False,
+                 snapshot_ttl = None, persistent = False, netns = None,
+                 backend = None, indexed = False):
         """Constructs a new netfilter Table.
         
         If auto_commit is true, commands are executed immediately,
         otherwise they are buffered and you need to call the commit()
         method to execute them.
 
-        If ipv6 is true then ip6tables and ip6tables-save are used
-        instead of iptables and iptables-save.
+        If ipv6 is true then ip6tables, ip6tables-restore and
+        ip6tables-save are used instead of iptables, iptables-restore
+        and iptables-save.
+
+        If snapshot_ttl is set, the snapshot used by list_chains(),
+        get_policy() and list_rules() is cached for that many seconds,
+        or until a command is executed against the table.
+
+        If persistent is true, commands which are executed immediately
+        are streamed to a long-lived iptables-restore process instead of
+        running iptables for each of them. Errors may then be reported
+        by a later call, see netfilter.worker.RestoreWorker.
+
+        If netns is set, the commands are run in that network namespace
+        using 'ip netns exec'.
+
+        backend runs the commands, it defaults to a ProcessBackend which
+        runs them as subprocesses. A netfilter.backend.FakeBackend can be
+        used to work against tables held in memory instead.
+
+        The commands run by the table are reported to the sinks
+        registered with netfilter.instrument.add_sink(), if any.
+
+        If indexed is true, the table keeps track of the position of
+        each rule, seeded from a snapshot before the first command and
+        updated by each command it runs, see netfilter.index. Rules are
+        then deleted and replaced by number, sparing the kernel a search
+        through the chain. The index assumes nothing else changes the
+        table; it is discarded and seeded again if a command fails or
+        has an effect it cannot follow, and reindex() does the same.
+        Buffered commands are replayed onto a new index; if the index
+        cannot follow one of them, rules are addressed by their
+        specification until the buffer is committed or cleared.
         """
+        if backend is None:
+            backend = netfilter.backend.ProcessBackend()
+        self.backend = backend
         self.auto_commit = auto_commit
+        self.snapshot_ttl = snapshot_ttl
+        self.netns = netns
         self.__name = name
+        self.__ipv6 = ipv6
         self.__buffer = []
+        self.__snapshot = None
+        self.__indexed = indexed
+        self.__index = None
         if ipv6:
             self.__iptables = 'ip6tables'
+            self.__iptables_restore = 'ip6tables-restore'
             self.__iptables_save = 'ip6tables-save'
         else:
             self.__iptables = 'iptables'
+            self.__iptables_restore = 'iptables-restore'
             self.__iptables_save = 'iptables-save'
+        self.__worker = None
+        if persistent:
+            self.__worker = backend.worker(
+                self.__prefix() + [self.__iptables_restore, '--noflush'] +
+                self.capabilities().restore_wait_option())
+
+    def __repr__(self):
+        family = self.__ipv6 and 'ipv6' or 'ipv4'
+        if self.netns:
+            return '<Table %s %s netns=%s>' % (self.__name, family,
+                self.netns)
+        return '<Table %s %s>' % (self.__name, family)
+
+    def capabilities(self):
+        """Returns the Capabilities of the iptables binary used by the
+        table, see netfilter.capabilities.detect().
+        """
+        return self.backend.capabilities(self.__iptables, self.__run)
+
+    def close(self):
+        """Waits for the commands sent to the persistent iptables-restore
+        process, if any, to be applied and stops it.
+        """
+        if self.__worker is not None:
+            try:
+                self.__worker.wait()
+            except IptablesError:
+                self.reindex()
+                raise
 
     def create_chain(self, chainname):
         """Creates the specified user-defined chain.
@@ -72,6 +242,12 @@ class Table:
         if chainname: args.append(chainname)
         self.__run_iptables(args)
 
+    def execute(self, args):
+        """Runs iptables against the table with the given list of
+        arguments, or buffers the command if auto_commit is false.
+        """
+        self.__run_iptables(args)
+
     def flush_chain(self, chainname=None):
         """Flushes the specified chain (all the chains in the table if
         none is given). This is equivalent to deleting all the rules
@@ -85,7 +261,7 @@ class Table:
         """Returns a list of strings representing the chains in the 
         Table.
         """
-        return self.__get_chains().keys()
+        return self.snapshot().list_chains()
 
     def rename_chain(self, old_chain_name, new_chain_name):
         """Renames the specified user-defined chain.
@@ -95,7 +271,7 @@ class Table:
     def get_policy(self, chainname):
         """Gets the policy for the specified built-in chain.
         """
-        return self.__get_chains()[chainname]['policy']
+        return self.snapshot().get_policy(chainname)
     
     def set_policy(self, chainname, policy):
         """Sets the policy for the specified built-in chain.
@@ -108,65 +284,255 @@ class Table:
         self.__run_iptables(['-A', chainname] + rule.specbits())
 
     def delete_rule(self, chainname, rule):
-        """Deletes a Rule from the specified chain.
+        """Deletes a Rule from the specified chain. If the table is indexed
+        and the Rule is found in the index, it is deleted by number.
         """
-        self.__run_iptables(['-D', chainname] + rule.specbits())
-    
+        position = None
+        index = self.rule_index()
+        if index is not None:
+            position = index.find(chainname, rule)
+        if position is None:
+            self.__run_iptables(['-D', chainname] + rule.specbits(), rule)
+        else:
+            self.__run_iptables(['-D', chainname, str(position)], rule)
+
+    def insert_rule(self, chainname, rule, position=1):
+        """Inserts a Rule at the given position of the specified chain,
+        counting from 1.
+        """
+        self.__run_iptables(['-I', chainname, str(position)] +
+            rule.specbits(), rule)
+
     def prepend_rule(self, chainname, rule):
         """Prepends a Rule to the specified chain.
         """
-        self.__run_iptables(['-I', chainname, '1'] + rule.specbits())
+        self.insert_rule(chainname, rule, 1)
+
+    def replace_rule(self, chainname, rule, new_rule):
+        """Replaces the first occurrence of a Rule in the specified chain
+        by new_rule, keeping its position. Raises an IptablesError if the
+        Rule is not in the chain.
+        """
+        position = self.rule_position(chainname, rule)
+        if position is None:
+            raise IptablesError(['-R', chainname] + rule.specbits(),
+                "Bad rule (does a matching rule exist in that chain?).")
+        self.__run_iptables(['-R', chainname, str(position)] +
+            new_rule.specbits(), new_rule)
+
+    def rule_position(self, chainname, rule):
+        """Returns the position of the first occurrence of a Rule in the
+        specified chain, counting from 1, or None if it is not there.
+        Unless the table is indexed, this reads the chain's rules.
+        """
+        index = self.rule_index()
+        if index is not None:
+            return index.find(chainname, rule)
+        rules = self.list_rules(chainname)
+        if rule in rules:
+            return rules.index(rule) + 1
+        return None
+
+    def rule_index(self):
+        """Returns the netfilter.index.TableIndex of an indexed table,
+        seeding it from a snapshot and the buffered commands if needed.
+        Returns None if the table is not indexed or if the index cannot
+        follow the buffered commands.
+        """
+        if not self.__indexed or self.__index is False:
+            return None
+        if self.__index is None:
+            index = netfilter.index.TableIndex(self.snapshot())
+            for cmd in self.__buffer:
+                if not index.apply(cmd[cmd.index('-t') + 2:]):
+                    # wait for the buffer to be committed or cleared
+                    index = False
+                    break
+            self.__index = index
+        return self.__index or None
+
+    def reindex(self):
+        """Discards the rule index, which is seeded again from a snapshot
+        when it is next needed.
+        """
+        self.__index = None
 
     def list_rules(self, chainname):
         """Returns a list of Rules in the specified chain.
         """
-        data = self.__run([self.__iptables_save, '-t', self.__name, '-c'])
-        return netfilter.parser.parse_rules(data, chainname)
+        return self.snapshot().list_rules(chainname)
+
+    def snapshot(self):
+        """Returns a TableSnapshot of the table's contents, reusing the
+        cached one if snapshot_ttl is set and it has not expired.
+        """
+        snapshot = self.__snapshot
+        if snapshot is not None and self.snapshot_ttl is not None and \
+           snapshot.age() < self.snapshot_ttl:
+            return snapshot
+
+        snapshot = TableSnapshot(self.__name,
+            *netfilter.parser.parse_table(self.dump()))
+        if self.snapshot_ttl is not None:
+            self.__snapshot = snapshot
+        return snapshot
+
+    def dump(self, all_tables=False):
+        """Returns the output of iptables-save, including counters, for
+        the current table or for all the tables if all_tables is true.
+        """
+        cmd = self.__prefix() + [self.__iptables_save, '-c']
+        if not all_tables:
+            cmd[-1:-1] = ['-t', self.__name]
+        self.close()
+        return self.__run(cmd)
+
+    def stream(self):
+        """Runs iptables-save and yields the chains and rules of the table
+        as its output is read, without holding the whole dump in memory.
+        See netfilter.parser.iterparse() for the format of the events.
+        """
+        cmd = self.__prefix() + [self.__iptables_save, '-t', self.__name,
+            '-c']
+        self.close()
+        if netfilter.instrument.sinks:
+            lines = netfilter.instrument.stream(self.backend, cmd,
+                self.__name, self.netns)
+        else:
+            lines = self.backend.stream(cmd)
+        return netfilter.parser.iterparse(lines)
+
+    def invalidate_snapshot(self):
+        """Discards the cached snapshot, if any.
+        """
+        self.__snapshot = None
+
+    def diff(self, desired, policies=None):
+        """Returns the list of iptables arguments which bring the table
+        from its current state to the desired one.
+
+        desired is a dictionary mapping chain names to lists of Rules,
+        policies is an optional dictionary mapping built-in chain names
+        to their policy. Chains which are not listed are left untouched.
+        Rules are compared as iptables-save prints them, so the desired
+        Rules should be written in the same form (e.g. with an explicit
+        'tcp' match for ports).
+        """
+        self.invalidate_snapshot()
+        return diff_table(self.snapshot(), desired, policies)
+
+    def sync(self, desired, policies=None):
+        """Brings the table to the desired state, only sending the
+        commands which are needed to get there (see diff()).
+
+        If auto_commit is true, the commands are applied in a single
+        iptables-restore transaction, otherwise they are buffered.
+        Returns the list of commands.
+        """
+        commands = self.diff(desired, policies)
+        if self.auto_commit:
+            self.restore(restore_payload(self.__name, commands))
+        else:
+            for args in commands:
+                self.execute(args)
+        return commands
 
-    def commit(self):
+    def commit(self, restore=False):
         """Commits any buffered commands. This is only useful if
         auto_commit is False.
+
+        If restore is true, the whole buffer is sent to iptables-restore
+        as a single transaction instead of running one iptables process
+        per command. The buffer is only cleared if the transaction
+        succeeds.
         """
-        while len(self.__buffer) > 0:
-            self.__run(self.__buffer.pop(0))
-    
+        try:
+            if restore:
+                self.__restore(self.get_restore_payload())
+                del self.__buffer[:]
+            else:
+                self.invalidate_snapshot()
+                while len(self.__buffer) > 0:
+                    self.__run(self.__buffer.pop(0))
+        except IptablesError:
+            self.reindex()
+            raise
+        if self.__index is False:
+            self.reindex()
+
+    def restore(self, payload, flush=False, counters=False):
+        """Feeds an iptables-restore document to iptables-restore.
+
+        Unless flush is true, the existing rules are kept. If counters
+        is true, the packet and byte counters in the document are
+        restored too.
+        """
+        if payload:
+            self.reindex()
+            self.__restore(payload, flush, counters)
+
+    def clear_buffer(self):
+        """Discards any buffered commands. This is only useful if
+        auto_commit is False.
+        """
+        if self.__buffer:
+            self.reindex()
+        del self.__buffer[:]
+
     def get_buffer(self):
         """Returns the command buffer. This is only useful if
         auto_commit is False.
         """
         return self.__buffer
-    
-    def __get_chains(self):
-        data = self.__run([self.__iptables_save, '-t', self.__name, '-c'])
-        return netfilter.parser.parse_chains(data)
-    
-    def __run_iptables(self, args):
-        if Table.__iptables_wait_option is None:
-            # check whether iptables supports --wait
-            try:
-                self.__run([self.__iptables, '-L', '-n', '--wait'])
-                Table.__iptables_wait_option = ['--wait']
-            except:
-                Table.__iptables_wait_option = []
 
-        cmd = [self.__iptables] + Table.__iptables_wait_option + ['-t', self.__name] + args
-        if self.auto_commit:
-            self.__run(cmd)
+    def get_restore_payload(self):
+        """Returns the command buffer as an iptables-restore document,
+        or an empty string if the buffer is empty. This is only useful
+        if auto_commit is False.
+        """
+        # strip the iptables invocation, up to and including '-t <name>'
+        return restore_payload(self.__name, [ cmd[cmd.index('-t') + 2:]
+            for cmd in self.__buffer ])
+
+    def __run_iptables(self, args, rule=None):
+        index = self.rule_index()
+
+        if self.auto_commit and self.__worker is not None:
+            self.invalidate_snapshot()
+            try:
+                self.__worker.execute(self.__name, [args])
+            except IptablesError:
+                self.reindex()
+                raise
         else:
-            self.__buffer.append(cmd)
-    
-    def __run(self, cmd):
-        p = subprocess.Popen(cmd,
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            close_fds=True)
-        out, err = p.communicate()
-        out = out.decode('utf8')
-        err = err.decode('utf8')
-        status = p.wait()
-        # check exit status
-        if not os.WIFEXITED(status) or os.WEXITSTATUS(status):
-            if not re.match(r'(iptables|ip6tables): Chain already exists', err):
-                raise IptablesError(cmd, err)
-        return out
+            cmd = self.__prefix() + [self.__iptables] + \
+                self.capabilities().wait_option() + ['-t', self.__name] + \
+                args
+            if self.auto_commit:
+                self.invalidate_snapshot()
+                try:
+                    self.__run(cmd)
+                except IptablesError:
+                    self.reindex()
+                    raise
+            else:
+                self.__buffer.append(cmd)
+
+        if index is not None and not index.apply(args, rule):
+            self.reindex()
+
+    def __prefix(self):
+        return netns_prefix(self.netns)
+
+    def __restore(self, payload, flush=False, counters=False):
+        if payload:
+            self.invalidate_snapshot()
+            self.__run(self.__prefix() + [self.__iptables_restore] +
+                self.capabilities().restore_wait_option() +
+                restore_options(flush, counters), payload)
 
+    def __run(self, cmd, input=None):
+        if netfilter.instrument.sinks:
+            return netfilter.instrument.run(self.backend, cmd, input,
+                self.__name, self.netns)
+        return self.backend.run(cmd, input)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import errno
+import os
+import re
+import subprocess
+import tempfile
+
+import netfilter.parser
+import netfilter.table
+
+# iptables-restore reports the line it failed on in one of these forms
+re_failed_line = re.compile(r'line:? ([0-9]+)')
+
+class RestoreWorker:
+    """The RestoreWorker class keeps an iptables-restore process running
+    and streams transactions to it, so that commands do not pay for a
+    fork and exec each.
+
+    iptables-restore does not acknowledge transactions, so errors are
+    reported late: an IptablesError raised by execute() may concern a
+    command sent by an earlier call. The commands which iptables-restore
+    discarded after a failure are sent again to a new process. If the
+    failure cannot be matched to a transaction, none of the commands sent
+    to the process are sent again and the IptablesError says so. Call
+    wait() to make sure all the commands sent so far were applied.
+    """
+    # how many bytes of transactions are sent to a process before it is
+    # replaced, so that failures can be matched to what was sent
+    history_size = 1024 * 1024
+
+    def __init__(self, command = ['iptables-restore', '--noflush']):
+        self.__command = command
+        self.__process = None
+        self.__errfile = None
+        self.__line = 0
+        self.__sent = []
+        self.__sent_size = 0
+
+    def close(self):
+        """Alias for wait().
+        """
+        self.wait()
+
+    def execute(self, table, commands):
+        """Sends the given list of commands for the specified table to
+        iptables-restore, as a single transaction.
+        """
+        error = self.__check()
+        if error is None and self.__sent_size > self.history_size:
+            error = self.__finish()
+        try:
+            self.__send(table, commands)
+        except EnvironmentError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            # the process died since the last check
+            error = self.__check()
+        if error is not None:
+            raise error
+
+    def wait(self):
+        """Waits for the commands sent so far to be applied, stopping
+        the iptables-restore process. Raises an IptablesError if any of
+        them failed.
+        """
+        while self.__process is not None:
+            error = self.__finish()
+            if error is not None:
+                # the remaining commands were sent again, wait for them too
+                self.wait()
+                raise error
+
+    def __finish(self):
+        """Waits for the iptables-restore process to apply the commands
+        sent so far and exit, then checks it.
+        """
+        try:
+            self.__process.stdin.close()
+        except EnvironmentError:
+            pass
+        self.__process.wait()
+        return self.__check()
+
+    def __check(self):
+        """If the iptables-restore process has exited, collects the error
+        which made it fail and sends the discarded commands again.
+        """
+        process = self.__process
+        if process is None or process.poll() is None:
+            return None
+
+        self.__errfile.seek(0)
+        err = self.__errfile.read().decode('utf8')
+        self.__errfile.close()
+        sent = self.__sent
+        self.__process = None
+        self.__errfile = None
+        self.__line = 0
+        self.__sent = []
+        self.__sent_size = 0
+        if process.returncode == 0:
+            return None
+
+        # find the transaction which failed
+        m = re_failed_line.search(err)
+        failed_line = m and int(m.group(1))
+        error = None
+        resend = []
+        for first, last, table, commands, size in sent:
+            if error is not None:
+                resend.append((table, commands))
+            elif failed_line is not None and failed_line <= last:
+                cmd = commands
+                if first < failed_line < last:
+                    cmd = commands[failed_line - first - 1]
+                error = netfilter.table.IptablesError(cmd, err)
+                # tolerate existing chains like Table does
+                if len(commands) == 1 and commands[0][0] == '-N' and \
+                   'Chain already exists' in err:
+                    error = False
+        if error is None:
+            # we could not determine what failed, so nothing is sent again
+            return netfilter.table.IptablesError(self.__command,
+                "%s\nfailed at an unknown line, %d transactions may not "
+                "have been applied" % (err.rstrip('\n'), len(sent)))
+
+        for table, commands in resend:
+            self.__send(table, commands)
+        return error or None
+
+    def __send(self, table, commands):
+        if self.__process is None:
+            self.__errfile = tempfile.TemporaryFile()
+            self.__process = subprocess.Popen(self.__command,
+                stdin=subprocess.PIPE,
+                stdout=self.__errfile,
+                stderr=self.__errfile,
+                close_fds=True)
+
+        lines = ['*%s\n' % table]
+        for args in commands:
+            lines.append(netfilter.parser.join_words(args) + '\n')
+        lines.append('COMMIT\n')
+        data = ''.join(lines).encode('utf8')
+
+        # remember which lines this transaction covers
+        first = self.__line + 1
+        self.__line += len(lines)
+        self.__sent.append((first, self.__line, table, commands, len(data)))
+        self.__sent_size += len(data)
+
+        self.__process.stdin.write(data)
+        self.__process.stdin.flush()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# asyncio test cases, imported by test_aio on Python 3.5 or later
+
+import asyncio
+import unittest
+
+import netfilter.capabilities
+import netfilter.instrument
+from netfilter.aio import AsyncTable
+from netfilter.rule import Rule
+from tests.test_netfilter import iptables_data
+
+class AsyncTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.commands = []
+        self.payloads = []
+        self.version = '1.4.19'
+        netfilter.capabilities.clear_cache()
+
+    def tearDown(self):
+        self.loop.close()
+        netfilter.capabilities.clear_cache()
+
+    async def fake_run(self, cmd, input=None):
+        self.commands.append(cmd)
+        if input is not None:
+            self.payloads.append(input)
+        await asyncio.sleep(0)
+        if cmd[1:] == ['--version']:
+            return '%s v%s\n' % (cmd[0], self.version)
+        return iptables_data
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def table(self, *args, **kwargs):
+        table = AsyncTable(*args, **kwargs)
+        table._AsyncTable__exec = self.fake_run
+        return table
+
+    def testQuery(self):
+        table = self.table('filter')
+
+        async def query():
+            return await asyncio.gather(table.list_chains(),
+                table.get_policy('INPUT'),
+                table.list_rules('firewall_input_filter'))
+
+        chains, policy, rules = self.run_async(query())
+        self.assertEqual(chains, ['INPUT', 'FORWARD', 'OUTPUT',
+            'firewall_forward_filter',
+            'firewall_input_filter'])
+        self.assertEqual(policy, 'DROP')
+        self.assertEqual(len(rules), 11)
+        self.assertEqual(self.commands,
+            [['iptables-save', '-t', 'filter', '-c']] * 3)
+
+    def testAutoCommit(self):
+        table = self.table('filter')
+        self.run_async(table.create_chain('test'))
+        self.run_async(table.append_rule('test', Rule(jump='ACCEPT')))
+        self.assertEqual(self.commands, [
+            ['iptables', '--version'],
+            ['iptables', '-t', 'filter', '-N', 'test'],
+            ['iptables', '-t', 'filter', '-A', 'test', '-j', 'ACCEPT']])
+        self.assertEqual(table.get_buffer(), [])
+
+    def testWait(self):
+        self.version = '1.8.7'
+        table = self.table('filter')
+
+        async def update():
+            await asyncio.gather(table.create_chain('test'),
+                table.flush_chain('test'))
+
+        self.run_async(update())
+        # the order in which gather() starts the coroutines varies
+        self.assertEqual(self.commands[:2], [['iptables', '--version']] * 2)
+        self.assertEqual(sorted(self.commands[2:]), [
+            ['iptables', '--wait', '-t', 'filter', '-F', 'test'],
+            ['iptables', '--wait', '-t', 'filter', '-N', 'test']])
+
+        # the probe is shared with the other tables
+        del self.commands[:]
+        self.run_async(self.table('filter').flush_chain())
+        self.assertEqual(self.commands, [
+            ['iptables', '--wait', '-t', 'filter', '-F']])
+
+    def testBuffered(self):
+        table = self.table('nat', auto_commit=False, ipv6=True)
+        self.run_async(table.flush_chain('PREROUTING'))
+        self.run_async(table.set_policy('PREROUTING', 'ACCEPT'))
+        self.assertEqual(self.commands, [['ip6tables', '--version']])
+        self.run_async(table.commit(restore=True))
+        self.assertEqual(self.commands, [['ip6tables', '--version'],
+            ['ip6tables-restore', '--noflush']])
+        self.assertEqual(self.payloads, [
+            '*nat\n'
+            '-F PREROUTING\n'
+            '-P PREROUTING ACCEPT\n'
+            'COMMIT\n'])
+        self.assertEqual(table.get_buffer(), [])
+
+    def testNetns(self):
+        events = []
+        netfilter.instrument.add_sink(events.append)
+        try:
+            table = self.table('filter', netns='test')
+            self.run_async(table.list_chains())
+            self.run_async(table.append_rule('INPUT', Rule(jump='ACCEPT')))
+            self.run_async(table.restore('*filter\n-F INPUT\nCOMMIT\n'))
+        finally:
+            netfilter.instrument.remove_sink(events.append)
+        prefix = ['ip', 'netns', 'exec', 'test']
+        self.assertEqual(self.commands, [
+            prefix + ['iptables-save', '-t', 'filter', '-c'],
+            ['iptables', '--version'],
+            prefix + ['iptables', '-t', 'filter', '-A', 'INPUT', '-j',
+                'ACCEPT'],
+            prefix + ['iptables-restore', '--noflush']])
+        self.assertEqual([ (event['binary'], event['table'], event['netns'],
+            event['status']) for event in events ], [
+            ('iptables-save', 'filter', 'test', 0),
+            ('iptables', 'filter', 'test', 0),
+            ('iptables', 'filter', 'test', 0),
+            ('iptables-restore', 'filter', 'test', 0)])
+
+    def testSync(self):
+        table = self.table('filter')
+        commands = self.run_async(table.sync(
+            {'OUTPUT': [Rule(jump='ACCEPT')]}))
+        self.assertEqual(commands, [['-I', 'OUTPUT', '1', '-j', 'ACCEPT']])
+        self.assertEqual(self.payloads, [
+            '*filter\n'
+            '-I OUTPUT 1 -j ACCEPT\n'
+            'COMMIT\n'])
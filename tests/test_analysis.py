@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+import netfilter.parser
+from netfilter.analysis import analyze, analyze_chain
+
+def parse(specs):
+    return [ netfilter.parser.parse_rule(spec) for spec in specs ]
+
+def summary(findings):
+    return [ (finding['kind'], finding['rule'], finding['by'])
+        for finding in findings ]
+
+class AnalysisTestCase(unittest.TestCase):
+    def testDuplicate(self):
+        self.assertEqual(summary(analyze_chain('INPUT', parse([
+            '-p tcp -m tcp --dport 22 -j LOG',
+            '-p tcp -m tcp --dport 80 -j ACCEPT',
+            '-p tcp -m tcp --dport 22 -j LOG',
+        ]))), [('duplicate', 3, 1)])
+
+    def testShadowed(self):
+        self.assertEqual(summary(analyze_chain('INPUT', parse([
+            '-s 10.0.0.0/8 -j ACCEPT',
+            '-s 10.1.0.0/16 -p tcp -m tcp --dport 22 -j DROP',
+            '-i eth+ -p tcp -m multiport --dports 80,1000:2000 -j ACCEPT',
+            '-i eth0 -p tcp -m tcp --dport 1500:1600 -j DROP',
+            '-m state --state RELATED,ESTABLISHED -j ACCEPT',
+            '-m state --state ESTABLISHED -m comment --comment x -j DROP',
+            '-p 6 -j RETURN',
+            '-p tcp -m tcp --dport 25 -j ACCEPT',
+        ]))), [('shadowed', 2, 1), ('shadowed', 4, 3), ('shadowed', 6, 5),
+               ('shadowed', 8, 7)])
+
+    def testNotShadowed(self):
+        self.assertEqual(analyze_chain('INPUT', parse([
+            # non-terminating targets let packets through
+            '-s 10.0.0.0/8 -j LOG',
+            '-s 10.0.0.0/8 -j other',
+            '-s 10.1.0.0/16 -j ACCEPT',
+            # narrower rules do not contain broader ones
+            '-s 192.168.1.0/24 -j ACCEPT',
+            '-s 192.168.0.0/16 -j ACCEPT',
+            '-p tcp -m tcp --dport 22 -j ACCEPT',
+            '-p tcp -m tcp --dport 20:30 -j DROP',
+            '-m state --state NEW -j ACCEPT',
+            '-m state --state NEW,INVALID -j ACCEPT',
+            '-i eth0 -j ACCEPT',
+            '-i eth+ -j ACCEPT',
+            # negations are only compared by equality
+            '! -d 10.0.0.0/8 -j DROP',
+            '-d 192.168.0.0/16 -j DROP',
+            '-p udp -m udp ! --dport 53 -j DROP',
+            '-p udp -m udp --dport 123 -j DROP',
+        ])), [])
+
+    def testConntrackTargets(self):
+        # CT and NOTRACK let the packet carry on to the next rule
+        self.assertEqual(analyze_chain('PREROUTING', parse([
+            '-p udp -m udp --dport 53 -j CT --notrack',
+            '-p udp -m udp --dport 53 -j NOTRACK',
+            '-p udp -m udp --dport 53 -j DROP',
+        ])), [])
+
+    def testMergeable(self):
+        findings = analyze_chain('INPUT', parse([
+            '-s 10.0.0.0/25 -j ACCEPT',
+            '-s 10.0.0.128/25 -j ACCEPT',
+            '-p tcp -m tcp --dport 80 -j ACCEPT',
+            '-p tcp -m multiport --dports 443,8000:8080 -j ACCEPT',
+            '-p udp -m udp --dport 53 -j ACCEPT',
+            '-p udp -m udp --dport 53 -d 10.0.0.1 -j ACCEPT',
+            '-d 10.0.0.2 -j DROP',
+            '-d 10.0.0.4 -j DROP',
+        ]))
+        self.assertEqual([ (finding['rule'], finding['by'],
+            finding.get('field'), finding.get('value'))
+            for finding in findings ], [
+            (2, 1, 'source', '10.0.0.0/24'),
+            (4, 3, 'dport', '80,443,8000:8080'),
+            (6, 5, None, None),
+        ])
+
+    def testMergeableRanges(self):
+        self.assertEqual([ finding['value'] for finding in analyze_chain(
+            'INPUT', parse([
+            '-p tcp -m tcp --dport 80 -j ACCEPT',
+            '-p tcp -m multiport --dports 81,79:80,90 -j ACCEPT',
+            '-p udp -m udp --dport 1:10 -j LOG',
+            '-p udp -m udp --dport 5:20 -j LOG',
+            '-p udp -m udp --dport 21:30 -j LOG',
+        ])) ], ['79:81,90', '5:30'])
+
+    def testMultiportLimit(self):
+        ports = [ '-p tcp -m multiport --dports %s -j ACCEPT' %
+            ','.join([ str(port) for port in range(start, start + 16, 2) ])
+            for start in (100, 200) ]
+        self.assertEqual(analyze_chain('INPUT', parse(ports)), [])
+
+    def testIPv6(self):
+        self.assertEqual(summary(analyze({'INPUT': parse([
+            '-s 2001:db8::/32 -j ACCEPT',
+            '-s 2001:db9::/32 -j ACCEPT',
+            '-s 2001:db8:1::/48 -j ACCEPT',
+        ])})), [('mergeable', 2, 1), ('shadowed', 3, 1)])
+
+if __name__ == '__main__':
+    unittest.main()
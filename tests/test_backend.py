@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+import netfilter.parser
+from netfilter.backend import FakeBackend
+from netfilter.firewall import Firewall
+from netfilter.rule import Rule, Match
+from netfilter.table import IptablesError, Table
+
+def specs(table, chainname):
+    return [ ' '.join(rule.specbits())
+        for rule in table.list_rules(chainname) ]
+
+class FakeBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.table = Table('filter', backend=self.backend)
+
+    def testRules(self):
+        table = self.table
+        table.append_rule('INPUT', Rule(protocol='tcp', jump='ACCEPT'))
+        table.append_rule('INPUT', Rule(protocol='udp', jump='ACCEPT'))
+        table.prepend_rule('INPUT', Rule(in_interface='lo', jump='ACCEPT'))
+        table.execute(['-I', 'INPUT', '3', '-p', 'icmp', '-j', 'DROP'])
+        self.assertEqual(specs(table, 'INPUT'), ['-i lo -j ACCEPT',
+            '-p tcp -j ACCEPT', '-p icmp -j DROP', '-p udp -j ACCEPT'])
+
+        table.delete_rule('INPUT', Rule(protocol='tcp', jump='ACCEPT'))
+        table.execute(['-D', 'INPUT', '1'])
+        table.execute(['-R', 'INPUT', '2', '-p', 'udp', '-j', 'DROP'])
+        self.assertEqual(specs(table, 'INPUT'), ['-p icmp -j DROP',
+            '-p udp -j DROP'])
+        self.assertEqual(specs(table, 'FORWARD'), [])
+
+        table.set_policy('INPUT', 'DROP')
+        self.assertEqual(table.get_policy('INPUT'), 'DROP')
+        table.flush_chain('INPUT')
+        self.assertEqual(specs(table, 'INPUT'), [])
+
+    def testChains(self):
+        table = self.table
+        table.create_chain('foo')
+        # creating an existing chain is tolerated, like with iptables
+        table.create_chain('foo')
+        table.append_rule('foo', Rule(jump='DROP'))
+        table.append_rule('INPUT', Rule(goto='foo'))
+        table.rename_chain('foo', 'bar')
+        self.assertEqual(list(table.list_chains()), ['INPUT', 'FORWARD',
+            'OUTPUT', 'bar'])
+        self.assertEqual(specs(table, 'INPUT'), ['-g bar'])
+        self.assertRaises(IptablesError, table.delete_chain, 'bar')
+        table.flush_chain()
+        table.delete_chain()
+        self.assertEqual(list(table.list_chains()), ['INPUT', 'FORWARD',
+            'OUTPUT'])
+
+    def testErrors(self):
+        table = self.table
+        self.assertRaises(IptablesError, table.append_rule, 'foo',
+            Rule(jump='ACCEPT'))
+        self.assertRaises(IptablesError, table.append_rule, 'INPUT',
+            Rule(jump='foo'))
+        self.assertRaises(IptablesError, table.delete_rule, 'INPUT',
+            Rule(jump='ACCEPT'))
+        self.assertRaises(IptablesError, table.set_policy, 'INPUT', 'foo')
+        self.assertRaises(IptablesError, table.delete_chain, 'INPUT')
+        self.assertRaises(IptablesError, table.execute, ['-D', 'INPUT', '1'])
+        try:
+            table.execute(['-L'])
+        except IptablesError as e:
+            self.assertEqual(e.message, 'iptables: unknown option "-L"\n')
+        else:
+            self.fail('IptablesError not raised')
+        self.assertRaises(IptablesError, Table('foo',
+            backend=self.backend).flush_chain)
+
+    def testRestore(self):
+        table = Table('filter', auto_commit=False, backend=self.backend)
+        table.create_chain('foo')
+        table.append_rule('foo', Rule(jump='ACCEPT'))
+        table.append_rule('INPUT', Rule(source='10.0.0.0/8', jump='foo'))
+        table.commit(restore=True)
+        self.assertEqual(specs(table, 'INPUT'), ['-s 10.0.0.0/8 -j foo'])
+        self.assertEqual(len(self.backend.commands), 2)
+
+        # a failed transaction is not applied
+        table.append_rule('INPUT', Rule(jump='DROP'))
+        table.append_rule('INPUT', Rule(jump='missing'))
+        try:
+            table.commit(restore=True)
+        except IptablesError as e:
+            self.assertTrue('Error occurred at line: 3' in e.message)
+        else:
+            self.fail('IptablesError not raised')
+        self.assertEqual(specs(table, 'INPUT'), ['-s 10.0.0.0/8 -j foo'])
+
+        # a complete document replaces the table
+        table.restore('*filter\n:INPUT DROP [0:0]\n[5:300] -A INPUT -j LOG\n'
+            'COMMIT\n', flush=True, counters=True)
+        self.assertEqual(list(table.list_chains()), ['INPUT', 'FORWARD',
+            'OUTPUT'])
+        self.assertEqual(table.get_policy('INPUT'), 'DROP')
+        rule = table.list_rules('INPUT')[0]
+        self.assertEqual((rule.packets, rule.bytes), (5, 300))
+        self.assertEqual(table.dump(),
+            '*filter\n:INPUT DROP [0:0]\n:FORWARD ACCEPT [0:0]\n'
+            ':OUTPUT ACCEPT [0:0]\n[5:300] -A INPUT -j LOG\nCOMMIT\n')
+
+    def testPersistent(self):
+        table = Table('filter', persistent=True, backend=self.backend)
+        table.create_chain('foo')
+        table.create_chain('foo')
+        table.append_rule('foo', Rule(jump='ACCEPT'))
+        self.assertRaises(IptablesError, table.append_rule, 'bar',
+            Rule(jump='ACCEPT'))
+        table.close()
+        self.assertEqual(specs(table, 'foo'), ['-j ACCEPT'])
+        self.assertEqual(self.backend.commands[0],
+            ['iptables-restore', '--noflush', '--wait'])
+
+        # iptables-restore only waits for the lock from 1.6.2
+        backend = FakeBackend('1.6.1')
+        table = Table('filter', persistent=True, backend=backend)
+        table.create_chain('foo')
+        table.restore('*filter\n-A foo -j ACCEPT\nCOMMIT\n')
+        self.assertEqual(backend.commands, [
+            ['iptables-restore', '--noflush'],
+            ['iptables-restore', '--noflush'],
+        ])
+
+    def testStream(self):
+        self.table.append_rule('INPUT', Rule(jump='ACCEPT'))
+        self.assertEqual([ event[0] for event in self.table.stream() ],
+            ['chain', 'chain', 'chain', 'rule'])
+
+    def testNamespaces(self):
+        blue = Table('filter', netns='blue', backend=self.backend)
+        blue6 = Table('filter', netns='blue', ipv6=True,
+            backend=self.backend)
+        blue.append_rule('INPUT', Rule(jump='ACCEPT'))
+        blue6.append_rule('INPUT', Rule(jump='DROP'))
+        self.assertEqual(specs(blue, 'INPUT'), ['-j ACCEPT'])
+        self.assertEqual(specs(blue6, 'INPUT'), ['-j DROP'])
+        self.assertEqual(specs(self.table, 'INPUT'), [])
+        self.assertEqual(self.backend.commands[0][:5],
+            ['ip', 'netns', 'exec', 'blue', 'iptables'])
+
+    def testSync(self):
+        desired = {'INPUT': [ netfilter.parser.parse_rule(spec) for spec in
+            ['-i lo -j ACCEPT', '-p tcp -m tcp --dport 22 -j ACCEPT']]}
+        self.assertEqual(len(self.table.sync(desired, {'INPUT': 'DROP'})), 3)
+        self.assertEqual(self.table.sync(desired, {'INPUT': 'DROP'}), [])
+
+    def testFirewall(self):
+        firewall = Firewall(backend=self.backend)
+        firewall.printMessage = lambda msg, interface=None: None
+        firewall.start()
+        firewall.acceptProtocol('eth0', 'tcp', ['22', '80'])
+        snapshots = firewall.snapshot()
+        self.assertEqual(list(snapshots.keys()), ['filter', 'nat'])
+        self.assertEqual(snapshots['filter'].get_policy('INPUT'), 'DROP')
+        self.assertEqual(len(snapshots['filter'].list_rules('INPUT')), 9)
+        firewall.stop()
+        self.assertEqual(firewall.filter.list_rules('INPUT'), [])
+        self.assertEqual(firewall.filter.get_policy('INPUT'), 'ACCEPT')
+
+    def testFirewallRestore(self):
+        firewall = Firewall(auto_commit=False, backend=self.backend)
+        firewall.printMessage = lambda msg, interface=None: None
+        for table in firewall.get_tables():
+            table.snapshot_ttl = 60
+        self.assertEqual(firewall.nat.list_rules('POSTROUTING'), [])
+        firewall.sourceNAT('eth0')
+        firewall.commit(restore=True)
+        self.assertEqual(specs(firewall.nat, 'POSTROUTING'),
+            ['-o eth0 -j MASQUERADE'])
+
+    def testCapabilities(self):
+        self.assertEqual(self.table.capabilities().version, (1, 8, 7))
+        self.assertEqual(FakeBackend('1.4.8').capabilities('iptables',
+            None).wait_option(), [])
+        self.table.flush_chain()
+        self.assertEqual(self.backend.commands[-1],
+            ['iptables', '--wait', '-t', 'filter', '-F'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import netfilter.capabilities
+from netfilter.capabilities import detect, parse_version
+from netfilter.table import Table
+
+class CapabilitiesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.probes = []
+        netfilter.capabilities.clear_cache()
+
+    def tearDown(self):
+        netfilter.capabilities.set_cache_file(None)
+        shutil.rmtree(self.tmpdir)
+
+    def fake_run(self, output):
+        def run(cmd):
+            self.probes.append(cmd)
+            return output
+        return run
+
+    def testParseVersion(self):
+        self.assertEqual(parse_version('iptables v1.4.8\n'),
+            ((1, 4, 8), 'legacy'))
+        self.assertEqual(parse_version('iptables v1.8.7 (nf_tables)\n'),
+            ((1, 8, 7), 'nf_tables'))
+        self.assertEqual(parse_version('ip6tables v1.8.4 (legacy)\n'),
+            ((1, 8, 4), 'legacy'))
+        self.assertEqual(parse_version('command not found'), (None, None))
+
+    def testDetect(self):
+        caps = detect('iptables', self.fake_run('iptables v1.4.20\n'))
+        self.assertTrue(caps.supports_wait())
+        self.assertEqual(caps.wait_option(), ['--wait'])
+        self.assertEqual(caps.backend, 'legacy')
+
+        # the result is cached per binary
+        self.assertTrue(detect('iptables', self.fake_run('')) is caps)
+        caps6 = detect('ip6tables', self.fake_run('ip6tables v1.4.19\n'))
+        self.assertFalse(caps6.supports_wait())
+        self.assertEqual(caps6.wait_option(), [])
+        self.assertEqual(len(self.probes), 2)
+        self.assertEqual(self.probes[1][1:], ['--version'])
+
+    def testRestoreWait(self):
+        caps = detect('iptables', self.fake_run('iptables v1.6.1\n'))
+        self.assertEqual(caps.wait_option(), ['--wait'])
+        self.assertEqual(caps.restore_wait_option(), [])
+        caps6 = detect('ip6tables', self.fake_run('ip6tables v1.6.2\n'))
+        self.assertTrue(caps6.supports_restore_wait())
+        self.assertEqual(caps6.restore_wait_option(), ['--wait'])
+
+    def testDetectFailure(self):
+        def run(cmd):
+            raise OSError('no such file')
+        caps = detect('iptables', run)
+        self.assertEqual(caps.version, None)
+        self.assertEqual(caps.wait_option(), [])
+
+    def testCacheFile(self):
+        cache_file = os.path.join(self.tmpdir, 'capabilities.json')
+        netfilter.capabilities.set_cache_file(cache_file)
+        binary = os.path.abspath(sys.executable)
+        caps = detect(binary, self.fake_run('iptables v1.8.7 (nf_tables)'))
+        self.assertEqual(caps.backend, 'nf_tables')
+        with open(cache_file) as fp:
+            self.assertEqual(json.load(fp)[binary]['version'], [1, 8, 7])
+
+        # a new process reads the file instead of probing
+        netfilter.capabilities.clear_cache()
+        caps = detect(binary, self.fake_run(''))
+        self.assertEqual(caps.version, (1, 8, 7))
+        self.assertEqual(caps.backend, 'nf_tables')
+        self.assertEqual(len(self.probes), 1)
+
+    def testCacheFileStale(self):
+        cache_file = os.path.join(self.tmpdir, 'capabilities.json')
+        binary = os.path.abspath(sys.executable)
+        with open(cache_file, 'w') as fp:
+            json.dump({binary: {'mtime': 0, 'version': [1, 4, 8],
+                'backend': 'legacy'}}, fp)
+        netfilter.capabilities.set_cache_file(cache_file)
+        caps = detect(binary, self.fake_run('iptables v1.6.0'))
+        self.assertEqual(caps.version, (1, 6, 0))
+        self.assertEqual(len(self.probes), 1)
+
+    def testTable(self):
+        def fake_run(cmd, input=None):
+            self.probes.append(cmd)
+            return 'ip6tables v1.6.0\n'
+
+        table = Table('filter', auto_commit=False, ipv6=True)
+        table._Table__run = fake_run
+        table.flush_chain()
+        table.flush_chain()
+        self.assertEqual(table.get_buffer(),
+            [['ip6tables', '--wait', '-t', 'filter', '-F']] * 2)
+        self.assertEqual(self.probes, [['ip6tables', '--version']])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+import netfilter.parser
+from netfilter.counters import CounterMonitor
+from netfilter.snapshot import TableSnapshot
+from netfilter.table import Table
+
+def make_snapshot(lines, timestamp):
+    data = '*filter\n:INPUT DROP [0:0]\n:test - [0:0]\n' + \
+        ''.join([ line + '\n' for line in lines ]) + 'COMMIT\n'
+    snapshot = TableSnapshot('filter', *netfilter.parser.parse_table(data))
+    snapshot.timestamp = timestamp
+    return snapshot
+
+class CounterMonitorTestCase(unittest.TestCase):
+    def testUpdate(self):
+        monitor = CounterMonitor(None)
+        self.assertEqual(monitor.update(make_snapshot([
+            '[10:1000] -A INPUT -i lo -j ACCEPT',
+            '[20:2000] -A INPUT -j test',
+            '[5:500] -A test -p tcp -j DROP',
+            '[7:700] -A test -p tcp -j DROP',
+        ], 100)), None)
+
+        # rules are reordered, one duplicate is gone, one is new
+        sample = monitor.update(make_snapshot([
+            '[30:3000] -A INPUT -j test',
+            '[0:0] -A INPUT -p udp -j ACCEPT',
+            '[15:1500] -A INPUT -i lo -j ACCEPT',
+            '[9:900] -A test -p tcp -j DROP',
+        ], 105))
+        self.assertEqual(sample['timestamp'], 105)
+        self.assertEqual(sample['interval'], 5)
+        self.assertEqual([ (entry['chain'], entry['packets'], entry['bytes'])
+            for entry in sample['rules'] ], [
+            ('INPUT', 10, 1000),
+            ('INPUT', 0, 0),
+            ('INPUT', 5, 500),
+            ('test', 4, 400),
+        ])
+        self.assertEqual(sample['rules'][0]['rule'].jump.name(), 'test')
+        self.assertEqual(sample['rules'][0]['packets_rate'], 2.0)
+        self.assertEqual(sample['rules'][0]['bytes_rate'], 200.0)
+        self.assertEqual(sample['chains'], {
+            'INPUT': {'packets': 15, 'bytes': 1500,
+                'packets_rate': 3.0, 'bytes_rate': 300.0},
+            'test': {'packets': 4, 'bytes': 400,
+                'packets_rate': 0.8, 'bytes_rate': 80.0},
+        })
+
+    def testReset(self):
+        monitor = CounterMonitor(None)
+        monitor.update(make_snapshot(['[10:1000] -A INPUT -j ACCEPT'], 0))
+        sample = monitor.update(make_snapshot(
+            ['[3:300] -A INPUT -j ACCEPT'], 10))
+        self.assertEqual(sample['rules'][0]['packets'], 3)
+        self.assertEqual(sample['rules'][0]['bytes'], 300)
+
+    def testParseOnlyNewRules(self):
+        monitor = CounterMonitor(None)
+        lines = ['[1:10] -A INPUT -j ACCEPT', '[1:10] -A test -j DROP']
+        monitor.update(make_snapshot(lines, 0))
+        first = monitor.update(make_snapshot(lines, 5))
+
+        parsed = []
+        parse_rule = netfilter.parser.parse_rule
+        def counting_parse_rule(spec):
+            parsed.append(spec)
+            return parse_rule(spec)
+
+        netfilter.parser.parse_rule = counting_parse_rule
+        try:
+            second = monitor.update(make_snapshot(
+                lines + ['[2:20] -A test -p tcp -j DROP'], 10))
+        finally:
+            netfilter.parser.parse_rule = parse_rule
+        self.assertEqual(parsed, ['-p tcp -j DROP'])
+        self.assertTrue(second['rules'][0]['rule'] is first['rules'][0]['rule'])
+        self.assertEqual(second['rules'][2]['rule'].protocol, 'tcp')
+        self.assertEqual(second['rules'][2]['rule'].packets, 2)
+
+    def testRun(self):
+        dumps = [
+            '*filter\n:INPUT DROP [0:0]\n[1:10] -A INPUT -j ACCEPT\nCOMMIT\n',
+            '*filter\n:INPUT DROP [0:0]\n[4:40] -A INPUT -j ACCEPT\nCOMMIT\n',
+            '*filter\n:INPUT DROP [0:0]\n[6:60] -A INPUT -j ACCEPT\nCOMMIT\n',
+        ]
+
+        def fake_run(cmd, input=None):
+            return dumps.pop(0)
+
+        table = Table('filter', snapshot_ttl=60)
+        table._Table__run = fake_run
+        samples = []
+        CounterMonitor(table).run(samples.append, interval=0, count=2)
+        self.assertEqual([ sample['chains']['INPUT']['packets']
+            for sample in samples ], [3, 2])
+        self.assertEqual(dumps, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+from collections import OrderedDict
+
+import netfilter.parser
+from netfilter.backend import FakeBackend
+from netfilter.dispatch import apply_tree, build_tree, expected_cost, \
+    port_buckets
+from netfilter.simulator import Packet, Simulator
+from netfilter.table import Table
+
+def parse(specs):
+    return [ netfilter.parser.parse_rule(spec) for spec in specs ]
+
+def specs(rules):
+    return [ ' '.join(rule.specbits()) for rule in rules ]
+
+rules = parse([
+    '-i lo -j ACCEPT',
+    '-i eth0 -p tcp -m tcp --dport 22 -j ACCEPT',
+    '-i eth0 -p tcp -m tcp --dport 25 -j ACCEPT',
+    '-i eth+ -p tcp -m tcp --dport 80 -j LOG',
+    '-i eth0 -p tcp -m tcp --dport 80 -j ACCEPT',
+    '-i eth0 -p udp -m udp --dport 53 -j ACCEPT',
+    '-i eth0 -p tcp -m tcp --dport 1000:2000 -j DROP',
+    '-i eth0 -p tcp -m multiport --dports 3000,4000 -j ACCEPT',
+    '-i eth0 -p tcp -m tcp ! --dport 5000 -j RETURN',
+    '! -i eth1 -p icmp -j ACCEPT',
+    '-i eth1 -p tcp -m tcp --dport 443 -j ACCEPT',
+    '-p 6 -m tcp --dport 8080 -j ACCEPT',
+])
+
+class DispatchTestCase(unittest.TestCase):
+    def packets(self):
+        packets = []
+        for interface in ['lo', 'eth0', 'eth1', 'eth2', None]:
+            for protocol in ['tcp', 'udp', 'icmp']:
+                for dport in [22, 25, 53, 80, 443, 1500, 3000, 4000, 5000,
+                              8080, 9999]:
+                    packets.append(Packet(in_interface=interface,
+                        protocol=protocol, dport=dport))
+        return packets
+
+    def testBuildTree(self):
+        tree = build_tree('INPUT', rules, min_size=2, fanout=2)
+        self.assertEqual(list(tree), ['INPUT', 'INPUT_eth0',
+            'INPUT_eth0_tcp', 'INPUT_eth0_tcp_22-80',
+            'INPUT_eth0_tcp_22-80_22-25', 'INPUT_eth0_tcp_22-80_80',
+            'INPUT_eth0_tcp_1000-8080', 'INPUT_7', 'INPUT_8'])
+        self.assertEqual(specs(tree['INPUT']), [
+            '-i eth0 -g INPUT_eth0',
+            '-i lo -j ACCEPT',
+            '-p tcp -i eth+ -m tcp --dport 80 -j LOG',
+            '-p icmp ! -i eth1 -j ACCEPT',
+            '-p tcp -i eth1 -m tcp --dport 443 -j ACCEPT',
+            '-p 6 -m tcp --dport 8080 -j ACCEPT'])
+        self.assertEqual(specs(tree['INPUT_eth0']), [
+            '-p tcp -g INPUT_eth0_tcp',
+            '-p udp -i eth0 -m udp --dport 53 -j ACCEPT',
+            '-p icmp ! -i eth1 -j ACCEPT'])
+        self.assertEqual(specs(tree['INPUT_eth0_tcp']), [
+            '-p tcp -m tcp --dport 22:80 -g INPUT_eth0_tcp_22-80',
+            '-p tcp -m tcp --dport 1000:8080 -g INPUT_eth0_tcp_1000-8080',
+            '-p tcp -i eth0 -m tcp ! --dport 5000 -j RETURN'])
+        self.assertEqual(specs(tree['INPUT_8']), [
+            '-p tcp -i eth0 -m multiport --dports 3000,4000 -j ACCEPT',
+            '-p tcp -i eth0 -m tcp ! --dport 5000 -j RETURN',
+            '-p 6 -m tcp --dport 8080 -j ACCEPT'])
+
+    def testSemantics(self):
+        # the tree must handle every packet as the flat chain does
+        policies = {'INPUT': 'DROP'}
+        flat = Simulator({'INPUT': rules}, policies)
+        for min_size in range(1, 4):
+            tree = build_tree('INPUT', rules, min_size=min_size, fanout=2)
+            simulator = Simulator(tree, policies)
+            for packet in self.packets():
+                verdict, path = simulator.evaluate('INPUT', packet)
+                self.assertEqual((verdict, [ rule for chain, number, rule
+                    in path if rule.goto is None ]),
+                    (flat.evaluate('INPUT', packet)[0], [ rule
+                    for chain, number, rule
+                    in flat.evaluate('INPUT', packet)[1] ]))
+
+    def testSmallChain(self):
+        tree = build_tree('INPUT', rules[:8])
+        self.assertEqual(list(tree), ['INPUT'])
+        self.assertEqual(tree['INPUT'], rules[:8])
+
+    def testChainName(self):
+        tree = build_tree('a_very_long_chain_name', parse([
+            '-i eth0.1234 -p tcp -m tcp --dport %d -j ACCEPT' % port
+            for port in range(10) ]), min_size=2)
+        self.assertEqual(list(tree)[:4], ['a_very_long_chain_name',
+            'a_very_long_chain_name_1', 'a_very_long_chain_name_1_tcp',
+            'a_very_long_chain_name_3'])
+        self.assertEqual(specs(tree['a_very_long_chain_name_3']), [
+            '-p tcp -i eth0.1234 -m tcp --dport 0 -j ACCEPT',
+            '-p tcp -i eth0.1234 -m tcp --dport 1 -j ACCEPT'])
+
+    def testPortBuckets(self):
+        self.assertEqual(port_buckets([[(1, 1)], [(2, 2)], [(3, 10)],
+            [(5, 6)], [(20, 20)], [(30, 30)], [(1, 1), (40, 40)]], 3),
+            [(1, 2), (3, 20), (30, 40)])
+        self.assertEqual(port_buckets([[(1, 100)], [(50, 60)]], 4),
+            [(1, 100)])
+
+    def testApplyTree(self):
+        backend = FakeBackend()
+        table = Table('filter', auto_commit=False, backend=backend)
+        backend.run(['iptables', '-t', 'filter', '-N', 'custom'])
+        apply_tree(table, OrderedDict([
+            ('INPUT', parse(['-i eth0 -g INPUT_eth0', '-j DROP'])),
+            ('INPUT_eth0', parse(['-p tcp -g INPUT_eth0_tcp',
+                '-g custom'])),
+            ('INPUT_eth0_tcp', parse(['-j ACCEPT'])),
+        ]))
+        self.assertEqual(table.get_restore_payload(), '*filter\n'
+            '-N INPUT_eth0\n'
+            '-F INPUT_eth0\n'
+            '-N INPUT_eth0_tcp\n'
+            '-F INPUT_eth0_tcp\n'
+            '-A INPUT_eth0 -p tcp -g INPUT_eth0_tcp\n'
+            '-A INPUT_eth0 -g custom\n'
+            '-A INPUT_eth0_tcp -j ACCEPT\n'
+            '-F INPUT\n'
+            '-A INPUT -i eth0 -g INPUT_eth0\n'
+            '-A INPUT -j DROP\n'
+            'COMMIT\n')
+        table.commit(restore=True)
+
+        # applying another tree reuses the existing chains and deletes
+        # the stale ones
+        apply_tree(table, OrderedDict([
+            ('INPUT', parse(['-i eth0 -g INPUT_eth0', '-j DROP'])),
+            ('INPUT_eth0', parse(['-p udp -j ACCEPT'])),
+        ]))
+        self.assertEqual(table.get_restore_payload(), '*filter\n'
+            '-F INPUT_eth0\n'
+            '-A INPUT_eth0 -p udp -j ACCEPT\n'
+            '-F INPUT\n'
+            '-A INPUT -i eth0 -g INPUT_eth0\n'
+            '-A INPUT -j DROP\n'
+            '-F INPUT_eth0_tcp\n'
+            '-X INPUT_eth0_tcp\n'
+            'COMMIT\n')
+        table.commit(restore=True)
+        self.assertEqual(table.list_chains(), ['INPUT', 'FORWARD', 'OUTPUT',
+            'custom', 'INPUT_eth0'])
+
+    def testExpectedCost(self):
+        packets = self.packets()
+        tree = build_tree('INPUT', rules, min_size=2, fanout=2)
+        self.assertTrue(expected_cost(tree, 'INPUT', packets) <
+            expected_cost({'INPUT': rules}, 'INPUT', packets))
+        self.assertEqual(expected_cost({'INPUT': rules}, 'INPUT', [
+            Packet(in_interface='lo')]), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+from netfilter.backend import FakeBackend
+from netfilter.index import ChainIndex
+from netfilter.rule import Rule
+from netfilter.table import IptablesError, Table
+
+def source(number):
+    return Rule(source='10.0.0.%d' % number, jump='DROP')
+
+class DeferredWorker:
+    # reports errors when waited for, like a RestoreWorker which has not
+    # read the outcome of a transaction yet
+    def __init__(self, worker):
+        self.worker = worker
+        self.error = None
+
+    def execute(self, table, commands):
+        try:
+            self.worker.execute(table, commands)
+        except IptablesError as e:
+            self.error = e
+
+    def wait(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+class DeferredBackend(FakeBackend):
+    def worker(self, command):
+        return DeferredWorker(FakeBackend.worker(self, command))
+
+class ChainIndexTestCase(unittest.TestCase):
+    def testPositions(self):
+        chain = ChainIndex([source(1), source(2), source(1)])
+        self.assertEqual(len(chain), 3)
+        self.assertEqual(chain.find(source(1)), 1)
+        self.assertEqual(chain.find(source(2)), 2)
+        self.assertEqual(chain.find(source(3)), None)
+
+        chain.insert(2, source(3))
+        chain.append(source(4))
+        self.assertEqual(chain.list_rules(), [source(1), source(3),
+            source(2), source(1), source(4)])
+        self.assertEqual(chain.find(source(4)), 5)
+
+        chain.delete(1)
+        self.assertEqual(chain.find(source(1)), 3)
+        chain.replace(3, source(5))
+        self.assertEqual(chain.find(source(1)), None)
+        self.assertEqual(chain.list_rules(), [source(3), source(2),
+            source(5), source(4)])
+
+    def testInsertRenumber(self):
+        chain = ChainIndex([source(0), source(1)])
+        # keep inserting at the same place until the keys run out
+        for number in range(2, 40):
+            chain.insert(2, source(number))
+        self.assertEqual(chain.list_rules(), [source(0)] +
+            [ source(number) for number in range(39, 1, -1) ] + [source(1)])
+        for number in range(2, 40):
+            self.assertEqual(chain.find(source(number)), 41 - number)
+
+    def testInvalid(self):
+        chain = ChainIndex([source(1)])
+        self.assertRaises(IndexError, chain.insert, 3, source(2))
+        self.assertRaises(IndexError, chain.replace, 2, source(2))
+        self.assertRaises(IndexError, chain.delete, 0)
+
+class IndexedTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.table = Table('filter', backend=self.backend, indexed=True)
+        for number in range(1, 6):
+            self.table.append_rule('INPUT', source(number))
+
+    def commands(self):
+        return [ cmd[cmd.index('-t') + 2:] for cmd in self.backend.commands
+            if cmd[0] == 'iptables' ]
+
+    def assertRules(self, table, rules):
+        self.assertEqual(table.rule_index().list_rules('INPUT'), rules)
+        table.reindex()
+        self.assertEqual(table.rule_index().list_rules('INPUT'), rules)
+
+    def testDelete(self):
+        table = self.table
+        del self.backend.commands[:]
+        table.delete_rule('INPUT', source(4))
+        table.delete_rule('INPUT', source(1))
+        self.assertEqual(self.commands(), [['-D', 'INPUT', '4'],
+            ['-D', 'INPUT', '1']])
+        self.assertRules(table, [source(2), source(3), source(5)])
+
+    def testDeleteUnknown(self):
+        table = self.table
+        index = table.rule_index()
+        del self.backend.commands[:]
+        self.assertRaises(IptablesError, table.delete_rule, 'INPUT',
+            source(9))
+        self.assertEqual(self.commands(), [['-D', 'INPUT', '-s', '10.0.0.9',
+            '-j', 'DROP']])
+        self.assertFalse(table.rule_index() is index)
+
+    def testInsertReplace(self):
+        table = self.table
+        del self.backend.commands[:]
+        table.insert_rule('INPUT', source(6), 3)
+        table.prepend_rule('INPUT', source(7))
+        table.replace_rule('INPUT', source(5), source(8))
+        self.assertEqual(self.commands(), [
+            ['-I', 'INPUT', '3', '-s', '10.0.0.6', '-j', 'DROP'],
+            ['-I', 'INPUT', '1', '-s', '10.0.0.7', '-j', 'DROP'],
+            ['-R', 'INPUT', '7', '-s', '10.0.0.8', '-j', 'DROP'],
+        ])
+        self.assertEqual(table.rule_position('INPUT', source(8)), 7)
+        self.assertRules(table, [source(7), source(1), source(2), source(6),
+            source(3), source(4), source(8)])
+        self.assertRaises(IptablesError, table.replace_rule, 'INPUT',
+            source(5), source(9))
+
+    def testChains(self):
+        table = self.table
+        table.create_chain('test')
+        table.append_rule('test', source(1))
+        self.assertEqual(table.rule_position('test', source(1)), 1)
+        table.flush_chain('test')
+        self.assertEqual(table.rule_position('test', source(1)), None)
+        table.delete_chain('test')
+        self.assertEqual(list(table.rule_index().chains.keys()),
+            ['INPUT', 'FORWARD', 'OUTPUT'])
+
+        index = table.rule_index()
+        table.create_chain('other')
+        table.rename_chain('other', 'renamed')
+        self.assertFalse(table.rule_index() is index)
+        self.assertEqual(list(table.rule_index().chains.keys()),
+            ['INPUT', 'FORWARD', 'OUTPUT', 'renamed'])
+
+    def testBuffered(self):
+        table = Table('filter', auto_commit=False, backend=self.backend,
+            indexed=True)
+        table.delete_rule('INPUT', source(2))
+        table.insert_rule('INPUT', source(6), 2)
+        table.delete_rule('INPUT', source(5))
+        self.assertEqual([ cmd[cmd.index('-t') + 2:]
+            for cmd in table.get_buffer() ], [
+            ['-D', 'INPUT', '2'],
+            ['-I', 'INPUT', '2', '-s', '10.0.0.6', '-j', 'DROP'],
+            ['-D', 'INPUT', '5'],
+        ])
+        index = table.rule_index()
+        table.commit(restore=True)
+        self.assertTrue(table.rule_index() is index)
+        self.assertRules(table, [source(1), source(6), source(3), source(4)])
+
+        table.append_rule('INPUT', source(7))
+        table.clear_buffer()
+        self.assertRules(table, [source(1), source(6), source(3), source(4)])
+
+    def testBufferedReindex(self):
+        table = Table('filter', auto_commit=False, backend=self.backend,
+            indexed=True)
+        table.insert_rule('INPUT', source(9), 1)
+        table.reindex()
+        # the buffered insertion is replayed onto the new index
+        table.delete_rule('INPUT', source(2))
+        self.assertEqual(table.get_buffer()[-1][-3:], ['-D', 'INPUT', '3'])
+        table.commit()
+        self.assertRules(table, [source(9), source(1), source(3), source(4),
+            source(5)])
+
+    def testBufferedRename(self):
+        self.table.create_chain('foo')
+        table = Table('filter', auto_commit=False, backend=self.backend,
+            indexed=True)
+        table.insert_rule('INPUT', source(9), 1)
+        table.rename_chain('foo', 'bar')
+        # the index cannot follow the rename until it is committed
+        self.assertEqual(table.rule_index(), None)
+        table.delete_rule('INPUT', source(2))
+        self.assertEqual(table.get_buffer()[-1][-6:], ['-D', 'INPUT', '-s',
+            '10.0.0.2', '-j', 'DROP'])
+        table.commit()
+        self.assertRules(table, [source(9), source(1), source(3), source(4),
+            source(5)])
+        self.assertEqual(table.rule_position('INPUT', source(3)), 3)
+
+    def testExecute(self):
+        table = self.table
+        table.execute(['-I', 'INPUT', '2', '-s', '10.0.0.6', '-j', 'DROP'])
+        table.execute(['-D', 'INPUT', '-s', '10.0.0.1', '-j', 'DROP'])
+        self.assertEqual(table.rule_position('INPUT', source(6)), 1)
+
+    def testDeferredError(self):
+        backend = DeferredBackend()
+        table = Table('filter', persistent=True, backend=backend,
+            indexed=True)
+        for number in range(1, 4):
+            table.append_rule('INPUT', source(number))
+        table.insert_rule('INPUT', Rule(source='10.0.0.4', jump='missing'),
+            2)
+        index = table.rule_index()
+        self.assertRaises(IptablesError, table.close)
+        self.assertFalse(table.rule_index() is index)
+        self.assertEqual(table.rule_position('INPUT', source(3)), 3)
+
+    def testUnindexed(self):
+        table = Table('filter', backend=self.backend)
+        self.assertEqual(table.rule_position('INPUT', source(3)), 3)
+        self.assertEqual(table.rule_position('INPUT', source(9)), None)
+        del self.backend.commands[:]
+        table.replace_rule('INPUT', source(3), source(9))
+        table.delete_rule('INPUT', source(9))
+        self.assertEqual(self.commands(), [
+            ['-R', 'INPUT', '3', '-s', '10.0.0.9', '-j', 'DROP'],
+            ['-D', 'INPUT', '-s', '10.0.0.9', '-j', 'DROP'],
+        ])
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import fcntl
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+import netfilter.instrument
+import netfilter.parser
+from netfilter.backend import FakeBackend, ProcessBackend
+from netfilter.instrument import Counters, LoggingSink
+from netfilter.rule import Rule
+from netfilter.table import IptablesError, Table
+
+dump = """*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+[1:60] -A INPUT -i lo -j ACCEPT
+[2:120] -A INPUT -p tcp -m tcp --dport 22 -j ACCEPT
+[0:0] -A OUTPUT -j ACCEPT
+COMMIT
+"""
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+class InstrumentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        netfilter.instrument.add_sink(self.events.append)
+
+    def tearDown(self):
+        netfilter.instrument.remove_sink(self.events.append)
+
+    def testCommands(self):
+        table = Table('filter', backend=FakeBackend(), netns='test')
+        table.append_rule('INPUT', Rule(jump='ACCEPT'))
+        self.assertRaises(IptablesError, table.append_rule, 'MISSING',
+            Rule(jump='ACCEPT'))
+        commands = [ event for event in self.events
+            if event['event'] == 'command' ]
+        self.assertEqual([ (event['binary'], event['table'],
+            event['netns'], event['lock_wait'], event['status'])
+            for event in commands ], [
+            ('iptables', 'filter', 'test', 0.0, 0),
+            ('iptables', 'filter', 'test', 0.0, 1),
+        ])
+        self.assertEqual(commands[0]['command'][:4],
+            ['ip', 'netns', 'exec', 'test'])
+        self.assertEqual(commands[0]['command'][-4:],
+            ['-A', 'INPUT', '-j', 'ACCEPT'])
+        for event in commands:
+            self.assertTrue(event['seconds'] >= 0)
+
+        del self.events[:]
+        table.commit(restore=True)
+        table.restore('*filter\n-A OUTPUT -j ACCEPT\nCOMMIT\n')
+        self.assertEqual([ (event['binary'], event['lock_wait'],
+            event['bytes']) for event in self.events ], [
+            ('iptables-restore', 0.0, 0)])
+
+    def testDump(self):
+        backend = FakeBackend()
+        table = Table('filter', backend=backend)
+        backend.run(['iptables-restore'], dump)
+        self.assertEqual(len(table.list_rules('INPUT')), 2)
+        self.assertEqual([ (event['event'], event.get('binary'),
+            event.get('function'), event.get('rules'))
+            for event in self.events ], [
+            ('command', 'iptables-save', None, None),
+            ('parse', None, 'list_rules', 2),
+        ])
+        self.assertEqual(self.events[0]['bytes'],
+            len(backend.run(['iptables-save', '-t', 'filter', '-c'])))
+
+        del self.events[:]
+        self.assertEqual(len(list(table.stream())), 6)
+        self.assertEqual([ (event['event'], event.get('binary'),
+            event.get('function'), event.get('rules'))
+            for event in self.events ], [
+            ('command', 'iptables-save', None, None),
+            ('parse', None, 'iterparse', 3),
+        ])
+
+    def testParser(self):
+        rules = netfilter.parser.parse_rules(dump, 'INPUT')
+        self.assertEqual(len(rules), 2)
+        event = self.events[-1]
+        self.assertEqual(event['function'], 'parse_rules')
+        self.assertEqual(event['rules'], 2)
+
+        rules = netfilter.parser.parse_rules(dump, chain='OUTPUT')
+        self.assertEqual(len(rules), 1)
+        self.assertEqual(self.events[-1]['rules'], 1)
+
+    def testDisabled(self):
+        netfilter.instrument.remove_sink(self.events.append)
+        try:
+            table = Table('filter', backend=FakeBackend())
+            table.append_rule('INPUT', Rule(jump='ACCEPT'))
+            table.list_rules('INPUT')
+            netfilter.parser.parse_rules(dump, chain='INPUT')
+            list(netfilter.parser.iterparse(dump.splitlines(True)))
+        finally:
+            netfilter.instrument.add_sink(self.events.append)
+        self.assertEqual(self.events, [])
+
+    def testStatus(self):
+        backend = ProcessBackend()
+        for cmd, status in [(['sh', '-c', 'exit 2'], 2),
+                            (['sh', '-c', 'kill -9 $$'], -9)]:
+            try:
+                netfilter.instrument.run(backend, cmd)
+            except IptablesError as e:
+                self.assertEqual(e.status, status)
+            else:
+                self.fail('%s did not fail' % cmd)
+            try:
+                list(netfilter.instrument.stream(backend, cmd))
+            except IptablesError as e:
+                self.assertEqual(e.status, status)
+            else:
+                self.fail('%s did not fail' % cmd)
+        self.assertEqual([ event['status'] for event in self.events ],
+            [2, 2, -9, -9])
+
+    def testWaitLock(self):
+        backend = ProcessBackend(lock_probe=0.05)
+        lockfile = tempfile.NamedTemporaryFile()
+        os.environ['XTABLES_LOCKFILE'] = lockfile.name
+        try:
+            self.assertTrue(0 <= backend.wait_lock() < 0.05)
+            self.assertEqual(ProcessBackend().wait_lock(), None)
+
+            # a held lock is only polled for lock_probe seconds
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            start = time.time()
+            self.assertEqual(backend.wait_lock(), None)
+            self.assertTrue(0.05 <= time.time() - start < 1)
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+            lockfile.close()
+            self.assertEqual(backend.wait_lock(), None)
+        finally:
+            del os.environ['XTABLES_LOCKFILE']
+
+class SinkTestCase(unittest.TestCase):
+    command = {
+        'event': 'command',
+        'command': ['iptables', '--wait', '-t', 'filter', '-F'],
+        'binary': 'iptables',
+        'table': 'filter',
+        'netns': None,
+        'seconds': 0.5,
+        'lock_wait': 0.25,
+        'status': 0,
+        'bytes': 10,
+    }
+    parse = {
+        'event': 'parse',
+        'function': 'list_rules',
+        'rules': 100,
+        'seconds': 0.5,
+        'rate': 200.0,
+    }
+
+    def testCounters(self):
+        counters = Counters()
+        counters(self.command)
+        counters(self.command)
+        counters(dict(self.command, status=None, lock_wait=None))
+        counters(self.parse)
+        self.assertEqual(counters.get('commands_total', binary='iptables',
+            status='0'), 2)
+        self.assertEqual(counters.get('commands_total', binary='iptables',
+            status='unknown'), 1)
+        self.assertEqual(counters.get('lock_wait_seconds_total',
+            binary='iptables'), 0.5)
+        self.assertEqual(counters.get('parsed_rules_total',
+            function='list_rules'), 100)
+        self.assertEqual(counters.get('parsed_rules_total',
+            function='iterparse'), 0)
+        self.assertEqual(counters.render(),
+            '# TYPE netfilter_commands_total counter\n'
+            'netfilter_commands_total{binary="iptables",status="0"} 2\n'
+            'netfilter_commands_total{binary="iptables",status="unknown"} 1\n'
+            '# TYPE netfilter_command_seconds_total counter\n'
+            'netfilter_command_seconds_total{binary="iptables"} 1.5\n'
+            '# TYPE netfilter_lock_wait_seconds_total counter\n'
+            'netfilter_lock_wait_seconds_total{binary="iptables"} 0.5\n'
+            '# TYPE netfilter_output_bytes_total counter\n'
+            'netfilter_output_bytes_total{binary="iptables"} 30\n'
+            '# TYPE netfilter_parsed_rules_total counter\n'
+            'netfilter_parsed_rules_total{function="list_rules"} 100\n'
+            '# TYPE netfilter_parse_seconds_total counter\n'
+            'netfilter_parse_seconds_total{function="list_rules"} 0.5\n')
+
+        counters.clear()
+        self.assertEqual(counters.render(), '')
+
+    def testLogging(self):
+        logger = logging.getLogger('netfilter.test_instrument')
+        logger.setLevel(logging.DEBUG)
+        handler = ListHandler()
+        logger.addHandler(handler)
+        try:
+            sink = LoggingSink(logger)
+            sink(self.command)
+            sink(self.parse)
+            sink.level = logging.NOTSET
+            sink(self.parse)
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual([ record.getMessage()
+            for record in handler.records ], [
+            'iptables --wait -t filter -F: 0.500000s, lock wait 0.250000s, '
+            'status 0, 10 bytes',
+            'list_rules: 100 rules in 0.500000s (200 rules/s)',
+        ])
+        self.assertTrue(handler.records[0].netfilter_event is self.command)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import OrderedDict
+
+import netfilter.instrument
+import netfilter.ipset
+import netfilter.parser
+from netfilter.backend import FakeBackend
+from netfilter.ipset import IpSet, compile_chain, compile_rules
+from netfilter.table import IptablesError
+
+# a fake ipset which logs its arguments and input, and fails on input
+# containing FAIL
+fake_ipset = """#!%s
+import sys
+data = sys.stdin.read()
+with open(%r, 'a') as log:
+    log.write(' '.join(sys.argv[1:]) + '\\n' + data)
+if 'FAIL' in data:
+    sys.stderr.write('ipset v7.1: Error in line 1\\n')
+    sys.exit(1)
+"""
+
+def parse(specs):
+    return [ netfilter.parser.parse_rule(spec) for spec in specs ]
+
+def specs(rules):
+    return [ ' '.join(rule.specbits()) for rule in rules ]
+
+class CompileTestCase(unittest.TestCase):
+    def testSource(self):
+        rules, sets = compile_chain(parse([
+            '-i lo -j ACCEPT'] + [
+            '-s 10.0.0.%d -p tcp -m tcp --dport 22 -j ACCEPT' % i
+            for i in range(1, 6) ] + [
+            '-s 10.0.1.0/24 -p tcp -m tcp --dport 22 -j ACCEPT',
+            '-s 10.0.0.1 -p tcp -m tcp --dport 22 -j ACCEPT',
+            '-j DROP',
+        ]), 'allow')
+        self.assertEqual(specs(rules), [
+            '-i lo -j ACCEPT',
+            '-p tcp -m tcp --dport 22 -m set --match-set allow1 src '
+            '-j ACCEPT',
+            '-j DROP'])
+        self.assertEqual(len(sets), 1)
+        self.assertEqual(sets[0].type, 'hash:net')
+        self.assertEqual(sets[0].family, 'inet')
+        self.assertEqual(sets[0].members, ['10.0.0.1', '10.0.0.2',
+            '10.0.0.3', '10.0.0.4', '10.0.0.5', '10.0.1.0/24'])
+
+    def testDestinationPorts(self):
+        rules, sets = compile_rules({
+            'INPUT': parse([
+                '-d 2001:db8::%d -j DROP' % i for i in range(1, 5) ]),
+            'FORWARD': parse([
+                '-p tcp -m multiport --dports 80,443 -j ACCEPT',
+                '-p tcp -m tcp --dport 22 -j ACCEPT',
+                '-p tcp -m tcp --dport 1000:2000 -j ACCEPT',
+                '-p tcp -m multiport --dports 8080 -j ACCEPT',
+            ]),
+        }, 'nf')
+        self.assertEqual(specs(rules['FORWARD']),
+            ['-p tcp -m set --match-set nf1 dst -j ACCEPT'])
+        self.assertEqual(specs(rules['INPUT']),
+            ['-m set --match-set nf2 dst -j DROP'])
+        self.assertEqual((sets[0].type, sets[0].members), ('bitmap:port',
+            ['80', '443', '22', '1000-2000', '8080']))
+        self.assertEqual(sets[1].family, 'inet6')
+
+    def testRulesUntouched(self):
+        rules = parse([ '-p tcp -m tcp --dport %d --syn -j ACCEPT' % port
+            for port in range(1, 5) ])
+        compiled, sets = compile_chain(rules, 'nf')
+        self.assertEqual(specs(compiled), ['-p tcp -m tcp --syn '
+            '-m set --match-set nf1 dst -j ACCEPT'])
+        # the given rules keep their frozen, cached rendering
+        for rule in rules:
+            self.assertTrue(rule.matches[0].spec() is rule.matches[0].spec())
+
+    def testOrderedChains(self):
+        rules, sets = compile_rules(OrderedDict([
+            ('OUTPUT', parse([ '-d 10.0.0.%d -j DROP' % i
+                for i in range(1, 5) ])),
+            ('INPUT', parse([ '-s 10.0.0.%d -j DROP' % i
+                for i in range(1, 5) ])),
+        ]), 'nf')
+        self.assertEqual(specs(rules['OUTPUT']),
+            ['-m set --match-set nf1 dst -j DROP'])
+        self.assertEqual(specs(rules['INPUT']),
+            ['-m set --match-set nf2 src -j DROP'])
+
+    def testUnchanged(self):
+        rules = parse([
+            # too short
+            '-s 10.0.0.1 -j ACCEPT',
+            '-s 10.0.0.2 -j ACCEPT',
+            # non-terminating target
+            '-s 10.0.0.1 -j LOG',
+            '-s 10.0.0.2 -j LOG',
+            '-s 10.0.0.3 -j LOG',
+            '-s 10.0.0.4 -j LOG',
+            # negated or different criteria
+            '! -s 10.0.0.1 -j DROP',
+            '! -s 10.0.0.2 -j DROP',
+            '-s 10.0.0.3 -j DROP',
+            '-s 10.0.0.4 -i eth0 -j DROP',
+            '-s 10.0.0.5 -j DROP',
+            '-s 10.0.0.6 -j REJECT',
+        ])
+        self.assertEqual(compile_chain(rules, 'allow'), (rules, []))
+        compiled, sets = compile_chain(rules, 'allow', min_size=2)
+        self.assertEqual(compiled[1:], rules[2:])
+        self.assertEqual(sets[0].members, ['10.0.0.1', '10.0.0.2'])
+
+    def testConsecutiveRuns(self):
+        rules, sets = compile_chain(parse([
+            '-s 10.0.0.1 -d 10.1.0.%d -j ACCEPT' % i for i in range(1, 4) ] +
+            [ '-s 10.0.0.%d -d 10.1.0.3 -j ACCEPT' % i for i in range(2, 7) ]),
+            'allow', min_size=3)
+        self.assertEqual(specs(rules), [
+            '-s 10.0.0.1 -m set --match-set allow1 dst -j ACCEPT',
+            '-d 10.1.0.3 -m set --match-set allow2 src -j ACCEPT'])
+        self.assertEqual([ len(ipset.members) for ipset in sets ], [3, 5])
+
+    def testName(self):
+        self.assertRaises(ValueError, IpSet, 'x' * 28, 'hash:net')
+
+class RestoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, 'log')
+        self.ipset = os.path.join(self.tmpdir, 'ipset')
+        with open(self.ipset, 'w') as fp:
+            fp.write(fake_ipset % (sys.executable, self.log))
+        os.chmod(self.ipset, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRestore(self):
+        netfilter.ipset.restore([
+            IpSet('allow', 'hash:net', ['10.0.0.1', '10.0.1.0/24']),
+            IpSet('ports', 'bitmap:port', ['22'],
+                options=['range', '0-65535']),
+        ], ipset=self.ipset)
+        with open(self.log) as fp:
+            self.assertEqual(fp.read(),
+                'restore\n'
+                'create allow hash:net family inet -exist\n'
+                'create allow-tmp hash:net family inet -exist\n'
+                'flush allow-tmp\n'
+                'add allow-tmp 10.0.0.1\n'
+                'add allow-tmp 10.0.1.0/24\n'
+                'swap allow-tmp allow\n'
+                'destroy allow-tmp\n'
+                'create ports bitmap:port range 0-65535 -exist\n'
+                'create ports-tmp bitmap:port range 0-65535 -exist\n'
+                'flush ports-tmp\n'
+                'add ports-tmp 22\n'
+                'swap ports-tmp ports\n'
+                'destroy ports-tmp\n')
+
+    def testRestoreBackend(self):
+        backend = FakeBackend()
+        events = []
+        netfilter.instrument.add_sink(events.append)
+        try:
+            for members in (['10.0.0.1', '10.0.0.2'], ['10.0.0.3']):
+                netfilter.ipset.restore([IpSet('allow', 'hash:net',
+                    members)], netns='test', backend=backend)
+        finally:
+            netfilter.instrument.remove_sink(events.append)
+        self.assertEqual(backend.get_ipset('allow', 'test'), ['10.0.0.3'])
+        self.assertEqual(backend.get_ipset('allow-tmp', 'test'), None)
+        self.assertEqual([ (event['binary'], event['netns'], event['status'])
+            for event in events ], [('ipset', 'test', 0)] * 2)
+        self.assertRaises(IptablesError, backend.run, ['ipset', 'restore'],
+            'add missing 10.0.0.1\n')
+
+    def testRestoreEmpty(self):
+        netfilter.ipset.restore([], ipset=self.ipset)
+        self.assertFalse(os.path.exists(self.log))
+
+    def testRestoreFailure(self):
+        try:
+            netfilter.ipset.restore([IpSet('allow', 'hash:net', ['FAIL'])],
+                ipset=self.ipset)
+        except IptablesError as e:
+            self.assertEqual(e.command, [self.ipset, 'restore'])
+            self.assertTrue('Error in line 1' in e.message)
+        else:
+            self.fail('IptablesError not raised')
+
+if __name__ == '__main__':
+    unittest.main()
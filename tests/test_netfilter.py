@@ -18,12 +18,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import io
 import unittest
 import logging
 
 import netfilter.table
+import netfilter.rule
 from netfilter.rule import Rule,Target,Match
 import netfilter.parser
+import netfilter.snapshot
+from netfilter.snapshot import TableSnapshot
 
 iptables_data = """# Generated by iptables-save v1.4.8 on Wed Sep 19 11:07:12 2012
 *filter
@@ -50,6 +54,35 @@ COMMIT
 # Completed on Wed Sep 19 11:07:13 2012
 """
 
+iptables_all_data = """# Generated by iptables-save v1.6.0 on Mon Jul 25 10:12:44 2016
+*raw
+:PREROUTING ACCEPT [1620:140381]
+:OUTPUT ACCEPT [1305:171532]
+[12:720] -A PREROUTING -p udp -m udp --dport 53 -j NOTRACK
+COMMIT
+# Completed on Mon Jul 25 10:12:44 2016
+# Generated by iptables-save v1.6.0 on Mon Jul 25 10:12:44 2016
+*mangle
+:PREROUTING ACCEPT [1620:140381]
+:INPUT ACCEPT [1620:140381]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [1305:171532]
+:POSTROUTING ACCEPT [1305:171532]
+[0:0] -A POSTROUTING -o eth0 -j TOS --set-tos 0x10/0x3f
+COMMIT
+# Completed on Mon Jul 25 10:12:44 2016
+# Generated by iptables-save v1.6.0 on Mon Jul 25 10:12:44 2016
+*nat
+:PREROUTING ACCEPT [10:600]
+:INPUT ACCEPT [2:120]
+:OUTPUT ACCEPT [23:1530]
+:POSTROUTING ACCEPT [23:1530]
+[5:300] -A PREROUTING -i eth1 -p tcp -m tcp --dport 80 -j REDIRECT --to-ports 3128
+[31:1860] -A POSTROUTING -o eth0 -j MASQUERADE
+COMMIT
+# Completed on Mon Jul 25 10:12:44 2016
+""" + iptables_data
+
 class ParserTestCase(unittest.TestCase):
     def testSplitWords(self):
         self.assertEqual(netfilter.parser.split_words('a b c'),
@@ -62,6 +95,59 @@ class ParserTestCase(unittest.TestCase):
         self.assertEqual(netfilter.parser.split_words(line),
             ['a', 'some text', 'b'])
 
+    def testSplitWordsEscaped(self):
+        line = 'a "say \\"hi\\"" "back\\\\slash" "end\\\\" b'
+        self.assertEqual(netfilter.parser.split_words(line),
+            ['a', 'say "hi"', 'back\\slash', 'end\\', 'b'])
+
+    def testJoinWords(self):
+        self.assertEqual(netfilter.parser.join_words(['a', 'b', 'c']),
+            'a b c')
+
+    def testJoinWordsQuoted(self):
+        bits = ['a', 'some text', '', 'say "hi"']
+        line = netfilter.parser.join_words(bits)
+        self.assertEqual(line, 'a "some text" "" "say \\"hi\\""')
+
+    def testJoinWordsRoundTrip(self):
+        bits = ['a', 'say "hi"', 'back\\slash', 'end\\', '', "it's"]
+        self.assertEqual(netfilter.parser.split_words(
+            netfilter.parser.join_words(bits)), bits)
+
+    def testFormatRuleRoundTrip(self):
+        rule = Rule(jump='ACCEPT', matches=[Match('comment',
+            {'comment': ['say "hi" \\ there']})])
+        line = netfilter.parser.format_rule('INPUT', rule)
+        self.assertEqual(line, '-A INPUT -m comment '
+            '--comment "say \\"hi\\" \\\\ there" -j ACCEPT')
+        self.assertEqual(netfilter.parser.parse_rule(line[len('-A INPUT '):]),
+            rule)
+
+    def testPullExtension(self):
+        bits = '--dports 22,80 ! --state NEW -j ACCEPT'.split()
+        options, pos = netfilter.parser.pull_extension(bits, 0)
+        self.assertEqual(options, {'dports': ['22,80', '!'], 'state': ['NEW']})
+        self.assertEqual(pos, 5)
+
+        bits = '! --state NEW --destination-port 22 -j ACCEPT'.split()
+        options, pos = netfilter.parser.pull_extension(bits, 0,
+            netfilter.rule.match_rewrite_options)
+        self.assertEqual(options, {'! state': ['NEW'], 'dport': ['22']})
+        self.assertEqual(pos, 5)
+
+    def testPullExtensionNegatedMainOption(self):
+        bits = '--state NEW ! -s 1.2.3.4'.split()
+        options, pos = netfilter.parser.pull_extension(bits, 0)
+        self.assertEqual(options, {'state': ['NEW']})
+        self.assertEqual(pos, 2)
+
+        rule = netfilter.parser.parse_rule('-m conntrack --ctstate NEW ! -s 1.2.3.4 -j DROP')
+        self.assertEqual(rule.source, '! 1.2.3.4')
+
+    def testPullExtensionInvalid(self):
+        self.assertRaises(netfilter.parser.ParseError,
+            netfilter.parser.pull_extension, ['foo'], 0)
+
     def testParseChains(self):
         chains = netfilter.parser.parse_chains(iptables_data)
 
@@ -79,6 +165,30 @@ class ParserTestCase(unittest.TestCase):
         self.assertEquals(chains['OUTPUT']['bytes'], 214582)
         self.assertEquals(chains['OUTPUT']['packets'], 1884)
 
+    def testParseTables(self):
+        tables = netfilter.parser.parse_tables(iptables_all_data)
+        self.assertEqual(tables.keys(), ['raw', 'mangle', 'nat', 'filter'])
+
+        chains, entries = tables['nat']
+        self.assertEqual(chains.keys(), ['PREROUTING', 'INPUT', 'OUTPUT', 'POSTROUTING'])
+        self.assertEqual(chains['PREROUTING'], {'policy': 'ACCEPT', 'packets': 10, 'bytes': 600})
+        self.assertEqual(entries['POSTROUTING'], [(31, 1860, '-o eth0 -j MASQUERADE')])
+
+        chains, entries = tables['filter']
+        self.assertEqual(chains, netfilter.parser.parse_chains(iptables_data))
+        self.assertEqual(len(entries['firewall_input_filter']), 11)
+
+    def testParseTablesLines(self):
+        lines = iter(iptables_all_data.encode('utf8').splitlines(True))
+        tables = netfilter.parser.parse_tables(lines)
+        self.assertEqual(tables.keys(), ['raw', 'mangle', 'nat', 'filter'])
+
+    def testParseTableNoHeader(self):
+        chains, entries = netfilter.parser.parse_table(
+            ':INPUT ACCEPT [0:0]\n[0:0] -A INPUT -j DROP\n')
+        self.assertEqual(chains.keys(), ['INPUT'])
+        self.assertEqual(entries, {'INPUT': [(0, 0, '-j DROP')]})
+
     def testParseRules(self):
         rules = netfilter.parser.parse_rules(iptables_data, 'INPUT')
         self.assertEquals(len(rules), 1)
@@ -91,6 +201,192 @@ class ParserTestCase(unittest.TestCase):
         rules = netfilter.parser.parse_rules(iptables_data, 'OUTPUT')
         self.assertEquals(rules, [])
 
+class ParseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        netfilter.parser.enable_cache(maxsize=2)
+
+    def tearDown(self):
+        netfilter.parser.disable_cache()
+
+    def testRule(self):
+        spec = '-p tcp -m tcp --dport 22 -m state --state NEW -j LOG --log-prefix "ssh "'
+        rule1 = netfilter.parser.parse_rule(spec)
+        rule2 = netfilter.parser.parse_rule(spec)
+        self.assertEqual(rule1, rule2)
+        self.assertEqual(rule1.specbits(), rule2.specbits())
+        self.assertFalse(rule1 is rule2)
+        self.assertFalse(rule1.matches[0] is rule2.matches[0])
+        self.assertEqual(netfilter.parser.rule_cache.stats(),
+            {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 2})
+
+        # modifying a returned rule does not alter the cache
+        rule2.matches[0].options()['dport'].append('80')
+        rule2.matches.pop()
+        rule2.source = '1.2.3.4'
+        self.assertEqual(netfilter.parser.parse_rule(spec), rule1)
+
+    def testEviction(self):
+        cache = netfilter.parser.rule_cache
+        netfilter.parser.parse_rule('-j ACCEPT')
+        netfilter.parser.parse_rule('-j DROP')
+        netfilter.parser.parse_rule('-j ACCEPT')
+        netfilter.parser.parse_rule('-j REJECT')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+        # DROP was the least recently used rule
+        netfilter.parser.parse_rule('-j DROP')
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+        netfilter.parser.parse_rule('-j REJECT')
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def testExtension(self):
+        cache = netfilter.parser.extension_cache
+        match1 = Match('tcp', '--destination-port 22')
+        match2 = Match('tcp', '--destination-port 22')
+        target = Target('tcp', '--destination-port 22')
+        self.assertEqual(match1.options(), {'dport': ['22']})
+        self.assertEqual(match2.options(), {'dport': ['22']})
+        self.assertFalse(match1.options() is match2.options())
+        self.assertEqual(target.options(), {'destination-port': ['22']})
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def testDisabled(self):
+        netfilter.parser.disable_cache()
+        self.assertEqual(netfilter.parser.rule_cache, None)
+        self.assertEqual(netfilter.parser.parse_rule('-j ACCEPT'), Rule(jump='ACCEPT'))
+
+class IterParseTestCase(unittest.TestCase):
+    def testEvents(self):
+        events = list(netfilter.parser.iterparse(iptables_data.splitlines(True)))
+        self.assertEqual(len(events), 19)
+        self.assertEqual(events[0], ('chain', 'filter', 'INPUT',
+            {'policy': 'DROP', 'packets': 556, 'bytes': 75796}))
+        self.assertEqual([ e[2] for e in events if e[0] == 'chain' ],
+            ['INPUT', 'FORWARD', 'OUTPUT', 'firewall_forward_filter', 'firewall_input_filter'])
+
+        event, table, chain, rule = events[5]
+        self.assertEqual((event, table, chain), ('rule', 'filter', 'INPUT'))
+        self.assertEqual(rule, Rule(jump='firewall_input_filter'))
+        self.assertEqual(rule.packets, 7480114)
+        self.assertEqual(rule.bytes, 987402857)
+
+    def testMatchesParseRules(self):
+        rules = [ e[3] for e in netfilter.parser.iterparse(
+            iptables_data.splitlines(True))
+            if e[0] == 'rule' and e[2] == 'firewall_input_filter' ]
+        self.assertEqual(rules,
+            netfilter.parser.parse_rules(iptables_data, 'firewall_input_filter'))
+
+    def testBytes(self):
+        data = iptables_data.encode('utf8')
+        self.assertEqual(len(list(netfilter.parser.iterparse(io.BytesIO(data)))), 19)
+
+    def testIncremental(self):
+        lines = iter(iptables_data.splitlines(True))
+        events = netfilter.parser.iterparse(lines)
+        self.assertEqual(next(events)[2], 'INPUT')
+        # only the lines up to the first chain have been consumed
+        self.assertEqual(next(lines), ':FORWARD DROP [204:11510]\n')
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = TableSnapshot('filter',
+            *netfilter.parser.parse_table(iptables_data))
+
+    def testListChains(self):
+        self.assertEqual(self.snapshot.list_chains(), ['INPUT', 'FORWARD', 'OUTPUT', 'firewall_forward_filter', 'firewall_input_filter'])
+
+    def testGetPolicy(self):
+        self.assertEqual(self.snapshot.get_policy('INPUT'), 'DROP')
+        self.assertEqual(self.snapshot.get_policy('firewall_input_filter'), None)
+        self.assertEqual(self.snapshot.get_chain('OUTPUT'),
+            {'policy': 'ACCEPT', 'packets': 1884, 'bytes': 214582})
+
+    def testListRules(self):
+        for chain in self.snapshot.list_chains():
+            self.assertEqual(self.snapshot.list_rules(chain),
+                netfilter.parser.parse_rules(iptables_data, chain))
+
+        rules = self.snapshot.list_rules('firewall_input_filter')
+        self.assertEqual(len(rules), 11)
+        self.assertEqual(rules[0].packets, 112148)
+        self.assertEqual(rules[0].bytes, 127429710)
+
+        # the returned list can be modified without altering the snapshot
+        del rules[:]
+        self.assertEqual(len(self.snapshot.list_rules('firewall_input_filter')), 11)
+
+    def testListEntries(self):
+        entries = self.snapshot.list_entries('FORWARD')
+        self.assertEqual(entries, [(759445591, 598252573508,
+            '-j firewall_forward_filter ')])
+        self.assertEqual(self.snapshot.list_entries('no_such_chain'), [])
+
+    def testListRulesUnknownChain(self):
+        self.assertEqual(self.snapshot.list_rules('no_such_chain'), [])
+
+    def testLoad(self):
+        snapshots = netfilter.snapshot.load(iptables_all_data)
+        self.assertEqual(snapshots.keys(), ['raw', 'mangle', 'nat', 'filter'])
+        self.assertEqual(snapshots['nat'].name, 'nat')
+        self.assertEqual(snapshots['nat'].list_rules('PREROUTING'), [
+            Rule(in_interface='eth1', protocol='tcp',
+                matches=[Match('tcp', '--dport 80')],
+                jump=Target('REDIRECT', '--to-ports 3128'))])
+        self.assertEqual(snapshots['raw'].get_policy('OUTPUT'), 'ACCEPT')
+        self.assertEqual(snapshots['filter'].list_chains(),
+            self.snapshot.list_chains())
+
+    def testDumpRoundTrip(self):
+        snapshots = netfilter.snapshot.load(iptables_all_data)
+        data = netfilter.snapshot.dump(snapshots, counters=True)
+        reloaded = netfilter.snapshot.load(data)
+        self.assertEqual(reloaded.keys(), snapshots.keys())
+        for name in snapshots.keys():
+            for chain in snapshots[name].list_chains():
+                self.assertEqual(reloaded[name].get_chain(chain),
+                    snapshots[name].get_chain(chain))
+                rules = snapshots[name].list_rules(chain)
+                self.assertEqual(reloaded[name].list_rules(chain), rules)
+                self.assertEqual([ (rule.packets, rule.bytes)
+                    for rule in reloaded[name].list_rules(chain) ],
+                    [ (rule.packets, rule.bytes) for rule in rules ])
+        self.assertEqual(netfilter.snapshot.dump(reloaded, counters=True), data)
+
+    def testDumpNoCounters(self):
+        data = netfilter.snapshot.dump([self.snapshot])
+        self.assertEqual(data.splitlines()[:7], [
+            '*filter',
+            ':INPUT DROP [0:0]',
+            ':FORWARD DROP [0:0]',
+            ':OUTPUT ACCEPT [0:0]',
+            ':firewall_forward_filter - [0:0]',
+            ':firewall_input_filter - [0:0]',
+            '-A INPUT -j firewall_input_filter'])
+        self.assertEqual(data.splitlines()[-1], 'COMMIT')
+        snapshot = netfilter.snapshot.load(data)['filter']
+        self.assertEqual(snapshot.list_rules('firewall_input_filter'),
+            self.snapshot.list_rules('firewall_input_filter'))
+
+    def testCreate(self):
+        rule = Rule(protocol='tcp', matches=[Match('tcp', '--dport 22')],
+            jump='ACCEPT')
+        rule.packets = 3
+        snapshot = netfilter.snapshot.create('filter', {
+            'INPUT': [rule, Rule(jump='LOG', matches=[Match('comment', '--comment "a b"')])],
+            'empty': [Rule()],
+        }, {'INPUT': 'DROP'})
+        data = netfilter.snapshot.dump([snapshot], counters=True)
+        self.assertEqual(data.splitlines()[:3], [
+            '*filter', ':INPUT DROP [0:0]', ':empty - [0:0]'])
+        self.assertTrue('[3:0] -A INPUT -p tcp -m tcp --dport 22 -j ACCEPT\n' in data)
+        self.assertTrue('[0:0] -A INPUT -m comment --comment "a b" -j LOG\n' in data)
+        self.assertTrue('[0:0] -A empty\n' in data)
+        reloaded = netfilter.snapshot.load(data)['filter']
+        self.assertEqual(reloaded.list_rules('INPUT'), snapshot.list_rules('INPUT'))
+        self.assertEqual(reloaded.list_rules('empty'), [Rule()])
+
 class TargetTestCase(unittest.TestCase):
     def testInit(self):
         target = Target('ACCEPT')
@@ -126,6 +422,37 @@ class TargetTestCase(unittest.TestCase):
         self.assertEqual(target1 == target2, False)
         self.assertEqual(target1 != target2, True)
 
+    def testOptionsModified(self):
+        target = Target('REDIRECT', '--to-ports 3128')
+        options = target.options()
+        self.assertTrue(target.options() is options)
+        options['to-ports'] = ['8080']
+        self.assertEqual(target.specbits(), ['--to-ports', '8080'])
+        self.assertEqual(target, Target('REDIRECT', '--to-ports 8080'))
+
+    def testSpecbitsCached(self):
+        target = Target('LOG', '! --foo bar --log-prefix "some prefix"')
+        self.assertEqual(target.specbits(),
+            ['!', '--foo', 'bar', '--log-prefix', 'some prefix'])
+        self.assertEqual(target.spec(), 'LOG ! --foo bar --log-prefix "some prefix"')
+
+        # the returned list belongs to the caller
+        target.specbits().append('--wiz')
+        self.assertEqual(len(target.specbits()), 5)
+
+        # modifying the options discards the cached arguments
+        target.options()['log-prefix'] = ['other']
+        self.assertEqual(target.spec(), 'LOG ! --foo bar --log-prefix other')
+        target.options()['log-level'] = ['4']
+        self.assertEqual(target.specbits(),
+            ['!', '--foo', 'bar', '--log-level', '4', '--log-prefix', 'other'])
+
+    def testHash(self):
+        target1 = Target('ACCEPT', '--foo bar --wiz bang')
+        target2 = Target('ACCEPT', '--wiz bang --foo bar')
+        self.assertEqual(hash(target1), hash(target2))
+        self.assertEqual(len(set([target1, target2, Target('ACCEPT')])), 2)
+
 class MatchTestCase(unittest.TestCase):
     def testRewriteSourcePort(self):
         match = Match('tcp', '--source-port 1234')
@@ -166,6 +493,11 @@ class RuleTestCase(unittest.TestCase):
         self.assertEqual(rule.jump.options(), {})
         self.assertEqual(rule.specbits(), ['-s', '192.168.1.2', '-j', 'ACCEPT'])
 
+    def testSourceIPv6(self):
+        rule = Rule(source='2001:db8::1/128', destination='2001:db8::/32')
+        self.assertEqual(rule.source, '2001:db8::1')
+        self.assertEqual(rule.destination, '2001:db8::/32')
+
     def testSourceNegated(self):
         rule = Rule(source='! 192.168.1.2', jump='ACCEPT')
         self.assertEqual(rule.protocol, None)
@@ -275,6 +607,73 @@ class RuleTestCase(unittest.TestCase):
         rule.matches.append(Match('tos', '--tos 0x10'))
         self.assertEqual(rule.specbits(), ['-m', 'tos', '--tos', '0x10', '-j', 'ACCEPT'])
 
+    def testHash(self):
+        rule1 = Rule(source='192.168.1.2/32', protocol='tcp',
+            matches=[Match('tcp', '--dport 80 --sport 1234')],
+            jump='ACCEPT')
+        rule2 = Rule(source='192.168.1.2', protocol='tcp',
+            matches=[Match('tcp', '--source-port 1234 --dport 80')],
+            jump=Target('ACCEPT'))
+        self.assertEqual(rule1, rule2)
+        self.assertEqual(hash(rule1), hash(rule2))
+        self.assertEqual(rule1.key(), rule2.key())
+
+    def testHashDifferent(self):
+        rules = set([
+            Rule(jump='ACCEPT'),
+            Rule(goto='ACCEPT'),
+            Rule(source='192.168.1.2', jump='ACCEPT'),
+            Rule(matches=[Match('state', '--state NEW')], jump='ACCEPT'),
+            Rule(matches=[Match('state', '! --state NEW')], jump='ACCEPT'),
+        ])
+        self.assertEqual(len(rules), 5)
+
+    def testExtraAttribute(self):
+        rule = Rule(jump='ACCEPT')
+        rule.comment = 'some comment'
+        self.assertEqual(rule.comment, 'some comment')
+        self.assertEqual(rule, Rule(jump='ACCEPT'))
+
+    def testSpecbitsModified(self):
+        rule = Rule(source='192.168.1.2', jump='ACCEPT')
+        self.assertEqual(rule.specbits(), ['-s', '192.168.1.2', '-j', 'ACCEPT'])
+        rule.source = '! 10.0.0.0/8'
+        rule.protocol = 'tcp'
+        rule.matches.append(Match('tcp', '--dport 22'))
+        rule.jump = 'DROP'
+        self.assertEqual(rule.specbits(), ['-p', 'tcp', '!', '-s',
+            '10.0.0.0/8', '-m', 'tcp', '--dport', '22', '-j', 'DROP'])
+        self.assertEqual(rule.spec(),
+            '-p tcp ! -s 10.0.0.0/8 -m tcp --dport 22 -j DROP')
+
+        # counters do not affect the rendering
+        rule.packets = 12
+        self.assertEqual(rule.spec(),
+            '-p tcp ! -s 10.0.0.0/8 -m tcp --dport 22 -j DROP')
+
+    def testSpec(self):
+        for chain in ['firewall_forward_filter', 'firewall_input_filter']:
+            for rule in netfilter.parser.parse_rules(iptables_data, chain):
+                self.assertEqual(rule.spec(),
+                    netfilter.parser.join_words(rule.specbits()))
+                self.assertEqual(netfilter.parser.parse_rule(rule.spec()),
+                    rule)
+        self.assertEqual(Rule().spec(), '')
+
+    def testFormatRules(self):
+        rules = netfilter.parser.parse_rules(iptables_data, 'firewall_forward_filter')
+        self.assertEqual(netfilter.parser.format_rules('firewall_forward_filter', rules, counters=True),
+            '[3323456:179228827] -A firewall_forward_filter -p tcp -m state --state NEW -m multiport --dports 22,80,443 -j ULOG --ulog-cprange 100 --ulog-prefix FORWARD --ulog-qthreshold 10\n')
+        self.assertEqual(netfilter.parser.format_rule('INPUT', Rule()),
+            '-A INPUT')
+
+    def testIndex(self):
+        rules = netfilter.parser.parse_rules(iptables_data, 'firewall_input_filter')
+        index = dict([ (rule, i) for i, rule in enumerate(rules) ])
+        rule = Rule(in_interface='eth1.171', protocol='udp',
+            matches=[Match('multiport', '--dports 53,67')], jump='ACCEPT')
+        self.assertEqual(index[rule], 8)
+
 class ParseRuleTestCase(unittest.TestCase):
     def testEmpty(self):
         rule = netfilter.parser.parse_rule('')
@@ -351,5 +750,184 @@ class BufferedTestCase(unittest.TestCase):
         buffer = table.get_buffer()
         self.assertEqual(buffer, [['iptables', '-t', 'test_table', '-A', 'test_chain', '-j', 'ACCEPT']])
 
+    def testRestorePayload(self):
+        table = netfilter.table.Table('test_table', False)
+        table.create_chain('test_chain')
+        table.append_rule('test_chain', Rule(
+            jump=Target('LOG', '--log-prefix "some prefix"')))
+        table.set_policy('INPUT', 'DROP')
+        self.assertEqual(table.get_restore_payload(),
+            '*test_table\n'
+            '-N test_chain\n'
+            '-A test_chain -j LOG --log-prefix "some prefix"\n'
+            '-P INPUT DROP\n'
+            'COMMIT\n')
+
+    def testRestorePayloadEmpty(self):
+        table = netfilter.table.Table('test_table', False)
+        self.assertEqual(table.get_restore_payload(), '')
+
+    def testClearBuffer(self):
+        table = netfilter.table.Table('test_table', False)
+        table.append_rule('test_chain', Rule(jump='ACCEPT'))
+        table.clear_buffer()
+        self.assertEqual(table.get_buffer(), [])
+
+def apply_commands(rules, commands):
+    """Applies rule-number based commands to a list of rule specs."""
+    rules = list(rules)
+    for args in commands:
+        pos = int(args[2]) - 1
+        if args[0] == '-D':
+            del rules[pos]
+        elif args[0] == '-I':
+            rules.insert(pos, tuple(args[3:]))
+        elif args[0] == '-R':
+            rules[pos] = tuple(args[3:])
+    return rules
+
+class DiffRulesTestCase(unittest.TestCase):
+    def assertDiff(self, current, desired, count):
+        current = [ Rule(source=x, jump='ACCEPT') for x in current ]
+        desired = [ Rule(source=x, jump='ACCEPT') for x in desired ]
+        commands = netfilter.table.diff_rules('test_chain', current, desired)
+        self.assertEqual(len(commands), count)
+        self.assertEqual(
+            apply_commands([ tuple(r.specbits()) for r in current ], commands),
+            [ tuple(r.specbits()) for r in desired ])
+
+    def testUnchanged(self):
+        self.assertDiff(['1.1.1.1', '2.2.2.2'], ['1.1.1.1', '2.2.2.2'], 0)
+
+    def testEmpty(self):
+        self.assertDiff([], ['1.1.1.1', '2.2.2.2'], 2)
+        self.assertDiff(['1.1.1.1', '2.2.2.2'], [], 2)
+
+    def testInsert(self):
+        self.assertDiff(['1.1.1.1', '3.3.3.3'], ['1.1.1.1', '2.2.2.2', '3.3.3.3', '4.4.4.4'], 2)
+
+    def testDelete(self):
+        self.assertDiff(['1.1.1.1', '2.2.2.2', '3.3.3.3', '4.4.4.4'], ['2.2.2.2', '4.4.4.4'], 2)
+
+    def testReplace(self):
+        self.assertDiff(['1.1.1.1', '2.2.2.2', '3.3.3.3'], ['1.1.1.1', '5.5.5.5', '6.6.6.6', '3.3.3.3'], 2)
+        self.assertDiff(['1.1.1.1', '2.2.2.2', '3.3.3.3', '4.4.4.4'], ['1.1.1.1', '5.5.5.5', '4.4.4.4'], 2)
+
+    def testLarge(self):
+        current = [ '10.0.%d.%d' % (i // 256, i % 256) for i in range(1000) ]
+        desired = current[:300] + ['192.168.0.1'] + current[301:900] + current[950:]
+        self.assertDiff(current, desired, 51)
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.commands = []
+        self.payloads = []
+
+    def fake_run(self, cmd, input=None):
+        if '--version' in cmd:
+            # pretend iptables does not support --wait
+            return 'iptables v1.4.8\n'
+        self.commands.append(cmd)
+        if input is not None:
+            self.payloads.append(input)
+        return iptables_data
+
+    def testUnchanged(self):
+        table = netfilter.table.Table('filter')
+        table._Table__run = self.fake_run
+        snapshot = table.snapshot()
+        desired = {}
+        for chain in snapshot.list_chains():
+            desired[chain] = snapshot.list_rules(chain)
+        policies = {'INPUT': 'DROP', 'OUTPUT': 'ACCEPT'}
+        self.assertEqual(table.sync(desired, policies), [])
+        self.assertEqual(self.payloads, [])
+
+    def testChanged(self):
+        table = netfilter.table.Table('filter')
+        table._Table__run = self.fake_run
+        desired = {
+            'INPUT': [Rule(in_interface='lo', jump='ACCEPT'),
+                Rule(jump='firewall_input_filter')],
+            'test_chain': [Rule(jump='DROP')],
+        }
+        policies = {'INPUT': 'DROP', 'OUTPUT': 'DROP'}
+        commands = table.sync(desired, policies)
+        self.assertEqual(commands, [
+            ['-N', 'test_chain'],
+            ['-I', 'INPUT', '1', '-i', 'lo', '-j', 'ACCEPT'],
+            ['-I', 'test_chain', '1', '-j', 'DROP'],
+            ['-P', 'OUTPUT', 'DROP']])
+        self.assertEqual(self.payloads, [
+            '*filter\n'
+            '-N test_chain\n'
+            '-I INPUT 1 -i lo -j ACCEPT\n'
+            '-I test_chain 1 -j DROP\n'
+            '-P OUTPUT DROP\n'
+            'COMMIT\n'])
+
+    def testRestoreFlush(self):
+        table = netfilter.table.Table('filter')
+        table._Table__run = self.fake_run
+        table.restore('*filter\nCOMMIT\n', flush=True, counters=True)
+        table.restore('*filter\nCOMMIT\n')
+        self.assertEqual(self.commands, [
+            ['iptables-restore', '--counters'],
+            ['iptables-restore', '--noflush']])
+
+    def testBuffered(self):
+        table = netfilter.table.Table('filter', False)
+        table._Table__run = self.fake_run
+        table.sync({'OUTPUT': [Rule(jump='ACCEPT')]})
+        self.assertEqual(table.get_buffer(), [
+            ['iptables', '-t', 'filter', '-I', 'OUTPUT', '1', '-j', 'ACCEPT']])
+
+class SnapshotCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.commands = []
+
+    def fake_run(self, cmd, input=None):
+        if '--version' in cmd:
+            # pretend iptables does not support --wait
+            return 'iptables v1.4.8\n'
+        self.commands.append(cmd)
+        return iptables_data
+
+    def testNoCache(self):
+        table = netfilter.table.Table('filter')
+        table._Table__run = self.fake_run
+        table.list_chains()
+        table.get_policy('INPUT')
+        table.list_rules('INPUT')
+        self.assertEqual(len(self.commands), 3)
+
+    def testCache(self):
+        table = netfilter.table.Table('filter', snapshot_ttl=60)
+        table._Table__run = self.fake_run
+        table.list_chains()
+        self.assertEqual(table.get_policy('INPUT'), 'DROP')
+        self.assertEqual(len(table.list_rules('INPUT')), 1)
+        self.assertEqual(self.commands, [['iptables-save', '-t', 'filter', '-c']])
+
+        # explicit invalidation
+        table.invalidate_snapshot()
+        table.list_chains()
+        self.assertEqual(len(self.commands), 2)
+
+    def testCacheExpired(self):
+        table = netfilter.table.Table('filter', snapshot_ttl=0)
+        table._Table__run = self.fake_run
+        table.list_chains()
+        table.list_chains()
+        self.assertEqual(len(self.commands), 2)
+
+    def testCacheInvalidatedByCommand(self):
+        table = netfilter.table.Table('filter', snapshot_ttl=60)
+        table._Table__run = self.fake_run
+        table.list_chains()
+        table.flush_chain('INPUT')
+        table.list_chains()
+        self.assertEqual(len(self.commands), 3)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import threading
+import time
+import unittest
+
+import netfilter.parallel
+from netfilter.firewall import Firewall
+from netfilter.rule import Rule
+from netfilter.table import IptablesError, Table
+
+class ParallelCommitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.commands = []
+
+    def table(self, name, netns=None, ipv6=False, delay=0):
+        def fake_run(cmd, input=None):
+            if '--version' in cmd:
+                return 'iptables v1.4.8\n'
+            time.sleep(delay)
+            with self.lock:
+                self.commands.append(cmd)
+            if 'FAIL' in cmd:
+                raise IptablesError(cmd, 'failed')
+            return ''
+
+        table = Table(name, auto_commit=False, ipv6=ipv6, netns=netns)
+        table._Table__run = fake_run
+        return table
+
+    def testNetns(self):
+        table = self.table('filter', netns='blue')
+        table.append_rule('INPUT', Rule(jump='ACCEPT'))
+        self.assertEqual(table.get_buffer(), [
+            ['ip', 'netns', 'exec', 'blue', 'iptables', '-t', 'filter',
+             '-A', 'INPUT', '-j', 'ACCEPT']])
+        self.assertEqual(table.get_restore_payload(),
+            '*filter\n-A INPUT -j ACCEPT\nCOMMIT\n')
+        self.assertEqual(repr(table), '<Table filter ipv4 netns=blue>')
+
+    def testCommit(self):
+        tables = []
+        for netns in ['blue', 'red', 'green']:
+            for name in ['filter', 'nat']:
+                table = self.table(name, netns=netns, delay=0.1)
+                table.flush_chain()
+                tables.append(table)
+        start = time.time()
+        timings = netfilter.parallel.commit(tables)
+        elapsed = time.time() - start
+
+        # namespaces, families and tables all run in parallel
+        self.assertTrue(elapsed < 0.3, elapsed)
+        self.assertEqual([ table for table, seconds in timings ], tables)
+        for table, seconds in timings:
+            self.assertTrue(seconds >= 0.1)
+            self.assertEqual(table.get_buffer(), [])
+        self.assertEqual(sorted([ (cmd[3], cmd[6])
+            for cmd in self.commands ]), [('blue', 'filter'),
+            ('blue', 'nat'), ('green', 'filter'), ('green', 'nat'),
+            ('red', 'filter'), ('red', 'nat')])
+
+    def testCommitRestore(self):
+        tables = [self.table('filter'), self.table('filter', ipv6=True)]
+        for table in tables:
+            table.set_policy('INPUT', 'DROP')
+        netfilter.parallel.commit(tables, restore=True, max_workers=1)
+        self.assertEqual(self.commands, [
+            ['iptables-restore', '--noflush'],
+            ['ip6tables-restore', '--noflush']])
+
+    def testCommitError(self):
+        tables = [self.table('filter', netns='blue'),
+            self.table('filter', netns='red'),
+            self.table('filter', netns='green')]
+        tables[0].create_chain('FAIL')
+        tables[1].create_chain('ok')
+        tables[2].create_chain('FAIL')
+        try:
+            netfilter.parallel.commit(tables)
+        except netfilter.parallel.CommitError as e:
+            self.assertEqual([ table for table, error in e.errors ],
+                [tables[0], tables[2]])
+            self.assertEqual(len(e.timings), 3)
+            self.assertTrue(str(e).startswith(
+                '<Table filter ipv4 netns=blue>: command: '))
+        else:
+            self.fail('CommitError not raised')
+        self.assertEqual(len(self.commands), 3)
+        self.assertEqual(tables[1].get_buffer(), [])
+
+    def testFirewall(self):
+        firewall = Firewall(auto_commit=False, netns='blue')
+        self.assertEqual([ repr(table) for table in firewall.get_tables() ],
+            ['<Table filter ipv4 netns=blue>', '<Table nat ipv4 netns=blue>'])
+
+if __name__ == '__main__':
+    unittest.main()
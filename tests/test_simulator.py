@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+import netfilter.parser
+import netfilter.simulator
+from netfilter.rule import Rule, Match
+from netfilter.simulator import Packet, Simulator, SimulatorError
+from netfilter.snapshot import TableSnapshot
+from tests.test_netfilter import iptables_data
+
+def parse(specs):
+    return [ netfilter.parser.parse_rule(spec) for spec in specs ]
+
+class SimulatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.simulator = Simulator({
+            'INPUT': parse([
+                '-i lo -j ACCEPT',
+                '-m state --state RELATED,ESTABLISHED -j ACCEPT',
+                '-s 10.0.0.0/8 -j trusted',
+                '-i eth+ -p tcp -m multiport --dports 80,443 -j ACCEPT',
+                '! -s 192.168.0.0/16 -p udp -m udp --dport 53 -j LOG',
+                '-p udp -m udp --dport 53 -j ACCEPT',
+                '-p tcp -m tcp --dport 1000:2000 -g ports',
+                '-j REJECT',
+            ]),
+            'trusted': parse([
+                '-p tcp -m tcp --dport 22 -j ACCEPT',
+                '-p tcp -m tcp ! --dport 22 -j RETURN',
+                '-j DROP',
+            ]),
+            'ports': parse([
+                '-p tcp -m tcp --dport 1500 -j ACCEPT',
+            ]),
+        }, {'INPUT': 'DROP', 'OUTPUT': 'ACCEPT'})
+
+    def evaluate(self, chain='INPUT', **kwargs):
+        verdict, path = self.simulator.evaluate(chain, Packet(**kwargs))
+        return verdict, [ (chainname, number)
+            for chainname, number, rule in path ]
+
+    def testInterface(self):
+        self.assertEqual(self.evaluate(in_interface='lo'),
+            ('ACCEPT', [('INPUT', 1)]))
+        self.assertEqual(self.evaluate(in_interface='eth1', protocol='tcp',
+            dport=443, state='NEW', source='1.2.3.4'),
+            ('ACCEPT', [('INPUT', 4)]))
+        self.assertEqual(self.evaluate(in_interface='ppp0', protocol='tcp',
+            dport=443, source='1.2.3.4'),
+            ('REJECT', [('INPUT', 8)]))
+
+    def testState(self):
+        self.assertEqual(self.evaluate(in_interface='eth0',
+            state='ESTABLISHED', protocol='tcp', dport=5000),
+            ('ACCEPT', [('INPUT', 2)]))
+
+    def testJumpReturn(self):
+        self.assertEqual(self.evaluate(source='10.1.2.3', protocol='tcp',
+            dport=22), ('ACCEPT', [('INPUT', 3), ('trusted', 1)]))
+        self.assertEqual(self.evaluate(source='10.1.2.3', protocol='tcp',
+            dport=80, in_interface='eth0'),
+            ('ACCEPT', [('INPUT', 3), ('trusted', 2), ('INPUT', 4)]))
+        self.assertEqual(self.evaluate(source='10.1.2.3', protocol='udp',
+            dport=53), ('DROP', [('INPUT', 3), ('trusted', 3)]))
+
+    def testNonTerminating(self):
+        self.assertEqual(self.evaluate(source='1.2.3.4', protocol='udp',
+            dport=53), ('ACCEPT', [('INPUT', 5), ('INPUT', 6)]))
+        self.assertEqual(self.evaluate(source='192.168.1.1', protocol='udp',
+            dport=53), ('ACCEPT', [('INPUT', 6)]))
+
+    def testRawTable(self):
+        simulator = Simulator({
+            'PREROUTING': parse([
+                '-p udp -m udp --dport 53 -j CT --notrack',
+                '-p udp -m udp --dport 53 -j DROP',
+                '-p tcp -j NOTRACK',
+            ]),
+        }, {'PREROUTING': 'ACCEPT'})
+        verdict, path = simulator.evaluate('PREROUTING',
+            Packet(protocol='udp', dport=53))
+        self.assertEqual((verdict, [ number for chain, number, rule in path ]),
+            ('DROP', [1, 2]))
+        verdict, path = simulator.evaluate('PREROUTING',
+            Packet(protocol='tcp', dport=80))
+        self.assertEqual((verdict, [ number for chain, number, rule in path ]),
+            ('ACCEPT', [3]))
+
+    def testGoto(self):
+        self.assertEqual(self.evaluate(protocol='tcp', dport=1500),
+            ('ACCEPT', [('INPUT', 7), ('ports', 1)]))
+        # falling off the end of a goto chain applies the policy
+        self.assertEqual(self.evaluate(protocol='tcp', dport=1501),
+            ('DROP', [('INPUT', 7)]))
+
+    def testPolicy(self):
+        self.assertEqual(self.evaluate('OUTPUT'), ('ACCEPT', []))
+        self.assertEqual(self.evaluate('ports', protocol='tcp', dport=1),
+            (None, []))
+
+    def testIPv6(self):
+        simulator = Simulator({'INPUT': parse([
+            '-s 2001:db8::/32 -p ipv6-icmp -j ACCEPT',
+            '-s 10.0.0.0/8 -j ACCEPT',
+        ])}, {'INPUT': 'DROP'})
+        self.assertEqual(simulator.evaluate('INPUT', Packet(
+            source='2001:db8::1', protocol='icmpv6'))[0], 'ACCEPT')
+        self.assertEqual(simulator.evaluate('INPUT', Packet(
+            source='2001:db9::1', protocol='icmpv6'))[0], 'DROP')
+        self.assertEqual(simulator.evaluate('INPUT', Packet(
+            source='::a00:1'))[0], 'DROP')
+
+    def testTcpFlags(self):
+        simulator = Simulator({'INPUT': parse([
+            '-p tcp -m tcp --tcp-flags FIN,SYN,RST,ACK SYN -j DROP',
+        ])}, {'INPUT': 'ACCEPT'})
+        self.assertEqual(simulator.evaluate('INPUT', Packet(
+            protocol='tcp', tcp_flags=['SYN']))[0], 'DROP')
+        self.assertEqual(simulator.evaluate('INPUT', Packet(
+            protocol='tcp', tcp_flags=['SYN', 'ACK']))[0], 'ACCEPT')
+
+    def testUnsupported(self):
+        self.assertRaises(SimulatorError, Simulator, {'INPUT': [
+            Rule(matches=[Match('recent', '--rcheck')], jump='DROP')]})
+        self.assertRaises(SimulatorError, Simulator, {'INPUT': [
+            Rule(matches=[Match('tcp', '--option 5')], jump='DROP')]})
+        self.assertRaises(TypeError, Packet, port=80)
+
+    def testCost(self):
+        # the rules walked through up to the verdict, in every chain
+        packets = [Packet(in_interface='lo'), Packet(source='10.1.2.3',
+            protocol='udp', dport=53), Packet(protocol='tcp', dport=1501)]
+        self.assertEqual(self.simulator.cost('INPUT', packets[:1]), 1)
+        self.assertEqual(self.simulator.cost('INPUT', packets[1:2]), 6)
+        self.assertEqual(self.simulator.cost('INPUT', packets[2:]), 8)
+        self.assertEqual(self.simulator.cost('INPUT', packets), 5)
+        self.assertEqual(self.simulator.cost('INPUT', []), 0)
+
+    def testLoop(self):
+        simulator = Simulator({'a': [Rule(jump='b')], 'b': [Rule(jump='a')]})
+        self.assertRaises(SimulatorError, simulator.evaluate, 'a', Packet())
+
+    def testFromSnapshot(self):
+        snapshot = TableSnapshot('filter',
+            *netfilter.parser.parse_table(iptables_data))
+        simulator = netfilter.simulator.from_snapshot(snapshot)
+        verdict, path = simulator.evaluate('INPUT', Packet(
+            in_interface='eth1.171', protocol='udp', dport=67,
+            state='NEW', source='192.168.1.10', destination='192.168.1.1'))
+        self.assertEqual(verdict, 'ACCEPT')
+        self.assertEqual([ (chain, number) for chain, number, rule in path ],
+            [('INPUT', 1), ('firewall_input_filter', 9)])
+        self.assertEqual(simulator.evaluate('FORWARD', Packet())[0], 'DROP')
+
+    def testIndexConsistency(self):
+        # the indexes must not change the outcome of a linear evaluation
+        snapshot = TableSnapshot('filter',
+            *netfilter.parser.parse_table(iptables_data))
+        simulator = netfilter.simulator.from_snapshot(snapshot)
+        packets = []
+        for interface in ['lo', 'eth0', 'eth1.171', None]:
+            for protocol in ['tcp', 'udp', 'icmp']:
+                for dport in [22, 53, 67, 80, 443, 9999]:
+                    for state in ['NEW', 'ESTABLISHED']:
+                        packets.append(Packet(in_interface=interface,
+                            protocol=protocol, dport=dport, state=state,
+                            source='192.168.1.10'))
+        indexed = [ simulator.evaluate('INPUT', packet)
+            for packet in packets ]
+        compiled = netfilter.simulator.CompiledChain
+        candidates = compiled.candidates
+        compiled.candidates = lambda self, packet: (1 << len(self.rules)) - 1
+        try:
+            linear = [ simulator.evaluate('INPUT', packet)
+                for packet in packets ]
+        finally:
+            compiled.candidates = candidates
+        self.assertEqual(indexed, linear)
+        self.assertEqual(len(set([ verdict for verdict, path in indexed ])), 2)
+
+if __name__ == '__main__':
+    unittest.main()
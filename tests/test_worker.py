@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# python-netfilter - Python modules for manipulating netfilter rules
+# Copyright (C) 2007-2012 Bolloré Telecom
+# Copyright (C) 2013-2016 Jeremy Lainé
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from netfilter.table import IptablesError
+from netfilter.worker import RestoreWorker
+
+# a fake iptables-restore which logs the lines it reads, and fails on
+# lines containing FAIL or when creating a chain called 'existing'. If
+# it read a line containing CRASH, it fails once its input is closed,
+# without saying which line failed.
+fake_restore = """
+import sys
+log = open(sys.argv[1], 'a')
+lineno = 0
+crash = False
+for line in iter(sys.stdin.readline, ''):
+    lineno += 1
+    if 'FAIL' in line:
+        sys.stderr.write('iptables-restore: line %d failed\\n' % lineno)
+        sys.exit(1)
+    crash = crash or 'CRASH' in line
+    if line == '-N existing\\n':
+        sys.stderr.write('iptables-restore: Chain already exists\\n'
+            'Error occurred at line: %d\\n' % lineno)
+        sys.exit(1)
+    log.write(line)
+    log.flush()
+if crash:
+    sys.stderr.write('iptables-restore: crashed\\n')
+    sys.exit(1)
+"""
+
+class RestoreWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        script = os.path.join(self.tmpdir, 'restore.py')
+        with open(script, 'w') as fp:
+            fp.write(fake_restore)
+        self.log = os.path.join(self.tmpdir, 'log')
+        self.worker = RestoreWorker([sys.executable, script, self.log])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def rules(self):
+        with open(self.log) as fp:
+            return [ line for line in fp.read().splitlines()
+                if line.startswith('-') ]
+
+    def testExecute(self):
+        self.worker.execute('filter', [['-A', 'INPUT', '-j', 'ACCEPT']])
+        self.worker.execute('filter', [['-A', 'INPUT', '-j', 'LOG',
+            '--log-prefix', 'some prefix']])
+        self.worker.execute('nat', [['-N', 'foo'], ['-A', 'foo', '-j', 'DROP']])
+        self.worker.wait()
+        self.assertEqual(self.rules(), [
+            '-A INPUT -j ACCEPT',
+            '-A INPUT -j LOG --log-prefix "some prefix"',
+            '-N foo',
+            '-A foo -j DROP'])
+        with open(self.log) as fp:
+            self.assertEqual(fp.read().count('COMMIT\n'), 3)
+
+    def testFailure(self):
+        self.worker.execute('filter', [['-A', 'INPUT', '-j', 'ACCEPT']])
+        try:
+            self.worker.execute('filter', [['-A', 'INPUT', '-j', 'FAIL']])
+            self.worker.execute('filter', [['-A', 'INPUT', '-j', 'DROP']])
+            self.worker.wait()
+        except IptablesError as e:
+            self.assertEqual(e.command, ['-A', 'INPUT', '-j', 'FAIL'])
+            self.assertTrue('line 5 failed' in e.message)
+        else:
+            self.fail('IptablesError not raised')
+
+        # the command following the failed one was sent again
+        self.worker.wait()
+        self.assertEqual(self.rules(), [
+            '-A INPUT -j ACCEPT',
+            '-A INPUT -j DROP'])
+
+    def testUnknownLine(self):
+        self.worker.execute('filter', [['-A', 'INPUT', '-j', 'ACCEPT']])
+        try:
+            self.worker.execute('filter', [['-A', 'INPUT', '-j', 'CRASH']])
+            self.worker.execute('filter', [['-A', 'INPUT', '-j', 'DROP']])
+            self.worker.wait()
+        except IptablesError as e:
+            self.assertTrue('crashed' in e.message)
+            self.assertTrue('failed at an unknown line, 3 transactions may '
+                'not have been applied' in e.message)
+        else:
+            self.fail('IptablesError not raised')
+
+        # nothing was sent again, as it may have been applied already
+        self.worker.wait()
+        self.assertEqual(self.rules(), [
+            '-A INPUT -j ACCEPT',
+            '-A INPUT -j CRASH',
+            '-A INPUT -j DROP'])
+
+    def testHistory(self):
+        # each transaction goes to a new process
+        self.worker.history_size = 1
+        self.worker.execute('filter', [['-A', 'INPUT', '-j', 'ACCEPT']])
+        self.worker.execute('filter', [['-A', 'INPUT', '-j', 'FAIL']])
+        try:
+            self.worker.execute('filter', [['-A', 'INPUT', '-j', 'DROP']])
+        except IptablesError as e:
+            self.assertEqual(e.command, ['-A', 'INPUT', '-j', 'FAIL'])
+            self.assertTrue('line 2 failed' in e.message)
+        else:
+            self.fail('IptablesError not raised')
+        self.worker.wait()
+        self.assertEqual(self.rules(), [
+            '-A INPUT -j ACCEPT',
+            '-A INPUT -j DROP'])
+
+    def testExistingChain(self):
+        self.worker.execute('filter', [['-N', 'existing']])
+        self.worker.execute('filter', [['-A', 'existing', '-j', 'DROP']])
+        self.worker.wait()
+        self.assertEqual(self.rules(), ['-A existing -j DROP'])
+
+    def testRestart(self):
+        self.worker.execute('filter', [['-A', 'INPUT', '-j', 'ACCEPT']])
+        self.worker.wait()
+        self.worker.execute('filter', [['-A', 'INPUT', '-j', 'DROP']])
+        self.worker.wait()
+        self.assertEqual(self.rules(), [
+            '-A INPUT -j ACCEPT',
+            '-A INPUT -j DROP'])
+
+if __name__ == '__main__':
+    unittest.main()